@@ -1,33 +1,48 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, current_app, request, jsonify, send_file, Response, g, has_request_context
 from flask_restful import Resource, Api
 from json import JSONEncoder
-from pymongo import MongoClient
-from bson import json_util, ObjectId
+from pymongo import MongoClient, monitoring
+from bson import json_util, ObjectId, Binary
+import bson
 from jsonschema import validate, ValidationError
 import pymongo
 import os
 import json
 from dotenv import load_dotenv
 from flask.json.provider import JSONProvider
+import click
 import re
-from bson import json_util
-
-
-# define regexps to select module ids, crateid, etc
+import atexit
+import collections
+import concurrent.futures
+import base64
+import datetime
+import gridfs
+import hashlib
+import hmac
+import io
+import queue
+import threading
+import time
+import urllib.parse
+
+
+def format_timestamp(timestamp):
+    """
+    Formats a datetime as ISO 8601 in UTC with a "Z" suffix, the format the clients send.
 
-def regExpPatterns(s):
-    mapRE = {"ModuleID": "PS_\\d+"}
-    if s in mapRE.keys():
-        return  mapRE[s]
-    else:
-        return None
+    Naive datetimes, as returned by MongoDB, are UTC.
+    """
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None).isoformat() + "Z"
 
-def findModuleIds(istring):
-    return re.findall(regExpPatterns("ModuleID"),istring)
 
 class CustomJSONEncoder(JSONEncoder):
     """
-    A custom JSON encoder that converts MongoDB ObjectIds to strings.
+    A custom JSON encoder that converts MongoDB ObjectIds to strings,
+    datetimes to ISO 8601 strings, binary data to base64 strings and stored
+    test arrays to nested lists.
 
     This encoder is used to ensure that MongoDB ObjectIds are properly serialized
     when returning JSON responses from a Flask REST API.
@@ -36,6 +51,12 @@ class CustomJSONEncoder(JSONEncoder):
     def default(self, obj):
         if isinstance(obj, ObjectId):
             return str(obj)
+        if isinstance(obj, datetime.datetime):
+            return format_timestamp(obj)
+        if isinstance(obj, bytes):
+            return base64.b64encode(obj).decode("ascii")
+        if isinstance(obj, StoredArray):
+            return obj.tolist()
         return super().default(self, obj)
 
 
@@ -45,17 +66,380 @@ class CustomJSONProvider(JSONProvider):
     """
 
     def dumps(self, obj, **kwargs):
-        return json.dumps(obj, **kwargs, cls=CustomJSONEncoder)
+        start = time.perf_counter()
+        dumped = json.dumps(obj, **kwargs, cls=CustomJSONEncoder)
+        query_profiler.add_serialization(time.perf_counter() - start)
+        return dumped
 
     def loads(self, s, **kwargs):
         return json.loads(s, **kwargs)
 
 
-app = Flask(__name__)
-api = Api(app)
-app.json = CustomJSONProvider(app)
+# ?explain=1 profiling: every command the request thread sends to MongoDB is
+# recorded by a command listener, then explained once the response is built
+
+# command fields that belong to the session, not to the query
+SESSION_FIELDS = {"lsid", "$clusterTime", "$db", "$readPreference", "txnNumber", "autocommit", "startTransaction"}
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "findAndModify"}
+
+
+class QueryProfiler(monitoring.CommandListener):
+    """
+    Command listener recording, per thread, the commands issued while a profile is active.
+
+    Cursor continuations (getMore) are folded into the command that opened the cursor.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def start(self):
+        self.local.commands = []
+        self.local.pending = {}
+        self.local.cursors = {}
+        self.local.serialization = 0.0
+
+    def stop(self):
+        """Stops recording; returns the recorded commands, in order, and the serialization time."""
+        commands = getattr(self.local, "commands", None)
+        self.local.commands = None
+        if commands is None:
+            return [], 0.0
+        return commands, self.local.serialization
+
+    def active(self):
+        return getattr(self.local, "commands", None) is not None
+
+    def add_serialization(self, seconds):
+        if self.active():
+            self.local.serialization += seconds
+
+    def started(self, event):
+        if not self.active():
+            return
+        if event.command_name == "getMore":
+            entry = self.local.cursors.get(event.command["getMore"])
+        else:
+            entry = {
+                "command": event.command_name,
+                "database": event.database_name,
+                "collection": event.command.get(event.command_name),
+                "spec": {k: v for k, v in event.command.items() if k not in SESSION_FIELDS},
+                "durationMs": 0.0,
+                "returned": 0,
+            }
+            self.local.commands.append(entry)
+        if entry is not None:
+            self.local.pending[event.request_id] = entry
+
+    def succeeded(self, event):
+        entry = self.local.pending.pop(event.request_id, None) if self.active() else None
+        if entry is None:
+            return
+        entry["durationMs"] += event.duration_micros / 1000
+        reply = event.reply
+        if "cursor" in reply:
+            batch = reply["cursor"].get("firstBatch", reply["cursor"].get("nextBatch", []))
+            entry["returned"] += len(batch)
+            if reply["cursor"].get("id"):
+                self.local.cursors[reply["cursor"]["id"]] = entry
+        elif "n" in reply:
+            entry["returned"] = reply["n"]
+        elif "values" in reply:
+            entry["returned"] = len(reply["values"])
+        elif "value" in reply:
+            entry["returned"] = int(reply["value"] is not None)
+
+    def failed(self, event):
+        entry = self.local.pending.pop(event.request_id, None) if self.active() else None
+        if entry is None:
+            return
+        entry["durationMs"] += event.duration_micros / 1000
+        entry["error"] = str(event.failure.get("errmsg", event.failure))
+
+
+query_profiler = QueryProfiler()
+
+
+# the routes are registered on bp, installed by create_app; every setting has
+# its default in DEFAULT_CONFIG, next to the code using it
+class LocalDBApi(Api):
+    """An Api answering the MongoDB timeouts of the resources with a 504, as for the routes."""
+
+    def handle_error(self, e):
+        if is_mongo_timeout(e):
+            return self.make_response(*mongo_timeout_response())
+        return super().handle_error(e)
+
+
+bp = Blueprint("localdb", __name__, cli_group=None)
+api = LocalDBApi(bp)
+DEFAULT_CONFIG = {}
+
+
+@api.representation("application/json")
+def output_json(data, code, headers=None):
+    """Serializes flask_restful responses with the app JSON provider, like jsonify."""
+    response = current_app.response_class(
+        current_app.json.dumps(data) + "\n", status=code, mimetype="application/json"
+    )
+    response.headers.extend(headers or {})
+    return response
+
+
+# admission control: the expensive routes are grouped, each group runs a bounded
+# number of requests at once and queues a bounded number of others; the rest
+# are refused with a 503 at once, so that the inserts of the stations always
+# find a free worker. Group: (running requests, waiting requests, MongoDB
+# time budget in seconds, None for no budget). The limits are for the whole
+# server: the counters live in each worker process, which enforces its share,
+# the limit divided by ADMISSION_WORKERS (WEB_CONCURRENCY, as set for
+# gunicorn) rounded up. A worker running one request at a time is bounded by
+# its worker count already, the limits only hold back threaded workers.
+DEFAULT_CONFIG["ADMISSION_LIMITS"] = {
+    "list": (4, 8, 10.0),
+    "search": (2, 4, 5.0),
+    "graph": (2, 4, 30.0),
+    "maintenance": (1, 0, None),
+}
+# seconds a queued request waits for a slot, and the Retry-After of a refusal
+DEFAULT_CONFIG["ADMISSION_WAIT_SECONDS"] = 2.0
+DEFAULT_CONFIG["ADMISSION_RETRY_AFTER"] = 1
+DEFAULT_CONFIG["ADMISSION_WORKERS"] = int(os.environ.get("WEB_CONCURRENCY", 1))
+
+ADMISSION_ROUTES = {
+    "SearchLogBookByText": "search",
+    "SearchLogBookByModuleIDs": "search",
+    "query_collection": "search",
+    "new_cabling_snapshot": "graph",
+    "cable_graph": "graph",
+    "validate_connectivity_route": "graph",
+    "import_cabling_map_route": "maintenance",
+    "rebuild_test_statistics": "maintenance",
+    "backfill_logbook_timestamps_route": "maintenance",
+    "backfill_involved_modules_route": "maintenance",
+    "rebuild_name_registry_route": "maintenance",
+    "rebuild_connection_snapshots_route": "maintenance",
+}
+# the resources whose listings (GET without a key) are limited; writes never are
+ADMISSION_RESOURCES = {
+    "modulesresource",
+    "logbookresource",
+    "testsresource",
+    "cablesresource",
+}
+
+
+class AdmissionLimit:
+    """
+    Bounds the requests running in a group of routes, with a bounded wait queue.
+
+    Args:
+        running (int): The requests allowed to run at once.
+        waiting (int): The requests allowed to wait for a free slot; the others are refused.
+    """
+
+    def __init__(self, running, waiting):
+        self.running = running
+        self.slots = threading.BoundedSemaphore(running)
+        self.waiting = waiting
+        self.queued = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, timeout):
+        """Takes a slot, waiting up to timeout seconds if the queue has room; False if refused."""
+        if self.slots.acquire(blocking=False):
+            return True
+        with self.lock:
+            if self.queued >= self.waiting:
+                return False
+            self.queued += 1
+        try:
+            return self.slots.acquire(timeout=timeout)
+        finally:
+            with self.lock:
+                self.queued -= 1
+
+    def release(self):
+        self.slots.release()
+
+
+def admission_group():
+    """The admission group of the current request, or None if it is not limited."""
+    endpoint = (request.endpoint or "").rpartition(".")[2]
+    if endpoint in ADMISSION_RESOURCES:
+        return "list" if request.method == "GET" and not request.view_args else None
+    return ADMISSION_ROUTES.get(endpoint)
+
+
+def busy_response(message):
+    return {"message": message}, 503, {"Retry-After": str(current_app.config["ADMISSION_RETRY_AFTER"])}
+
+
+def is_mongo_timeout(e):
+    return isinstance(e, pymongo.errors.PyMongoError) and e.timeout
+
+
+def mongo_timeout_response():
+    # unlike a refusal, the request ran: a write may have been applied, so no
+    # Retry-After and a distinct status, which clients do not retry blindly
+    message = "the database did not answer within the time budget of the request, a write may have been applied"
+    return {"message": message, "outcome": "unknown"}, 504
+
+
+@bp.before_app_request
+def admit_request():
+    group = admission_group()
+    limit = current_app.extensions["localdb_admission"].get(group)
+    if limit is None:
+        return None
+    if not limit.acquire(current_app.config["ADMISSION_WAIT_SECONDS"]):
+        return busy_response(f"too many concurrent {group} requests, retry later")
+    g.admission = limit
+    seconds = current_app.config["ADMISSION_LIMITS"][group][2]
+    if seconds:
+        # every MongoDB operation of the request gets the remaining budget as maxTimeMS
+        g.mongo_timeout = pymongo.timeout(seconds)
+        g.mongo_timeout.__enter__()
+
+
+@bp.teardown_app_request
+def release_request(exc):
+    timeout = g.pop("mongo_timeout", None)
+    if timeout is not None:
+        timeout.__exit__(None, None, None)
+    limit = g.pop("admission", None)
+    if limit is not None:
+        limit.release()
+
+
+@bp.app_errorhandler(pymongo.errors.PyMongoError)
+def handle_mongo_error(e):
+    if is_mongo_timeout(e):
+        return mongo_timeout_response()
+    raise e
+
+
+DEFAULT_CONFIG["ADMIN_TOKEN"] = os.environ.get("LOCALDB_ADMIN_TOKEN")
+
+# endpoints accepting ?explain=1: the resources (GET only), the searches and the snapshot
+EXPLAIN_RESOURCES = {
+    "modulesresource",
+    "logbookresource",
+    "testsresource",
+    "testpayloadsresource",
+    "cablesresource",
+    "cratesresource",
+    "cabletemplatesresource",
+}
+EXPLAIN_ROUTES = {
+    "SearchLogBookByText",
+    "SearchLogBookByModuleIDs",
+    "query_collection",
+    "new_cabling_snapshot",
+    "suggest_modules",
+}
+
+
+def is_admin():
+    """True if the request carries the admin token (X-Admin-Token); never if none is configured."""
+    token = current_app.config["ADMIN_TOKEN"]
+    return bool(token) and hmac.compare_digest(request.headers.get("X-Admin-Token", ""), token)
+
+
+def explain_command(entry):
+    """
+    Runs explain (executionStats) on a recorded read command.
+
+    Returns:
+        dict: The winning plan, the number of documents and index keys examined and
+        the server execution time, or the explain error.
+    """
+    try:
+        result = db.client[entry["database"]].command({"explain": entry["spec"], "verbosity": "executionStats"})
+    except pymongo.errors.PyMongoError as e:
+        return {"explainError": str(e)}
+    planner = result.get("queryPlanner", {})
+    stats = result.get("executionStats", {})
+    if not planner and result.get("stages"):
+        # aggregations report the plan of their initial $cursor stage
+        cursor = result["stages"][0].get("$cursor", {})
+        planner = cursor.get("queryPlanner", {})
+        stats = cursor.get("executionStats", {})
+    return {
+        "plan": planner.get("winningPlan"),
+        "docsExamined": stats.get("totalDocsExamined"),
+        "keysExamined": stats.get("totalKeysExamined"),
+        "executionTimeMillis": stats.get("executionTimeMillis"),
+    }
+
+
+@bp.before_app_request
+def start_explain():
+    if request.args.get("explain") != "1":
+        return None
+    endpoint = (request.endpoint or "").rpartition(".")[2]
+    if endpoint in EXPLAIN_RESOURCES:
+        if request.method != "GET":
+            return None
+    elif endpoint not in EXPLAIN_ROUTES:
+        return None
+    if not is_admin():
+        return {"message": "explain requires the admin token"}, 403
+    g.explain_start = time.perf_counter()
+    query_profiler.start()
+
+
+@bp.after_app_request
+def finish_explain(response):
+    """
+    Wraps the response of an explained request as {"result": ..., "explain": ...}.
+
+    The explain part lists every command issued (with its plan for reads),
+    the documents examined vs returned and the time spent in the database,
+    in Python and serializing the response, in milliseconds.
+    """
+    start = g.pop("explain_start", None)
+    if start is None:
+        return response
+    total = (time.perf_counter() - start) * 1000
+    commands, serialization = query_profiler.stop()
+    serialization *= 1000
+    db_time = sum(entry["durationMs"] for entry in commands)
+    for entry in commands:
+        if entry["command"] in EXPLAINABLE_COMMANDS and "error" not in entry:
+            entry.update(explain_command(entry))
+    examined = [entry["docsExamined"] for entry in commands if entry.get("docsExamined") is not None]
+    explain = {
+        # extended JSON, the specs can hold regexes and other BSON types
+        "commands": json.loads(json_util.dumps(commands)),
+        "docsExamined": sum(examined),
+        "returned": sum(entry["returned"] for entry in commands if entry["command"] in EXPLAINABLE_COMMANDS),
+        "timings": {
+            "totalMs": total,
+            "dbMs": db_time,
+            "pythonMs": max(total - db_time - serialization, 0.0),
+            "serializationMs": serialization,
+        },
+    }
+    body = response.get_json(silent=True) if response.is_json else None
+    wrapped = jsonify({"result": body, "explain": explain})
+    wrapped.status_code = response.status_code
+    return wrapped
+
+
+@bp.teardown_app_request
+def stop_explain(exc):
+    # a request that failed never reaches finish_explain
+    g.pop("explain_start", None)
+    query_profiler.stop()
+
+# the schemas and the settings are found relative to this file, so that the
+# API can be imported from any directory
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
 # Load the schema
-with open("../schemas/all_schemas.json", "r") as f:
+with open(os.path.join(BASE_DIR, "schemas", "all_schemas.json"), "r") as f:
     all_schemas = json.load(f)
 
 module_schema = all_schemas["module"]
@@ -67,26 +451,912 @@ cables_schema = all_schemas["cables"]
 cable_templates_schema = all_schemas["cable_templates"]
 testpayload_schema = all_schemas["testpayload"]
 
-load_dotenv("../config/mongo.env")
+load_dotenv(os.path.join(BASE_DIR, "config", "mongo.env"))
 username = os.environ.get("MONGO_USERNAME")
 password = os.environ.get("MONGO_PASSWORD")
-db_name = os.environ.get("MONGO_DB_NAME")
 host_name = os.environ.get("MONGO_HOST_NAME")
+DEFAULT_CONFIG["MONGO_URI"] = os.environ.get("MONGO_URI", f"mongodb://{username}:{password}@{host_name}:27017")
+DEFAULT_CONFIG["MONGO_DB_NAME"] = os.environ.get("MONGO_DB_NAME")
+
+
+class LazyDatabase:
+    """
+    The MongoDB database of the API, connected on first use.
+
+    Importing the module or creating an app does not touch the network: the
+    client is created by the first query, with the settings given to configure.
+    Attribute and item access are forwarded to the pymongo Database.
+    """
+
+    def __init__(self, uri, name):
+        self.lock = threading.Lock()
+        self._client = None
+        self._database = None
+        self.generation = 0
+        self.configure(uri, name)
+
+    def configure(self, uri, name):
+        """Sets the connection settings; a client already open is closed."""
+        with self.lock:
+            if self._client is not None:
+                self._client.close()
+            self.uri = uri
+            self.name = name
+            self._client = None
+            self._database = None
+            self.generation += 1
+
+    @property
+    def database(self):
+        if self._database is None:
+            with self.lock:
+                if self._database is None:
+                    self._client = MongoClient(self.uri, event_listeners=[query_profiler])
+                    self._database = self._client[self.name]
+        return self._database
+
+    @property
+    def client(self):
+        return self.database.client
+
+    def __getitem__(self, name):
+        return self.database[name]
+
+    def __getattr__(self, name):
+        return getattr(self.database, name)
+
+
+class LazyProxy:
+    """Forwards attribute access to an object created from db on first use, and again after db.configure."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._target = None
+        self._generation = None
+
+    def __getattr__(self, name):
+        if self._generation != db.generation:
+            self._target = self._factory(db.database)
+            self._generation = db.generation
+        return getattr(self._target, name)
+
+
+def lazy_collection(name):
+    return LazyProxy(lambda database: database[name])
+
+
+db = LazyDatabase(DEFAULT_CONFIG["MONGO_URI"], DEFAULT_CONFIG["MONGO_DB_NAME"])
+modules_collection = lazy_collection("modules")
+logbook_collection = lazy_collection("logbook")
+current_cabling_map_collection = lazy_collection("current_cabling_map")
+connection_snapshot_collection = lazy_collection("connection_snapshot")
+tests_collection = lazy_collection("tests")
+cables_collection = lazy_collection("cables")
+cable_templates_collection = lazy_collection("cable_templates")
+crates_collection = lazy_collection("crates")
+testpayload_collection = lazy_collection("testpayloads")
+changes_collection = lazy_collection("changes")
+counters_collection = lazy_collection("counters")
+name_registry_collection = lazy_collection("name_registry")
+payload_files_bucket = LazyProxy(lambda database: gridfs.GridFSBucket(database, bucket_name="payload_files"))
+payload_files_collection = lazy_collection("payload_files.files")
+test_rollups_collection = lazy_collection("test_rollups")
+backfill_jobs_collection = lazy_collection("backfill_jobs")
+
+
+def ensure_indexes():
+    """Creates the indexes used by the API (a no-op for the existing ones)."""
+    modules_collection.create_index("moduleID")
+    modules_collection.create_index("status")
+    modules_collection.create_index("position")
+    tests_collection.create_index("testID")
+    tests_collection.create_index("testType")
+    tests_collection.create_index("testStatus")
+    tests_collection.create_index("modules_list")
+    cables_collection.create_index("name")
+    cables_collection.create_index("type")
+    crates_collection.create_index("name")
+    cable_templates_collection.create_index("type")
+    changes_collection.create_index("seq", unique=True)
+    connection_snapshot_collection.create_index([("First", 1), ("StartingSide", 1)], unique=True)
+    connection_snapshot_collection.create_index("Chain")
+    name_registry_collection.create_index("name", unique=True)
+    logbook_collection.create_index([("station", 1), ("timestamp", 1), ("_id", 1)])
+    logbook_collection.create_index([("timestamp", 1), ("_id", 1)])
+    # a file name is unique per payload; the index was first created without unique
+    old = payload_files_collection.index_information().get("metadata.payload_1_filename_1")
+    if old and not old.get("unique"):
+        payload_files_collection.drop_index("metadata.payload_1_filename_1")
+    payload_files_collection.create_index([("metadata.payload", 1), ("filename", 1)], unique=True)
+    index_prefixes_cache.clear()
+
+
+# first field of every index, per collection, refreshed every INDEX_CACHE_SECONDS
+index_prefixes_cache = {}
+INDEX_CACHE_SECONDS = 60
+DEFAULT_CONFIG["ENSURE_INDEXES"] = True
+
+
+@bp.before_app_request
+def ensure_indexes_once():
+    # on the first request rather than at startup, which needs no connection;
+    # once per app and database, db.configure() moves to another database
+    ensured = current_app.extensions.get("localdb_indexes_ensured")
+    if ensured != db.generation and current_app.config["ENSURE_INDEXES"]:
+        ensure_indexes()
+        current_app.extensions["localdb_indexes_ensured"] = db.generation
+
+
+# change feed: every write handler records (seq, collection, op, key) so that
+# clients can sync incrementally through /changes?since=<seq>
+
+# a seq is allocated before its change is inserted, so a concurrent writer can
+# make seq N + 1 visible before N: /changes never hands out a token past a
+# missing seq, unless the change after it is older than this many seconds
+# (the writer of N is then taken to have failed)
+DEFAULT_CONFIG["CHANGES_GAP_SECONDS"] = float(os.environ.get("CHANGES_GAP_SECONDS", 30))
+
+CHANGE_FEED_COLLECTIONS = {
+    "modules": (modules_collection, "moduleID"),
+    "logbook": (logbook_collection, "_id"),
+    "tests": (tests_collection, "testID"),
+    "cables": (cables_collection, "name"),
+    "crates": (crates_collection, "name"),
+    "cable_templates": (cable_templates_collection, "type"),
+}
+
+
+def next_sequence(name, n=1):
+    """
+    Atomically allocates n consecutive values of the named counter.
+
+    Args:
+        name (str): The name of the counter.
+        n (int, optional): How many values to allocate. Defaults to 1.
+
+    Returns:
+        int: The last allocated value; the allocated range is [last - n + 1, last].
+    """
+    counter = counters_collection.find_one_and_update(
+        {"_id": name},
+        {"$inc": {"seq": n}},
+        upsert=True,
+        return_document=pymongo.ReturnDocument.AFTER,
+    )
+    return counter["seq"]
+
+
+def record_changes(collection_name, op, keys, fields=None):
+    """
+    Appends one entry per key to the change feed.
+
+    The entries carry the origin of the write, the X-Station header of the
+    request if any. The caches of the collection are invalidated. Writes to cables, modules
+    and crates also update the name registry when a name may have changed,
+    and refresh the materialized connection snapshots passing through them
+    when a connection may have changed; template writes mark all of them stale.
+
+    Args:
+        collection_name (str): One of the keys of CHANGE_FEED_COLLECTIONS.
+        op (str): "insert", "update" or "delete".
+        keys (list): The natural keys (moduleID, name, ...) of the written documents.
+        fields (iterable, optional): The top-level fields an update wrote, None if unknown.
+    """
+    keys = [str(k) if isinstance(k, ObjectId) else k for k in keys]
+    if not keys:
+        return
+    last = next_sequence("changes", len(keys))
+    first = last - len(keys) + 1
+    now = datetime.datetime.now(datetime.timezone.utc)
+    origin = request.headers.get("X-Station") if has_request_context() else None
+    changes_collection.insert_many(
+        [
+            {
+                "seq": first + i,
+                "collection": collection_name,
+                "op": op,
+                "key": key,
+                "time": now,
+                "origin": origin,
+            }
+            for i, key in enumerate(keys)
+        ]
+    )
+    for cache in CACHES_BY_COLLECTION.get(collection_name, []):
+        cache.invalidate()
+    if collection_name in NAME_REGISTRY_COLLECTIONS:
+        fields = None if fields is None else {field.split(".")[0] for field in fields}
+        if fields is None or fields & NAME_FIELDS:
+            sync_name_registry(collection_name, keys)
+        if fields is None or fields & CONNECTION_FIELDS:
+            refresh_connection_snapshots(keys)
+    elif collection_name == "cable_templates":
+        connection_snapshot_collection.update_many({}, {"$set": {"stale": True}})
+
+
+def record_change(collection_name, op, key):
+    record_changes(collection_name, op, [key])
+
+
+# the fields of modules, crates and cables that the name registry and the
+# connection snapshots depend on: updates of other fields skip them
+NAME_FIELDS = {"moduleID", "name"}
+CONNECTION_FIELDS = NAME_FIELDS | {"type", "connectedTo", "detSide", "crateSide"}
+
+
+def updated_keys(key, updated_data, key_field):
+    """Returns the keys touched by an update: the old one and, if renamed, the new one."""
+    new_key = updated_data.get(key_field, key)
+    return [key] if new_key == key else [key, new_key]
+
+
+# read-through caches of small, rarely written collections: each process keeps
+# them in memory; writers bump a version counter so that all processes reload
+
+DEFAULT_CONFIG["CACHE_TTL_SECONDS"] = float(os.environ.get("CACHE_TTL_SECONDS", 300))
+DEFAULT_CONFIG["CACHE_VERSION_CHECK_SECONDS"] = float(os.environ.get("CACHE_VERSION_CHECK_SECONDS", 1))
+
+
+class ReadThroughCache:
+    """
+    An in-memory copy of data loaded from MongoDB, shared by the requests of a process.
+
+    The data is reloaded when it is older than ttl or when its version, the
+    "cache:<name>" counter, has changed; the version is read at most every
+    version_check seconds, which bounds how long another process can serve
+    data older than a write (0 checks on every read). The cached data must
+    not be modified by the readers.
+
+    Args:
+        name (str): The name of the cache, used for its version counter.
+        loader (callable): Returns the data.
+    """
+
+    def __init__(self, name, loader, ttl, version_check):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.version_check = version_check
+        # lock guards the fields and is only held briefly; load_lock lets one
+        # request at a time reload, without blocking clear
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.generation = 0
+        self.clear()
+
+    def clear(self):
+        """Drops the local copy only; a load already running is not stored."""
+        with self.lock:
+            self.value = None
+            self.version = None
+            self.loaded = 0.0
+            self.checked = 0.0
+            self.generation += 1
+
+    def get(self):
+        now = time.monotonic()
+        fresh = now - self.checked < self.version_check and now - self.loaded < self.ttl
+        value = self.value
+        if value is not None and fresh:
+            return value
+        with self.load_lock:
+            counter = counters_collection.find_one({"_id": f"cache:{self.name}"})
+            version = counter["seq"] if counter else 0
+            with self.lock:
+                generation = self.generation
+                value = self.value
+                stale = value is None or version != self.version or now - self.loaded >= self.ttl
+                if not stale:
+                    self.checked = now
+                    return value
+            # the version is read before loading: a write in between reloads again next time
+            value = self.loader()
+            with self.lock:
+                # cleared while loading: the data may predate the write, keep it out of the cache
+                if generation == self.generation:
+                    self.value = value
+                    self.version = version
+                    self.loaded = now
+                    self.checked = now
+            return value
+
+    def invalidate(self):
+        """Drops the local copy and makes every other process reload at its next version check."""
+        next_sequence(f"cache:{self.name}")
+        self.clear()
+
+
+def load_crates():
+    crates = list(crates_collection.find())
+    return {
+        "by_name": {crate.get("name"): crate for crate in crates},
+        "by_id": {str(crate["_id"]): crate for crate in crates},
+    }
+
+
+def load_module_vocabularies():
+    return {
+        field: sorted(value for value in modules_collection.distinct(field) if value is not None)
+        for field in ("status", "position")
+    }
+
+
+cable_templates_cache = ReadThroughCache(
+    "cable_templates",
+    lambda: {template["type"]: template for template in cable_templates_collection.find()},
+    DEFAULT_CONFIG["CACHE_TTL_SECONDS"],
+    DEFAULT_CONFIG["CACHE_VERSION_CHECK_SECONDS"],
+)
+crates_cache = ReadThroughCache(
+    "crates", load_crates, DEFAULT_CONFIG["CACHE_TTL_SECONDS"], DEFAULT_CONFIG["CACHE_VERSION_CHECK_SECONDS"]
+)
+module_vocabularies_cache = ReadThroughCache(
+    "module_vocabularies",
+    load_module_vocabularies,
+    DEFAULT_CONFIG["CACHE_TTL_SECONDS"],
+    DEFAULT_CONFIG["CACHE_VERSION_CHECK_SECONDS"],
+)
+CACHES_BY_COLLECTION = {
+    "cable_templates": [cable_templates_cache],
+    "crates": [crates_cache],
+    "modules": [module_vocabularies_cache],
+}
+
+
+def cable_templates():
+    """Returns all the cable templates, from the cache."""
+    return list(cable_templates_cache.get().values())
+
+
+def clear_caches():
+    """Drops the local copies, for tools that write to MongoDB directly."""
+    for caches in CACHES_BY_COLLECTION.values():
+        for cache in caches:
+            cache.clear()
+
+
+# name registry: every module, crate and cable name is mapped to its type and
+# _id in one indexed collection, kept current by record_changes
+
+NAME_REGISTRY_COLLECTIONS = {
+    "modules": ("module", modules_collection, "moduleID"),
+    "crates": ("crate", crates_collection, "name"),
+    "cables": ("cable", cables_collection, "name"),
+}
+NAME_REGISTRY_TYPES = {
+    kind: collection for kind, collection, key_field in NAME_REGISTRY_COLLECTIONS.values()
+}
+
+
+def sync_name_registry(collection_name, keys):
+    """
+    Registers the given names if they exist in the collection, unregisters them otherwise.
+
+    Args:
+        collection_name (str): "modules", "crates" or "cables".
+        keys (list): The written moduleIDs or names.
+    """
+    kind, collection, key_field = NAME_REGISTRY_COLLECTIONS[collection_name]
+    keys = [key for key in keys if key is not None]
+    if not keys:
+        return
+    found = {
+        document[key_field]: document["_id"]
+        for document in collection.find({key_field: {"$in": keys}}, {key_field: 1})
+    }
+    operations = []
+    for key in keys:
+        if key in found:
+            # the type is part of the filter: a name of another type is never overwritten,
+            # the unique index on name refuses the upsert instead
+            operations.append(
+                pymongo.UpdateOne({"name": key, "type": kind}, {"$set": {"ref": found[key]}}, upsert=True)
+            )
+        else:
+            operations.append(pymongo.DeleteOne({"name": key, "type": kind}))
+    try:
+        name_registry_collection.bulk_write(operations, ordered=False)
+    except pymongo.errors.BulkWriteError as e:
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+    entity_extractor.apply(
+        {key: kind for key in keys if key in found}, {key: kind for key in keys if key not in found}
+    )
+
+
+def name_conflict(name, kind):
+    """
+    Checks that a name is not already used by an object of another type.
+
+    Returns:
+        str: An error message if the name is taken, None otherwise.
+    """
+    entry = name_registry_collection.find_one({"name": name})
+    if entry and entry["type"] != kind:
+        return f"Name {name} already used by a {entry['type']}"
+    return None
+
+
+def claim_name(name, kind):
+    """
+    Registers a name for a type before the document using it is written.
+
+    The unique index on name makes the claim atomic: of two writers taking
+    the same name for different types, one gets the conflict.
+
+    Returns:
+        str: An error message if the name is used by another type, None otherwise.
+    """
+    if name is None:
+        return None
+    try:
+        name_registry_collection.update_one(
+            {"name": name, "type": kind}, {"$setOnInsert": {"ref": None}}, upsert=True
+        )
+    except pymongo.errors.DuplicateKeyError:
+        return name_conflict(name, kind) or f"Name {name} already used"
+    return None
+
+
+def claim_names(kinds):
+    """
+    Claims several names at once with one bulk write, see claim_name.
+
+    Args:
+        kinds (dict): {name: type}.
+
+    Returns:
+        tuple: {name: error message} for the names used by another type, and
+        the names registered by this call, to release if they end up unused.
+    """
+    names = list(kinds)
+    operations = [
+        pymongo.UpdateOne({"name": name, "type": kinds[name]}, {"$setOnInsert": {"ref": None}}, upsert=True)
+        for name in names
+    ]
+    if not operations:
+        return {}, []
+    try:
+        upserted = name_registry_collection.bulk_write(operations, ordered=False).upserted_ids
+        failed = []
+    except pymongo.errors.BulkWriteError as e:
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+        upserted = {entry["index"]: entry["_id"] for entry in e.details.get("upserted", [])}
+        failed = [error["index"] for error in e.details["writeErrors"]]
+    conflicts = {
+        names[i]: name_conflict(names[i], kinds[names[i]]) or f"Name {names[i]} already used" for i in failed
+    }
+    return conflicts, [names[i] for i in upserted]
+
+
+def claim_rename(collection_name, key, updated_data):
+    """Claims the new name of an update renaming a document; returns an error message if it is taken."""
+    kind, collection, key_field = NAME_REGISTRY_COLLECTIONS[collection_name]
+    new_key = updated_data.get(key_field, key)
+    return None if new_key == key else claim_name(new_key, kind)
+
+
+def rebuild_name_registry():
+    """
+    Recreates the name registry from the modules, crates and cables collections.
+
+    Returns:
+        int: The number of registered names.
+    """
+    name_registry_collection.delete_many({})
+    operations = []
+    for kind, collection, key_field in NAME_REGISTRY_COLLECTIONS.values():
+        for document in collection.find({key_field: {"$exists": True}}, {key_field: 1}):
+            operations.append(
+                pymongo.UpdateOne(
+                    {"name": document[key_field]},
+                    {"$setOnInsert": {"type": kind, "ref": document["_id"]}},
+                    upsert=True,
+                )
+            )
+    if operations:
+        name_registry_collection.bulk_write(operations, ordered=False)
+    entity_extractor.invalidate()
+    return name_registry_collection.count_documents({})
+
+
+# entity extraction from free text (logbook details): IDs following a naming
+# scheme are found by the precompiled ENTITY_PATTERNS, every registered name by
+# an Aho-Corasick automaton over the name registry; both in one pass each
+
+# kind: pattern of the IDs of that kind; cables and crates have no fixed naming
+# scheme, so they are only found through the name registry. An ID is a whole
+# token: neither a word character nor a hyphen may precede or follow it
+ENTITY_PATTERNS = {
+    "module": re.compile(r"(?<![\w-])(?:PS|2S)_\d+(?:[_-][A-Za-z0-9]+)*(?![\w-])"),
+}
+DEFAULT_CONFIG["EXTRACTOR_REFRESH_SECONDS"] = float(os.environ.get("EXTRACTOR_REFRESH_SECONDS", 60))
+DEFAULT_CONFIG["EXTRACTOR_MAX_DELTA"] = int(os.environ.get("EXTRACTOR_MAX_DELTA", 1000))
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton: finds all the occurrences of a set of words in one pass over a text.
+
+    Args:
+        words (dict): {word: value}; the value is reported with each match.
+    """
+
+    def __init__(self, words):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for word, value in words.items():
+            node = 0
+            for char in word:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = next_node
+            if word:
+                self.out[node].append((len(word), value))
+        # failure links, breadth first so that shorter suffixes are done first
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, next_node in self.goto[node].items():
+                queue.append(next_node)
+                fail = self.fail[node]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                target = self.goto[fail].get(char, 0)
+                self.fail[next_node] = target if target != next_node else 0
+                self.out[next_node] = self.out[next_node] + self.out[self.fail[next_node]]
+
+    def matches(self, text):
+        """Yields (start, end, value) for every occurrence of a word in text."""
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        for end, char in enumerate(text, 1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length, value in out[node]:
+                yield end - length, end, value
+
+
+class EntityExtractor:
+    """
+    Extracts module, crate and cable names from text.
+
+    The automaton over the registered names is built in the background,
+    started by the first request; until it is built, only the names of the
+    delta are found. Names registered or unregistered by this process are
+    applied at once as a small delta, matched by a second automaton; the
+    full automaton is rebuilt in the background, while the old one keeps
+    serving, when the delta exceeds EXTRACTOR_MAX_DELTA names or
+    EXTRACTOR_REFRESH_SECONDS after the last build, which picks up writes
+    made by other processes.
+    """
+
+    def __init__(self, refresh_seconds, max_delta=1000):
+        self.refresh_seconds = refresh_seconds
+        self.max_delta = max_delta
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.stamp = 0
+        self.automaton = None
+        self.built = 0.0
+        # name: (kind, stamp) of the names registered and unregistered since the build
+        self.added = {}
+        self.removed = {}
+        self.delta = AhoCorasick({})
+        self.rebuilding = False
+
+    def invalidate(self):
+        """Rebuilds the automaton in the background, discarding a running rebuild; the old one serves meanwhile."""
+        with self.lock:
+            self.generation += 1
+            self.rebuilding = False
+        self.refresh()
+
+    def apply(self, added, removed):
+        """
+        Applies registry writes made by this process without rebuilding the automaton.
+
+        Args:
+            added (dict): {name: kind} of the registered names.
+            removed (dict): {name: kind} of the unregistered names.
+        """
+        with self.lock:
+            self.stamp += 1
+            for name, kind in removed.items():
+                self.added.pop(name, None)
+                self.removed[name] = (kind, self.stamp)
+            for name, kind in added.items():
+                self.removed.pop(name, None)
+                self.added[name] = (kind, self.stamp)
+            self.delta = AhoCorasick({name: kind for name, (kind, _) in self.added.items()})
+        if len(self.added) + len(self.removed) > self.max_delta:
+            self.refresh()
+
+    def load(self):
+        return AhoCorasick(
+            {
+                entry["name"]: entry["type"]
+                for entry in name_registry_collection.find({}, {"name": 1, "type": 1, "_id": 0})
+            }
+        )
+
+    def refresh(self):
+        """Rebuilds the automaton on a background thread, unless a rebuild is running."""
+        with self.lock:
+            if self.rebuilding:
+                return
+            self.rebuilding = True
+            generation, stamp = self.generation, self.stamp
+        threading.Thread(target=self.rebuild, args=(generation, stamp), daemon=True).start()
+
+    def rebuild(self, generation, stamp):
+        try:
+            automaton = self.load()
+        except Exception:
+            with self.lock:
+                if generation == self.generation:
+                    self.rebuilding = False
+            raise
+        with self.lock:
+            if generation != self.generation:
+                # invalidated meanwhile
+                return
+            self.rebuilding = False
+            self.install(automaton, stamp)
+
+    def install(self, automaton, stamp):
+        # keep the delta applied after the registry was read
+        self.automaton = automaton
+        self.built = time.monotonic()
+        self.added = {name: entry for name, entry in self.added.items() if entry[1] > stamp}
+        self.removed = {name: entry for name, entry in self.removed.items() if entry[1] > stamp}
+        self.delta = AhoCorasick({name: kind for name, (kind, _) in self.added.items()})
+
+    def get_automata(self):
+        """Returns the full automaton, the delta automaton and the names unregistered since the build."""
+        if self.automaton is None or time.monotonic() - self.built > self.refresh_seconds:
+            self.refresh()
+        with self.lock:
+            return self.automaton or AhoCorasick({}), self.delta, dict(self.removed), set(self.added)
+
+    def extract(self, text):
+        """
+        Returns {kind: [names]} for the modules, crates and cables named in text.
+
+        Names are listed once, in order of first appearance. A registered name
+        only counts where it is not part of a longer word, e.g. "PS_1" in "PS_10".
+        """
+        found = {kind: {} for kind in NAME_REGISTRY_TYPES}
+        for kind, pattern in ENTITY_PATTERNS.items():
+            for match in pattern.finditer(text):
+                found[kind].setdefault(match.group(), match.start())
+        automaton, delta, removed, added = self.get_automata()
+        matches = [
+            match
+            for match in automaton.matches(text)
+            if text[match[0]:match[1]] not in added
+            and removed.get(text[match[0]:match[1]], (None,))[0] != match[2]
+        ]
+        matches += delta.matches(text)
+        for start, end, kind in matches:
+            word = text[start:end]
+            if (start and continues_word(text[start - 1], word[0])) or (
+                end < len(text) and continues_word(text[end], word[-1])
+            ):
+                continue
+            found[kind].setdefault(word, start)
+        return {kind: sorted(names, key=names.get) for kind, names in found.items()}
+
+
+def continues_word(outside, inside):
+    """True if a name ending (or starting) with inside runs on into the adjacent character outside."""
+    return (outside.isalnum() or outside == "_") and (inside.isalnum() or inside == "_")
+
+
+entity_extractor = EntityExtractor(
+    DEFAULT_CONFIG["EXTRACTOR_REFRESH_SECONDS"], DEFAULT_CONFIG["EXTRACTOR_MAX_DELTA"]
+)
 
-client = MongoClient(f"mongodb://{username}:{password}@{host_name}:27017")
-db = client[db_name]
-# we already have a database called "test" from the previous example
-# db = client['test']
-# we also have a collection called "modules" from the previous example
-modules_collection = db["modules"]
-logbook_collection = db["logbook"]
-current_cabling_map_collection = db["current_cabling_map"]
-connection_snapshot_collection = db["connection_snapshot"]
-tests_collection = db["tests"]
-cables_collection = db["cables"]
-cable_templates_collection = db["cable_templates"]
-crates_collection = db["crates"]
-testpayload_collection = db["testpayloads"]
+
+@bp.before_app_request
+def build_extractor_once():
+    # the first build starts with the first request, in the background, rather
+    # than inside the first request that extracts names (a logbook post)
+    if entity_extractor.automaton is None:
+        entity_extractor.refresh()
+
+
+# buffered logbook ingestion: validated entries get their _id up front and are
+# written in batches by a background thread
+
+DEFAULT_CONFIG["LOGBOOK_BUFFERED"] = os.environ.get("LOGBOOK_BUFFERED", "0") == "1"
+DEFAULT_CONFIG["LOGBOOK_FLUSH_SIZE"] = int(os.environ.get("LOGBOOK_FLUSH_SIZE", 500))
+DEFAULT_CONFIG["LOGBOOK_FLUSH_INTERVAL"] = float(os.environ.get("LOGBOOK_FLUSH_INTERVAL", 0.2))
+DEFAULT_CONFIG["LOGBOOK_WAIT_TIMEOUT"] = float(os.environ.get("LOGBOOK_WAIT_TIMEOUT", 10))
+# entries queued at most; further posts are refused with 503 until the writer catches up
+DEFAULT_CONFIG["LOGBOOK_QUEUE_SIZE"] = int(os.environ.get("LOGBOOK_QUEUE_SIZE", 10000))
+
+
+class PendingWrite:
+    """A queued document together with the event set once it has been written."""
+
+    def __init__(self, document):
+        self.document = document
+        self.done = threading.Event()
+        self.error = None
+
+
+class BufferedWriter:
+    """
+    Batches inserts into a collection.
+
+    Documents are put in an in-process queue and a daemon thread writes them
+    with insert_many as soon as flush_size documents are queued or
+    flush_interval seconds have passed since the first one of the batch.
+    At most max_queued documents wait in the queue (0 for no limit).
+    """
+
+    def __init__(self, collection, change_feed_name, flush_size, flush_interval, max_queued=0):
+        self.collection = collection
+        self.change_feed_name = change_feed_name
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(max_queued)
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, document):
+        """
+        Queues a document for insertion, allocating its _id if missing.
+
+        Args:
+            document (dict): The document to insert.
+
+        Returns:
+            PendingWrite: The pending write, whose done event is set after the flush.
+
+        Raises:
+            queue.Full: If max_queued documents are already waiting.
+        """
+        document.setdefault("_id", ObjectId())
+        pending = PendingWrite(document)
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        self.queue.put_nowait(pending)
+        return pending
+
+    def flush(self):
+        """Synchronously writes everything still in the queue."""
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.flush_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.flush_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch):
+        failed = {}
+        try:
+            self.collection.insert_many(
+                [pending.document for pending in batch], ordered=False
+            )
+        except pymongo.errors.BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                failed[error["index"]] = error.get("errmsg", "write error")
+        except pymongo.errors.PyMongoError as e:
+            failed = {i: str(e) for i in range(len(batch))}
+        written = [
+            pending.document["_id"] for i, pending in enumerate(batch) if i not in failed
+        ]
+        try:
+            record_changes(self.change_feed_name, "insert", written)
+        finally:
+            for i, pending in enumerate(batch):
+                pending.error = failed.get(i)
+                pending.done.set()
+
+
+logbook_writer = BufferedWriter(
+    logbook_collection,
+    "logbook",
+    DEFAULT_CONFIG["LOGBOOK_FLUSH_SIZE"],
+    DEFAULT_CONFIG["LOGBOOK_FLUSH_INTERVAL"],
+    DEFAULT_CONFIG["LOGBOOK_QUEUE_SIZE"],
+)
+atexit.register(logbook_writer.flush)
+
+
+def parse_bool(value, default=False):
+    """
+    Parses a boolean query parameter: 1/true/yes or 0/false/no, any case.
+
+    Raises:
+        ValueError: If the value is none of these.
+    """
+    if value is None:
+        return default
+    if value.lower() in ("1", "true", "yes"):
+        return True
+    if value.lower() in ("0", "false", "no"):
+        return False
+    raise ValueError(f"Invalid boolean {value!r}")
+
+
+def parse_timestamp(value):
+    """
+    Parses an ISO 8601 timestamp into a UTC datetime, stored by MongoDB as a BSON date.
+
+    Timestamps without a timezone are taken as UTC.
+
+    Raises:
+        ValidationError: If the value is not an ISO 8601 timestamp.
+    """
+    try:
+        timestamp = datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValidationError(f"Invalid timestamp {value!r}")
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp.astimezone(datetime.timezone.utc)
+
+
+def backfill_logbook_timestamps(batch_size=1000):
+    """
+    Converts the logbook timestamps still stored as strings to BSON dates.
+
+    Returns:
+        dict: The number of converted entries and of entries that could not be parsed.
+    """
+    converted = 0
+    invalid = 0
+    operations = []
+    for log in logbook_collection.find({"timestamp": {"$type": "string"}}, {"timestamp": 1}):
+        try:
+            timestamp = parse_timestamp(log["timestamp"])
+        except ValidationError:
+            invalid += 1
+            continue
+        operations.append(
+            pymongo.UpdateOne(
+                {"_id": log["_id"], "timestamp": log["timestamp"]},
+                {"$set": {"timestamp": timestamp}},
+            )
+        )
+        if len(operations) >= batch_size:
+            converted += logbook_collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        converted += logbook_collection.bulk_write(operations, ordered=False).modified_count
+    return {"converted": converted, "invalid": invalid}
 
 
 class ModulesResource(Resource):
@@ -130,7 +1400,11 @@ class ModulesResource(Resource):
         try:
             new_module = request.get_json()
             validate(instance=new_module, schema=module_schema)
+            conflict = claim_name(new_module["moduleID"], "module")
+            if conflict:
+                return {"message": conflict}, 409
             modules_collection.insert_one(new_module)
+            record_change("modules", "insert", new_module["moduleID"])
             return {"message": "Module inserted"}, 201
         except ValidationError as e:
             return {"message": str(e)}, 400
@@ -146,12 +1420,23 @@ class ModulesResource(Resource):
             If the module is successfully updated, returns a message indicating success.
         """
         updated_data = request.get_json()
-        modules_collection.update_one({"moduleID": moduleID}, {"$set": updated_data})
+        conflict = claim_rename("modules", moduleID, updated_data)
+        if conflict:
+            return {"message": conflict}, 409
+        result = modules_collection.update_one({"moduleID": moduleID}, {"$set": updated_data})
+        if result.matched_count:
+            record_changes(
+                "modules", "update", updated_keys(moduleID, updated_data, "moduleID"), updated_data
+            )
+        else:
+            # release the claimed new name
+            sync_name_registry("modules", updated_keys(moduleID, updated_data, "moduleID")[1:])
         return {"message": "Module updated"}, 200
 
     def delete(self, moduleID):
         """
-        Deletes an existing module from the database.
+        Deletes an existing module from the database, with the references to it
+        in tests, logbook entries and cable ports.
 
         Args:
             moduleID (int): The moduleID number of the module to delete.
@@ -159,7 +1444,7 @@ class ModulesResource(Resource):
         Returns:
             If the module is successfully deleted, returns a message indicating success.
         """
-        modules_collection.delete_one({"moduleID": moduleID})
+        cascade_delete("modules", [moduleID])
         return {"message": "Module deleted"}, 200
 
 
@@ -167,6 +1452,55 @@ class ModulesResource(Resource):
 api.add_resource(ModulesResource, "/modules", "/modules/<string:moduleID>")
 
 
+DEFAULT_CONFIG["SUGGEST_MAX_LIMIT"] = int(os.environ.get("SUGGEST_MAX_LIMIT", 50))
+
+
+def prefix_range(prefix):
+    """Returns the range query matching the strings starting with prefix."""
+    if not prefix:
+        return {"$type": "string"}
+    # the first string after all those starting with prefix
+    return {"$gte": prefix, "$lt": prefix[:-1] + chr(ord(prefix[-1]) + 1)}
+
+
+@bp.route("/modules/_vocabularies", methods=["GET"])
+def module_vocabularies():
+    """Returns {"status": [...], "position": [...]}, the values in use, from the cache."""
+    return jsonify(module_vocabularies_cache.get())
+
+
+@bp.route("/modules/_suggest", methods=["GET"])
+def suggest_modules():
+    """
+    Returns the first moduleIDs, in order, starting with a prefix, for autocompletion.
+
+    The lookup is a range scan on the moduleID index, covered by it. The
+    planner picks the index on its own: no hint, which would fail where the
+    indexes are not ensured (ENSURE_INDEXES off).
+
+    Query parameters:
+    - prefix (str): The start of the moduleID.
+    - limit (int, optional): How many moduleIDs to return (default is 10, at most SUGGEST_MAX_LIMIT).
+
+    Returns:
+    - list: The matching moduleIDs.
+    """
+    prefix = request.args.get("prefix", "")
+    try:
+        limit = int(request.args.get("limit", 10))
+    except ValueError:
+        return {"message": "limit must be an integer"}, 400
+    if not 0 < limit <= current_app.config["SUGGEST_MAX_LIMIT"]:
+        return {"message": f"limit must be between 1 and {current_app.config['SUGGEST_MAX_LIMIT']}"}, 400
+    modules = (
+        modules_collection.find({"moduleID": prefix_range(prefix)}, {"moduleID": 1, "_id": 0})
+        .sort("moduleID", 1)
+        .limit(limit)
+    )
+    # moduleIDs are not enforced unique, drop repeats
+    return jsonify(list(dict.fromkeys(module["moduleID"] for module in modules)))
+
+
 class LogbookResource(Resource):
     """
     A class representing a RESTful resource for logbook entries.
@@ -194,16 +1528,31 @@ class LogbookResource(Resource):
         """
         Retrieves a logbook entry with the specified _id, or all logbook entries if no _id is provided.
 
+        With any of the from, to, station, limit or after query parameters, returns
+        a page of the entries in the time window instead, in timestamp order, using
+        the (station, timestamp) index.
+
         Parameters:
         -----------
         timestamp : str, optional
             The _id of the logbook entry to retrieve.
+        from, to : str, optional
+            Query parameters; ISO 8601 bounds of the window (from inclusive, to exclusive).
+        station : str, optional
+            Query parameter; only return the entries of this station.
+        limit : int, optional
+            Query parameter; the page size (default is 100).
+        after : str, optional
+            Query parameter; the "next" value returned with the previous page.
 
         Returns:
         --------
         dict or list
             A dictionary representing the logbook entry with the specified _id, or a list of all logbook entries if no timestamp is provided.
+            For window queries, {"entries": [...], "next": token or None}.
         """
+        if not _id and any(arg in request.args for arg in ("from", "to", "station", "limit", "after")):
+            return self.get_window()
         if _id:
             log = logbook_collection.find_one({"_id": ObjectId(_id)})
             if log:
@@ -217,23 +1566,75 @@ class LogbookResource(Resource):
                 log["_id"] = str(log["_id"])
             return jsonify(logs)
 
+    def get_window(self):
+        query = {}
+        try:
+            if request.args.get("station"):
+                query["station"] = request.args["station"]
+            window = {}
+            if request.args.get("from"):
+                window["$gte"] = parse_timestamp(request.args["from"])
+            if request.args.get("to"):
+                window["$lt"] = parse_timestamp(request.args["to"])
+            if window:
+                query["timestamp"] = window
+            limit = int(request.args.get("limit", 100))
+            if limit < 1:
+                raise ValueError("limit must be at least 1")
+            if request.args.get("after"):
+                after_timestamp, after_id = request.args["after"].rsplit("|", 1)
+                after_timestamp = parse_timestamp(after_timestamp)
+                # resume at the last timestamp returned, so that the index scan starts
+                # there; the _id breaks the ties between entries of that timestamp
+                if "$gte" not in window or window["$gte"] < after_timestamp:
+                    window["$gte"] = after_timestamp
+                query["timestamp"] = window
+                query["$or"] = [{"timestamp": {"$gt": after_timestamp}}, {"_id": {"$gt": ObjectId(after_id)}}]
+        except (ValueError, ValidationError, bson.errors.InvalidId) as e:
+            return {"message": str(e)}, 400
+
+        logs = list(
+            logbook_collection.find(query)
+            .sort([("timestamp", 1), ("_id", 1)])
+            .limit(limit + 1)
+        )
+        next_token = None
+        if len(logs) > limit:
+            logs = logs[:limit]
+            last = logs[-1]
+            next_token = format_timestamp(last["timestamp"]) + "|" + str(last["_id"])
+        return jsonify({"entries": logs, "next": next_token})
+
     def post(self):
         """
         Inserts a new logbook entry into the database.
 
+        When LOGBOOK_BUFFERED is set the entry is queued and written in a batch by
+        the background writer: the response is 202 with the pre-allocated _id,
+        unless the wait query parameter is true, in which case the request
+        returns 201 once the batch containing the entry has been flushed, or
+        504 if it has not been flushed within LOGBOOK_WAIT_TIMEOUT seconds.
+        The response is 503 when LOGBOOK_QUEUE_SIZE entries are already queued.
+
         Parameters:
         -----------
-        None
+        wait : str, optional
+            Query parameter (1/true/yes or 0/false/no); wait for the buffered write to complete.
 
         Returns:
         --------
         dict
             A dictionary containing the _id of the new entry
         """
+        try:
+            wait = parse_bool(request.args.get("wait"))
+        except ValueError as e:
+            return {"message": str(e)}, 400
         try:
             new_log = request.get_json()
             
             validate(instance=new_log, schema=logbook_schema)
+            new_log["timestamp"] = parse_timestamp(new_log["timestamp"])
 #
 # check involved modules
 #
@@ -246,9 +1647,24 @@ class LogbookResource(Resource):
                 im = new_log["involved_modules"]
             if det in new_log:
                 d = new_log["details"]
-                modules_in_the_details = findModuleIds(d) 
-            new_log[key] = im + list(set(modules_in_the_details) - set(im))
+                modules_in_the_details = entity_extractor.extract(d)["module"]
+            new_log[key] = im + [m for m in modules_in_the_details if m not in im]
+            if current_app.config["LOGBOOK_BUFFERED"]:
+                try:
+                    pending = logbook_writer.submit(new_log)
+                except queue.Full:
+                    return busy_response("Too many logbook entries waiting to be written")
+                if not wait:
+                    return {"_id": str(new_log["_id"]), "message": "Log queued"}, 202
+                if not pending.done.wait(current_app.config["LOGBOOK_WAIT_TIMEOUT"]):
+                    # still queued: it may be written later, but the caller asked to know
+                    message = "Log queued but not written in time"
+                    return {"_id": str(new_log["_id"]), "message": message}, 504
+                if pending.error:
+                    return {"message": pending.error}, 500
+                return {"_id": str(new_log["_id"])}, 201
             logbook_collection.insert_one(new_log)
+            record_change("logbook", "insert", new_log["_id"])
             return {"_id": str(new_log["_id"])}, 201
         except ValidationError as e:
             return {"message": str(e)}, 400
@@ -257,6 +1673,8 @@ class LogbookResource(Resource):
         """
         Updates an existing logbook entry with the specified _id (as a string).
 
+        Modules named in new details are added to involved_modules, as on insert.
+
         Parameters:
         -----------
         timestamp : str
@@ -268,7 +1686,22 @@ class LogbookResource(Resource):
             A dictionary containing a message indicating that the logbook entry was successfully updated.
         """
         updated_data = request.get_json()
-        logbook_collection.update_one({"_id": ObjectId(_id)}, {"$set": updated_data})
+        if "timestamp" in updated_data:
+            try:
+                updated_data["timestamp"] = parse_timestamp(updated_data["timestamp"])
+            except ValidationError as e:
+                return {"message": str(e)}, 400
+        update = {"$set": updated_data}
+        if isinstance(updated_data.get("details"), str):
+            modules = entity_extractor.extract(updated_data["details"])["module"]
+            if "involved_modules" in updated_data:
+                involved = updated_data["involved_modules"]
+                updated_data["involved_modules"] = involved + [m for m in modules if m not in involved]
+            elif modules:
+                update["$addToSet"] = {"involved_modules": {"$each": modules}}
+        result = logbook_collection.update_one({"_id": ObjectId(_id)}, update)
+        if result.matched_count:
+            record_change("logbook", "update", _id)
         return {"message": "Log updated"}, 200
 
     def delete(self, _id):
@@ -288,6 +1721,7 @@ class LogbookResource(Resource):
         log = logbook_collection.find_one({"_id": ObjectId(_id)})
         if log:
             logbook_collection.delete_one({"_id": ObjectId(_id)})
+            record_change("logbook", "delete", _id)
             return {"message": "Log deleted"}, 200
         else:
             return {"message": "Log not found"}, 404
@@ -297,6 +1731,207 @@ class LogbookResource(Resource):
 api.add_resource(LogbookResource, "/logbook", "/logbook/<string:_id>")
 
 
+# typed numeric arrays in testResults: clients send
+# {"__ndarray__": {"dtype": "<f8", "shape": [2, 3], "data": "<base64>"}}
+# and the raw bytes are stored as BSON Binary
+
+
+def map_ndarrays(obj, convert):
+    """Applies convert to the content of every {"__ndarray__": ...} node of a document."""
+    if isinstance(obj, dict):
+        if len(obj) == 1 and "__ndarray__" in obj:
+            return convert(obj["__ndarray__"])
+        return {key: map_ndarrays(value, convert) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [map_ndarrays(value, convert) for value in obj]
+    return obj
+
+
+def ndarray_to_bson(spec):
+    """
+    Converts an array received as JSON to its stored form.
+
+    Raises:
+        ValidationError: If the dtype is not numeric or the data does not match the shape.
+    """
+    import numpy as np
+
+    try:
+        dtype = np.dtype(spec["dtype"])
+        if not isinstance(spec["shape"], list):
+            raise TypeError("shape must be a list")
+        shape = [int(n) for n in spec["shape"]]
+        data = base64.b64decode(spec["data"], validate=True)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValidationError(f"Invalid __ndarray__: {e}")
+    if any(n < 0 for n in shape):
+        raise ValidationError("Invalid __ndarray__: negative dimension in shape")
+    if dtype.kind not in "biufc":
+        raise ValidationError(f"Invalid __ndarray__: {dtype.str} is not a numeric dtype")
+    if len(data) != dtype.itemsize * int(np.prod(shape)):
+        raise ValidationError("Invalid __ndarray__: data size does not match dtype and shape")
+    return {"__ndarray__": {"dtype": dtype.str, "shape": shape, "data": Binary(data)}}
+
+
+class StoredArray:
+    """A stored array in a response, converted to nested lists only when the response is serialized."""
+
+    def __init__(self, spec):
+        self.spec = spec
+
+    def tolist(self):
+        import numpy as np
+
+        spec = self.spec
+        return np.frombuffer(spec["data"], dtype=spec["dtype"]).reshape(spec["shape"]).tolist()
+
+
+def encode_test_arrays(entry):
+    if isinstance(entry.get("testResults"), dict):
+        entry["testResults"] = map_ndarrays(entry["testResults"], ndarray_to_bson)
+    return entry
+
+
+def test_response(entries, single):
+    """
+    Returns tests in the format asked by the client.
+
+    ?format=bson returns the BSON documents (concatenated for lists), keeping
+    the arrays as raw bytes for zero-copy decoding; otherwise the arrays are
+    converted to nested lists when serialized, or kept as base64 with
+    ?arrays=base64.
+    """
+    if request.args.get("format") == "bson":
+        return Response(
+            b"".join(bson.encode(entry) for entry in entries), mimetype="application/bson"
+        )
+    for entry in entries:
+        entry["_id"] = str(entry["_id"])  # convert ObjectId to string
+        if request.args.get("arrays") != "base64" and isinstance(entry.get("testResults"), dict):
+            entry["testResults"] = map_ndarrays(entry["testResults"], StoredArray)
+    return jsonify(entries[0] if single else entries)
+
+
+# test statistics: per testType, testStatus, day and module batch the number
+# of tests in each status is kept in test_rollups, updated on every test write
+
+ROLLUP_FIELDS = ("testType", "testStatus", "testDate", "modules_list")
+
+
+def module_batch(moduleID):
+    """The production batch of a module: its ID without the trailing serial number."""
+    return re.sub(r"[-_]\d+$", "", moduleID)
+
+
+def encode_status_key(status):
+    """
+    Makes a test status usable as a field of the rollup status counters.
+
+    %, "." and "$" are percent-encoded, so that the key is a single path
+    component for $inc; the empty status is stored as "%".
+    """
+    key = str(status)
+    if not key:
+        return "%"
+    return key.replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+
+
+def decode_status_key(key):
+    return "" if key == "%" else urllib.parse.unquote(key)
+
+
+def update_test_rollups(tests, sign):
+    """
+    Adds (sign=1) or removes (sign=-1) tests from the rollup counters.
+
+    Module batches count one result per module of the test.
+    """
+    increments = {}
+    for test in tests:
+        status = test.get("testStatus")
+        buckets = [
+            ("testType", test.get("testType")),
+            ("testStatus", status),
+            ("day", str(test.get("testDate", ""))[:10]),
+        ]
+        buckets += [("batch", module_batch(m)) for m in test.get("modules_list", [])]
+        for dimension, bucket in buckets:
+            counts = increments.setdefault((dimension, bucket), {})
+            counts[status] = counts.get(status, 0) + sign
+    operations = [
+        pymongo.UpdateOne(
+            {"_id": f"{dimension}:{bucket}"},
+            {
+                "$set": {"dimension": dimension, "bucket": bucket},
+                "$inc": dict(
+                    {"total": sum(counts.values())},
+                    **{f"status.{encode_status_key(status)}": n for status, n in counts.items()},
+                ),
+            },
+            upsert=True,
+        )
+        for (dimension, bucket), counts in increments.items()
+    ]
+    if operations:
+        test_rollups_collection.bulk_write(operations, ordered=False)
+
+
+def aggregate_test_statistics():
+    """
+    Computes the rollup counters from the tests collection with a single $facet.
+
+    Returns:
+        list: The rollup documents.
+    """
+    def by(expression):
+        return {
+            "$group": {"_id": {"bucket": expression, "status": "$testStatus"}, "n": {"$sum": 1}}
+        }
+
+    facets = next(
+        tests_collection.aggregate(
+            [
+                {
+                    "$facet": {
+                        "testType": [by("$testType")],
+                        "testStatus": [by("$testStatus")],
+                        "day": [by({"$substr": ["$testDate", 0, 10]})],
+                        "module": [{"$unwind": "$modules_list"}, by("$modules_list")],
+                    }
+                }
+            ]
+        )
+    )
+    rollups = {}
+    for facet, groups in facets.items():
+        for group in groups:
+            dimension, bucket = facet, group["_id"].get("bucket")
+            if facet == "module":
+                dimension, bucket = "batch", module_batch(bucket)
+            rollup = rollups.setdefault(
+                (dimension, bucket),
+                {"_id": f"{dimension}:{bucket}", "dimension": dimension, "bucket": bucket,
+                 "total": 0, "status": {}},
+            )
+            status = encode_status_key(group["_id"].get("status"))
+            rollup["total"] += group["n"]
+            rollup["status"][status] = rollup["status"].get(status, 0) + group["n"]
+    return list(rollups.values())
+
+
+def format_test_statistics(rollups):
+    statistics = {}
+    for rollup in rollups:
+        if not rollup["total"]:
+            continue
+        statistics.setdefault(rollup["dimension"], {})[str(rollup["bucket"])] = {
+            "total": rollup["total"],
+            "status": {decode_status_key(k): n for k, n in rollup["status"].items() if n},
+            "fail_rate": rollup["status"].get(encode_status_key("failed"), 0) / rollup["total"],
+        }
+    return statistics
+
+
 class TestsResource(Resource):
     """
     Resource for handling HTTP requests related to tests.
@@ -312,21 +1947,21 @@ class TestsResource(Resource):
         if testID:
             entry = tests_collection.find_one({"testID": testID})
             if entry:
-                entry["_id"] = str(entry["_id"])  # convert ObjectId to string
-                return jsonify(entry)
+                return test_response([entry], single=True)
             else:
                 return {"message": "Entry not found"}, 404
         else:
             entries = list(tests_collection.find())
-            for entry in entries:
-                entry["_id"] = str(entry["_id"])
-            return jsonify(entries)
+            return test_response(entries, single=False)
 
     def post(self):
         try:
             new_entry = request.get_json()
             validate(instance=new_entry, schema=tests_schema)
+            encode_test_arrays(new_entry)
             tests_collection.insert_one(new_entry)
+            update_test_rollups([new_entry], 1)
+            record_change("tests", "insert", new_entry["testID"])
             return {"message": "Entry inserted"}, 201
         except ValidationError as e:
             return {"message": str(e)}, 400
@@ -334,16 +1969,28 @@ class TestsResource(Resource):
     def put(self, testID):
         if testID:
             updated_data = request.get_json()
-            tests_collection.update_one({"testID": testID}, {"$set": updated_data})
+            try:
+                encode_test_arrays(updated_data)
+            except ValidationError as e:
+                return {"message": str(e)}, 400
+            old = tests_collection.find_one_and_update(
+                {"testID": testID},
+                {"$set": updated_data},
+                projection={field: 1 for field in ROLLUP_FIELDS},
+            )
+            if old:
+                if any(field in updated_data for field in ROLLUP_FIELDS):
+                    update_test_rollups([old], -1)
+                    update_test_rollups([dict(old, **updated_data)], 1)
+                record_change("tests", "update", testID)
             return {"message": "Entry updated"}, 200
         else:
             return {"message": "Entry not found"}, 404
 
     def delete(self, testID):
         if testID:
-            entry = tests_collection.find_one({"testID": testID})
-            if entry:
-                tests_collection.delete_one({"testID": testID})
+            deleted, cleaned = cascade_delete("tests", [testID])
+            if deleted:
                 return {"message": "Entry deleted"}, 200
             else:
                 return {"message": "Entry not found"}, 404
@@ -367,14 +2014,14 @@ class TestPayloadsResource(Resource):
 
     def get(self, testpID=None):
         if testpID:
-            entry = tests_collection.find_one({"_id": ObjectId(testpID)})
+            entry = testpayload_collection.find_one({"_id": ObjectId(testpID)})
             if entry:
                 entry["_id"] = str(entry["_id"])  # convert ObjectId to string
                 return jsonify(entry)
             else:
                 return {"message": "Entry not found"}, 404
         else:
-            entries = list(tests_collection.find())
+            entries = list(testpayload_collection.find())
             for entry in entries:
                 entry["_id"] = str(entry["_id"])
             return jsonify(entries)
@@ -383,25 +2030,29 @@ class TestPayloadsResource(Resource):
         try:
             new_entry = request.get_json()
             validate(instance=new_entry, schema=testpayload_schema)
-            result = (tests_collection.insert_one(new_entry))
+            result = (testpayload_collection.insert_one(new_entry))
             _id = str(result.inserted_id)
             return {"_id": str(_id)}, 201
         except ValidationError as e:
             return {"message": str(e)}, 400
 
     def put(self, testpID):
-        if testID:
+        if testpID:
             updated_data = request.get_json()
-            tests_collection.update_one({"_id": ObjectId(testpID)}, {"$set": updated_data})
+            testpayload_collection.update_one({"_id": ObjectId(testpID)}, {"$set": updated_data})
             return {"message": "Entry updated"}, 200
         else:
             return {"message": "Entry not found"}, 404
 
     def delete(self, testpID):
         if testpID:
-            entry = tests_collection.find_one({"_id": ObjectId(testpID)})
+            entry = testpayload_collection.find_one({"_id": ObjectId(testpID)})
             if entry:
-                tests_collection.delete_one({"_id": ObjectId(testpID)})
+                testpayload_collection.delete_one({"_id": ObjectId(testpID)})
+                for payload_file in payload_files_collection.find(
+                    {"metadata.payload": ObjectId(testpID)}, {"_id": 1}
+                ):
+                    payload_files_bucket.delete(payload_file["_id"])
                 return {"message": "Entry deleted"}, 200
             else:
                 return {"message": "Entry not found"}, 404
@@ -412,6 +2063,182 @@ class TestPayloadsResource(Resource):
 api.add_resource(TestPayloadsResource, "/testpayloads", "/testpayloads/<string:testpID>")
 
 
+# testpayloads used to be written into the tests collection; they are told
+# apart from the tests by having no testID
+LEGACY_TESTPAYLOAD_QUERY = {
+    "testID": {"$exists": False},
+    "sessionID": {"$exists": True},
+    "remoteFileList": {"$exists": True},
+}
+
+
+def migrate_testpayloads(batch_size=1000):
+    """
+    Moves the testpayloads stored in the tests collection to testpayloads, keeping their _id.
+
+    Safe to run again after an interruption: payloads copied by a previous
+    run are only removed from tests.
+
+    Returns:
+        int: The number of payloads moved.
+    """
+    moved = 0
+    while True:
+        batch = list(tests_collection.find(LEGACY_TESTPAYLOAD_QUERY).limit(batch_size))
+        if not batch:
+            return moved
+        try:
+            testpayload_collection.insert_many(batch, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+        tests_collection.delete_many({"_id": {"$in": [entry["_id"] for entry in batch]}})
+        moved += len(batch)
+
+
+@bp.cli.command("migrate-testpayloads")
+def migrate_testpayloads_command():
+    """Move the testpayloads stored in the tests collection to testpayloads."""
+    print(f"{migrate_testpayloads()} testpayloads moved")
+
+
+
+DEFAULT_CONFIG["PAYLOAD_MAX_FILE_SIZE"] = int(os.environ.get("PAYLOAD_MAX_FILE_SIZE", 2**30))
+PAYLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def payload_file_info(payload_file):
+    return {
+        "_id": payload_file["_id"],
+        "filename": payload_file["filename"],
+        "length": payload_file["length"],
+        "uploadDate": payload_file["uploadDate"],
+        "sha256": payload_file["metadata"].get("sha256"),
+    }
+
+
+class TestPayloadFilesResource(Resource):
+    """
+    Resource for the raw files of a testpayload, stored in GridFS.
+
+    Files are streamed in and out in chunks, so they are never fully held in memory.
+
+    Methods:
+    - get: lists the files of a testpayload, or downloads one (with HTTP Range support)
+    - post: uploads a file, sent as the raw request body
+    - delete: deletes a file
+    """
+
+    def get(self, testpID, filename=None):
+        if not filename:
+            files = payload_files_collection.find({"metadata.payload": ObjectId(testpID)})
+            return jsonify([payload_file_info(payload_file) for payload_file in files])
+
+        payload_file = payload_files_collection.find_one(
+            {"metadata.payload": ObjectId(testpID), "filename": filename}
+        )
+        if not payload_file:
+            return {"message": "File not found"}, 404
+        length = payload_file["length"]
+        headers = {
+            "Accept-Ranges": "bytes",
+            "X-Checksum-SHA256": payload_file["metadata"].get("sha256", ""),
+        }
+        start, stop, status = 0, length, 200
+        if request.range:
+            file_range = request.range.range_for_length(length)
+            if file_range is None:
+                headers["Content-Range"] = f"bytes */{length}"
+                return Response(status=416, headers=headers)
+            start, stop = file_range
+            headers["Content-Range"] = f"bytes {start}-{stop - 1}/{length}"
+            status = 206
+        headers["Content-Length"] = str(stop - start)
+
+        def generate():
+            with payload_files_bucket.open_download_stream(payload_file["_id"]) as stream:
+                stream.seek(start)
+                remaining = stop - start
+                while remaining > 0:
+                    chunk = stream.read(min(PAYLOAD_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+
+        return Response(
+            generate(), status=status, headers=headers, mimetype="application/octet-stream"
+        )
+
+    def post(self, testpID, filename):
+        """
+        Streams the request body into GridFS.
+
+        The SHA-256 of the content is computed while streaming and stored with
+        the file; if the client sends an X-Checksum-SHA256 header the upload is
+        rejected when they do not match. Files larger than PAYLOAD_MAX_FILE_SIZE
+        are rejected with 413.
+        """
+        max_size = current_app.config["PAYLOAD_MAX_FILE_SIZE"]
+        if not testpayload_collection.find_one({"_id": ObjectId(testpID)}, {"_id": 1}):
+            return {"message": "Entry not found"}, 404
+        if request.content_length and request.content_length > max_size:
+            return {"message": f"File larger than {max_size} bytes"}, 413
+        if payload_files_collection.find_one(
+            {"metadata.payload": ObjectId(testpID), "filename": filename}, {"_id": 1}
+        ):
+            return {"message": "File already exists"}, 409
+
+        checksum = hashlib.sha256()
+        size = 0
+        upload = payload_files_bucket.open_upload_stream(
+            filename, metadata={"payload": ObjectId(testpID)}
+        )
+        try:
+            while True:
+                chunk = request.stream.read(PAYLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    upload.abort()
+                    return {"message": f"File larger than {max_size} bytes"}, 413
+                checksum.update(chunk)
+                upload.write(chunk)
+        except Exception:
+            upload.abort()
+            raise
+        expected = request.headers.get("X-Checksum-SHA256")
+        if expected and expected.lower() != checksum.hexdigest():
+            upload.abort()
+            return {"message": "Checksum mismatch"}, 400
+        try:
+            upload.close()
+        except gridfs.errors.FileExists:
+            # a concurrent upload of the same file completed first
+            upload.abort()
+            return {"message": "File already exists"}, 409
+        payload_files_collection.update_one(
+            {"_id": upload._id}, {"$set": {"metadata.sha256": checksum.hexdigest()}}
+        )
+        return {"_id": str(upload._id), "length": size, "sha256": checksum.hexdigest()}, 201
+
+    def delete(self, testpID, filename):
+        payload_file = payload_files_collection.find_one(
+            {"metadata.payload": ObjectId(testpID), "filename": filename}, {"_id": 1}
+        )
+        if not payload_file:
+            return {"message": "File not found"}, 404
+        payload_files_bucket.delete(payload_file["_id"])
+        return {"message": "File deleted"}, 200
+
+
+api.add_resource(
+    TestPayloadFilesResource,
+    "/testpayloads/<string:testpID>/files",
+    "/testpayloads/<string:testpID>/files/<path:filename>",
+)
+
 
 class CablesResource(Resource):
     """
@@ -442,7 +2269,11 @@ class CablesResource(Resource):
         try:
             new_entry = request.get_json()
             validate(instance=new_entry, schema=cables_schema)
+            conflict = claim_name(new_entry.get("name"), "cable")
+            if conflict:
+                return {"message": conflict}, 409
             cables_collection.insert_one(new_entry)
+            record_change("cables", "insert", new_entry.get("name"))
             return {"message": "Entry inserted"}, 201
         except ValidationError as e:
             return {"message": str(e)}, 400
@@ -450,16 +2281,24 @@ class CablesResource(Resource):
     def put(self, name):
         if name:
             updated_data = request.get_json()
-            cables_collection.update_one({"name": name}, {"$set": updated_data})
+            conflict = claim_rename("cables", name, updated_data)
+            if conflict:
+                return {"message": conflict}, 409
+            result = cables_collection.update_one({"name": name}, {"$set": updated_data})
+            if result.matched_count:
+                record_changes(
+                    "cables", "update", updated_keys(name, updated_data, "name"), updated_data
+                )
+            else:
+                sync_name_registry("cables", updated_keys(name, updated_data, "name")[1:])
             return {"message": "Entry updated"}, 200
         else:
             return {"message": "Entry not found"}, 404
 
     def delete(self, name):
         if name:
-            entry = cables_collection.find_one({"name": name})
-            if entry:
-                cables_collection.delete_one({"name": name})
+            deleted, cleaned = cascade_delete("cables", [name])
+            if deleted:
                 return {"message": "Entry deleted"}, 200
             else:
                 return {"message": "Entry not found"}, 404
@@ -473,24 +2312,25 @@ api.add_resource(CablesResource, "/cables", "/cables/<string:name>")
 # a route for crates for now equal to cables
 class CratesResource(Resource):
     def get(self, name=None):
+        crates = crates_cache.get()["by_name"]
         if name:
-            entry = crates_collection.find_one({"name": name})
+            entry = crates.get(name)
             if entry:
-                entry["_id"] = str(entry["_id"])  # convert ObjectId to string
                 return jsonify(entry)
             else:
                 return {"message": "Entry not found"}, 404
         else:
-            entries = list(crates_collection.find())
-            for entry in entries:
-                entry["_id"] = str(entry["_id"])
-            return jsonify(entries)
+            return jsonify(list(crates.values()))
 
     def post(self):
         try:
             new_entry = request.get_json()
             # NOTE: add schema for crates
+            conflict = claim_name(new_entry.get("name"), "crate")
+            if conflict:
+                return {"message": conflict}, 409
             crates_collection.insert_one(new_entry)
+            record_change("crates", "insert", new_entry.get("name"))
             return {"message": "Entry inserted"}, 201
         except ValidationError as e:
             return {"message": str(e)}, 400
@@ -498,16 +2338,24 @@ class CratesResource(Resource):
     def put(self, name):
         if name:
             updated_data = request.get_json()
-            crates_collection.update_one({"name": name}, {"$set": updated_data})
+            conflict = claim_rename("crates", name, updated_data)
+            if conflict:
+                return {"message": conflict}, 409
+            result = crates_collection.update_one({"name": name}, {"$set": updated_data})
+            if result.matched_count:
+                record_changes(
+                    "crates", "update", updated_keys(name, updated_data, "name"), updated_data
+                )
+            else:
+                sync_name_registry("crates", updated_keys(name, updated_data, "name")[1:])
             return {"message": "Entry updated"}, 200
         else:
             return {"message": "Entry not found"}, 404
 
     def delete(self, name):
         if name:
-            entry = crates_collection.find_one({"name": name})
-            if entry:
-                crates_collection.delete_one({"name": name})
+            deleted, cleaned = cascade_delete("crates", [name])
+            if deleted:
                 return {"message": "Entry deleted"}, 200
             else:
                 return {"message": "Entry not found"}, 404
@@ -523,23 +2371,20 @@ api.add_resource(CratesResource, "/crates", "/crates/<string:name>")
 class CableTemplatesResource(Resource):
     def get(self, cable_type=None):
         if cable_type:
-            entry = cable_templates_collection.find_one({"type": cable_type})
+            entry = cable_templates_cache.get().get(cable_type)
             if entry:
-                entry["_id"] = str(entry["_id"])
                 return jsonify(entry)
             else:
                 return {"message": "Template not found"}, 404
         else:
-            entries = list(cable_templates_collection.find())
-            for entry in entries:
-                entry["_id"] = str(entry["_id"])
-            return jsonify(entries)
+            return jsonify(cable_templates())
 
     def post(self):
         try:
             new_entry = request.get_json()
             validate(instance=new_entry, schema=cable_templates_schema)
             cable_templates_collection.insert_one(new_entry)
+            record_change("cable_templates", "insert", new_entry["type"])
             return {"message": "Template inserted"}, 201
         except ValidationError as e:
             return {"message": str(e)}, 400
@@ -547,9 +2392,11 @@ class CableTemplatesResource(Resource):
     def put(self, cable_type):
         if cable_type:
             updated_data = request.get_json()
-            cable_templates_collection.update_one(
+            result = cable_templates_collection.update_one(
                 {"type": cable_type}, {"$set": updated_data}
             )
+            if result.matched_count:
+                record_change("cable_templates", "update", cable_type)
             return {"message": "Template updated"}, 200
         else:
             return {"message": "Template not found"}, 404
@@ -558,6 +2405,7 @@ class CableTemplatesResource(Resource):
         if cable_type:
             result = cable_templates_collection.delete_one({"type": cable_type})
             if result.deleted_count > 0:
+                record_change("cable_templates", "delete", cable_type)
                 return {"message": "Template deleted"}, 200
             else:
                 return {"message": "Template not found"}, 404
@@ -571,7 +2419,163 @@ api.add_resource(
 )
 
 ### CUSTOM ROUTES ###
-@app.route("/searchLogBookByText", methods=["POST"])
+
+# cascading deletes: the references to deleted documents are pulled from the
+# other collections with one update_many per referencing collection (module
+# tests, test modules_list, logbook involved_modules, cable ports and the
+# connectedTo of modules and crates), optionally in a single transaction,
+# which needs a replica set
+
+DEFAULT_CONFIG["CASCADE_TRANSACTIONS"] = os.environ.get("CASCADE_TRANSACTIONS", "0") == "1"
+DEFAULT_CONFIG["BATCH_DELETE_MAX_KEYS"] = int(os.environ.get("BATCH_DELETE_MAX_KEYS", 1000))
+CASCADE_COLLECTIONS = {
+    "modules": (modules_collection, "moduleID"),
+    "tests": (tests_collection, "testID"),
+    "cables": (cables_collection, "name"),
+    "crates": (crates_collection, "name"),
+}
+CABLE_SIDES = ("detSide", "crateSide")
+
+
+def pull_references(collection, key_field, query, update, session):
+    """
+    Applies update to the documents matching query and returns their keys.
+
+    Only the documents read are updated, so that the keys returned, and the
+    change feed built from them, cover every document the update touches.
+    """
+    docs = list(collection.find(query, {key_field: 1}, session=session))
+    if docs:
+        collection.update_many(
+            {"$and": [query, {"_id": {"$in": [doc["_id"] for doc in docs]}}]}, update, session=session
+        )
+    return [doc[key_field] for doc in docs]
+
+
+def delete_with_references(collection_name, keys, session=None):
+    """
+    Deletes documents by key and pulls the references to them.
+
+    Returns:
+        tuple: The deleted documents, {collection name: updated keys} and the
+        tests whose rollups change, as (old, new) lists.
+    """
+    collection, key_field = CASCADE_COLLECTIONS[collection_name]
+    projection = [key_field] + (list(ROLLUP_FIELDS) if collection_name == "tests" else [])
+    deleted = list(collection.find({key_field: {"$in": keys}}, projection, session=session))
+    updated = {}
+    rollups = ([], [])
+    if not deleted:
+        return deleted, updated, rollups
+    ids = [doc["_id"] for doc in deleted]
+    names = [doc[key_field] for doc in deleted]
+    collection.delete_many({"_id": {"$in": ids}}, session=session)
+
+    if collection_name == "modules":
+        query = {"modules_list": {"$in": names}}
+        tests = list(tests_collection.find(query, ["testID"] + list(ROLLUP_FIELDS), session=session))
+        if tests:
+            tests_collection.update_many(
+                {"$and": [query, {"_id": {"$in": [test["_id"] for test in tests]}}]},
+                {"$pull": {"modules_list": {"$in": names}}},
+                session=session,
+            )
+            updated["tests"] = [test["testID"] for test in tests]
+            kept = [
+                dict(test, modules_list=[m for m in test.get("modules_list", []) if m not in names])
+                for test in tests
+            ]
+            rollups = (tests, kept)
+        updated["logbook"] = pull_references(
+            logbook_collection,
+            "_id",
+            {"involved_modules": {"$in": names}},
+            {"$pull": {"involved_modules": {"$in": names}}},
+            session,
+        )
+    elif collection_name == "tests":
+        updated["modules"] = pull_references(
+            modules_collection, "moduleID", {"tests": {"$in": names}}, {"$pull": {"tests": {"$in": names}}}, session
+        )
+        rollups = (deleted, [])
+    elif collection_name == "cables":
+        for other in ("modules", "crates"):
+            other_collection, other_key = CASCADE_COLLECTIONS[other]
+            updated[other] = pull_references(
+                other_collection, other_key, {"connectedTo": {"$in": ids}}, {"$unset": {"connectedTo": ""}}, session
+            )
+    if collection_name != "tests":
+        # modules, crates and cables can all be at the end of a cable port
+        updated["cables"] = pull_references(
+            cables_collection,
+            "name",
+            {"$or": [{side + ".connectedTo": {"$in": ids}} for side in CABLE_SIDES]},
+            {"$pull": {side: {"connectedTo": {"$in": ids}} for side in CABLE_SIDES}},
+            session,
+        )
+    return deleted, updated, rollups
+
+
+def cascade_delete(collection_name, keys):
+    """
+    Deletes the documents of collection_name with the given keys and every reference to them.
+
+    With CASCADE_TRANSACTIONS the deletion and the cleanup commit together; the
+    change feed and the test statistics are updated afterwards in any case.
+
+    Args:
+        collection_name (str): "modules", "tests", "cables" or "crates".
+        keys (list): The moduleIDs, testIDs or names to delete.
+
+    Returns:
+        tuple: The deleted keys and {collection name: number of documents cleaned}.
+    """
+    if current_app.config["CASCADE_TRANSACTIONS"]:
+        with db.client.start_session() as session:
+            deleted, updated, rollups = session.with_transaction(
+                lambda session: delete_with_references(collection_name, keys, session)
+            )
+    else:
+        deleted, updated, rollups = delete_with_references(collection_name, keys)
+    key_field = CASCADE_COLLECTIONS[collection_name][1]
+    names = [doc[key_field] for doc in deleted]
+    record_changes(collection_name, "delete", names)
+    for other, other_keys in updated.items():
+        # only the test list of the modules changes when tests are deleted; the
+        # other cleanups pull ports and connections
+        fields = ["tests"] if collection_name == "tests" else None
+        record_changes(other, "update", [key for key in other_keys if key not in names], fields)
+    update_test_rollups(rollups[0], -1)
+    update_test_rollups(rollups[1], 1)
+    return names, {other: len(other_keys) for other, other_keys in updated.items()}
+
+
+@bp.route("/batchDelete/<string:collection_name>", methods=["POST"])
+def batch_delete(collection_name):
+    """delete_data = {
+    ids: [key, ...]
+    }
+    Deletes the modules, tests, cables or crates with the given keys and cleans
+    the references to them, as the DELETE of a single document does. At most
+    BATCH_DELETE_MAX_KEYS keys can be given.
+
+    Returns:
+        deleted, the keys found and deleted, and cleaned, the number of documents
+        of each other collection whose references were removed.
+    """
+    if collection_name not in CASCADE_COLLECTIONS:
+        return {"message": f"Unknown collection {collection_name}"}, 404
+    data = request.get_json()
+    ids = data.get("ids") if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not all(isinstance(key, str) for key in ids):
+        return {"message": "ids must be a list of strings"}, 400
+    limit = current_app.config["BATCH_DELETE_MAX_KEYS"]
+    if len(ids) > limit:
+        return {"message": f"At most {limit} keys can be deleted at once"}, 400
+    deleted, cleaned = cascade_delete(collection_name, ids)
+    return {"deleted": deleted, "cleaned": cleaned}, 200
+
+@bp.route("/searchLogBookByText", methods=["POST"])
 def SearchLogBookByText():
         data = request.get_json()
         pattern = data.get("modules")
@@ -588,7 +2592,7 @@ def SearchLogBookByText():
 
     
 
-@app.route("/searchLogBookByModuleIDs", methods=["POST"])
+@bp.route("/searchLogBookByModuleIDs", methods=["POST"])
 def SearchLogBookByModuleIDs():
         data = request.get_json()
         pattern = data.get("modules")
@@ -600,7 +2604,7 @@ def SearchLogBookByModuleIDs():
            result.append(str(i["_id"])) 
         return jsonify(result), 200        
 
-@app.route("/disconnectCables", methods=["POST"])
+@bp.route("/disconnectCables", methods=["POST"])
 def disconnect():
     """disconnect_data = {
     cable1_name: name,
@@ -652,10 +2656,11 @@ def disconnect():
         },
     )
 
+    record_changes("cables", "update", [cable1_name, cable2_name])
     return {"message": "Cable disconnected"}, 200
 
 
-@app.route("/connectCables", methods=["POST"])
+@bp.route("/connectCables", methods=["POST"])
 def connect_cables():
     """connect_data = {
     cable1_name: name,
@@ -692,25 +2697,534 @@ def connect_cables():
         },
     )
 
-    # Update cable2's detSide to connect to cable1's crateSide
-    cable2_side = "detSide" if cable1_side == "crateSide" else "crateSide"
-    cables_collection.update_one(
-        {"_id": ObjectId(cable2_id)},
+    # Update cable2's detSide to connect to cable1's crateSide
+    cable2_side = "detSide" if cable1_side == "crateSide" else "crateSide"
+    cables_collection.update_one(
+        {"_id": ObjectId(cable2_id)},
+        {
+            "$push": {
+                cable2_side: {
+                    "port": cable2_port,
+                    "connectedTo": ObjectId(cable1_id),
+                    "type": "cable",
+                }
+            }
+        },
+    )
+
+    record_changes("cables", "update", [cable1_name, cable2_name])
+    return {"message": "Cables connected"}, 200
+
+
+def cable_link_error(link):
+    """Returns why a link of /batchConnectCables or /batchDisconnectCables is malformed, or None."""
+    if not isinstance(link, dict):
+        return "A link must be an object"
+    if not isinstance(link.get("cable1_name"), str) or not isinstance(link.get("cable2_name"), str):
+        return "cable1_name and cable2_name must be strings"
+    for field in ("cable1_port", "cable2_port"):
+        if not isinstance(link.get(field), int) or isinstance(link.get(field), bool):
+            return f"{field} must be an integer"
+    if link.get("cable1_side") not in ("detSide", "crateSide"):
+        return "cable1_side must be detSide or crateSide"
+    return None
+
+
+def apply_cable_links(links, connect):
+    """
+    Connects or disconnects a batch of cable pairs with one read and one bulk write.
+
+    Every link has the same fields as the body of /connectCables. Names are
+    resolved with a single query; links referring to unknown cables, to ports
+    already in use (connect) or to connections that do not exist (disconnect)
+    are rejected without being written. The remaining $push/$pull operations
+    are sent in a single bulk_write, guarded so that a port taken concurrently
+    is never connected twice; a link whose guard or write fails is rolled back.
+
+    Args:
+        links (list): The links to apply.
+        connect (bool): True to connect, False to disconnect.
+
+    Returns:
+        list: One {"index", "status", "message"} result per link.
+    """
+    invalid = {index: cable_link_error(link) for index, link in enumerate(links)}
+    names = set()
+    for index, link in enumerate(links):
+        if not invalid[index]:
+            names.update([link["cable1_name"], link["cable2_name"]])
+    cables = {
+        cable["name"]: cable
+        for cable in cables_collection.find(
+            {"name": {"$in": list(names)}}, {"name": 1, "detSide": 1, "crateSide": 1}
+        )
+    }
+
+    results = []
+    planned = []
+    operations = []
+    claimed = set()
+    for index, link in enumerate(links):
+        results.append({"index": index, "status": "error", "message": invalid[index]})
+        if invalid[index]:
+            continue
+        cable1 = cables.get(link["cable1_name"])
+        cable2 = cables.get(link["cable2_name"])
+        side1 = link["cable1_side"]
+        port1 = link["cable1_port"]
+        port2 = link["cable2_port"]
+        if not cable1 or not cable2:
+            results[index]["message"] = "Cable not found"
+            continue
+        side2 = "detSide" if side1 == "crateSide" else "crateSide"
+        entry1 = {"port": port1, "connectedTo": cable2["_id"], "type": "cable"}
+        entry2 = {"port": port2, "connectedTo": cable1["_id"], "type": "cable"}
+        claims = [(cable1["name"], side1, port1), (cable2["name"], side2, port2)]
+        if any(claim in claimed for claim in claims):
+            results[index]["message"] = "Port used twice in the same batch"
+            continue
+
+        if connect:
+            if any(conn["port"] == port1 for conn in cable1.get(side1, [])) or any(
+                conn["port"] == port2 for conn in cable2.get(side2, [])
+            ):
+                results[index]["message"] = "Port already in use"
+                continue
+            operations.append(
+                pymongo.UpdateOne(
+                    {"_id": cable1["_id"], side1 + ".port": {"$ne": port1}},
+                    {"$push": {side1: entry1}},
+                )
+            )
+            operations.append(
+                pymongo.UpdateOne(
+                    {"_id": cable2["_id"], side2 + ".port": {"$ne": port2}},
+                    {"$push": {side2: entry2}},
+                )
+            )
+        else:
+            if entry1 not in cable1.get(side1, []) or entry2 not in cable2.get(side2, []):
+                results[index]["message"] = "Cables not connected"
+                continue
+            operations.append(
+                pymongo.UpdateOne({"_id": cable1["_id"]}, {"$pull": {side1: entry1}})
+            )
+            operations.append(
+                pymongo.UpdateOne({"_id": cable2["_id"]}, {"$pull": {side2: entry2}})
+            )
+        claimed.update(claims)
+        planned.append((index, cable1, side1, entry1, cable2, side2, entry2))
+
+    if operations:
+        error = None
+        try:
+            result = cables_collection.bulk_write(operations, ordered=False)
+            complete = not connect or result.modified_count == len(operations)
+        except pymongo.errors.BulkWriteError as e:
+            error = "Write failed: " + e.details["writeErrors"][0]["errmsg"]
+            complete = False
+        if not complete:
+            # a guard failed because of a concurrent write, or a write failed:
+            # find out which links are only half applied and undo them
+            ids = {p[1]["_id"] for p in planned} | {p[4]["_id"] for p in planned}
+            current = {
+                cable["_id"]: cable
+                for cable in cables_collection.find({"_id": {"$in": list(ids)}})
+            }
+            rollback = []
+            failed = set()
+            for index, cable1, side1, entry1, cable2, side2, entry2 in planned:
+                has1 = entry1 in current[cable1["_id"]].get(side1, [])
+                has2 = entry2 in current[cable2["_id"]].get(side2, [])
+                if has1 == has2 == connect:
+                    continue
+                for cable, side, entry, has in (
+                    (cable1, side1, entry1, has1),
+                    (cable2, side2, entry2, has2),
+                ):
+                    if connect and has:
+                        rollback.append(
+                            pymongo.UpdateOne({"_id": cable["_id"]}, {"$pull": {side: entry}})
+                        )
+                    elif not connect and not has and (has1 or has2):
+                        rollback.append(
+                            pymongo.UpdateOne(
+                                {"_id": cable["_id"], side + ".port": {"$ne": entry["port"]}},
+                                {"$push": {side: entry}},
+                            )
+                        )
+                results[index]["message"] = error or "Port already in use"
+                failed.add(index)
+            planned = [p for p in planned if p[0] not in failed]
+            if rollback:
+                cables_collection.bulk_write(rollback, ordered=False)
+
+    changed = set()
+    for index, cable1, side1, entry1, cable2, side2, entry2 in planned:
+        results[index]["status"] = "connected" if connect else "disconnected"
+        changed.update([cable1["name"], cable2["name"]])
+    record_changes("cables", "update", sorted(changed))
+    return results
+
+
+@bp.route("/batchConnectCables", methods=["POST"])
+def batch_connect_cables():
+    """connect_data = {
+    links: [
+        {cable1_name: name, cable1_port: port, cable1_side: side, cable2_name: name, cable2_port: port},
+        ...
+    ]
+    }
+    """
+    data = request.get_json()
+    links = data.get("links", []) if isinstance(data, dict) else None
+    if not isinstance(links, list):
+        return {"message": "The body must be an object with a list of links"}, 400
+    results = apply_cable_links(links, connect=True)
+    return jsonify({"results": results}), 200
+
+
+@bp.route("/batchDisconnectCables", methods=["POST"])
+def batch_disconnect_cables():
+    """disconnect_data = {
+    links: [
+        {cable1_name: name, cable1_port: port, cable1_side: side, cable2_name: name, cable2_port: port},
+        ...
+    ]
+    }
+    """
+    data = request.get_json()
+    links = data.get("links", []) if isinstance(data, dict) else None
+    if not isinstance(links, list):
+        return {"message": "The body must be an object with a list of links"}, 400
+    results = apply_cable_links(links, connect=False)
+    return jsonify({"results": results}), 200
+
+
+def insert_in_batches(collection, documents, batch_size):
+    """Inserts the documents batch by batch, yielding the number inserted after each batch."""
+    for i in range(0, len(documents), batch_size):
+        collection.insert_many(documents[i : i + batch_size], ordered=False)
+        yield len(documents[i : i + batch_size])
+
+
+def bulk_write_in_batches(collection, operations, batch_size):
+    """Runs the operations batch by batch, yielding the number run after each batch."""
+    for i in range(0, len(operations), batch_size):
+        collection.bulk_write(operations[i : i + batch_size], ordered=False)
+        yield len(operations[i : i + batch_size])
+
+
+def import_cabling_map(maps, crates=(), templates=(), dry_run=False, batch_size=1000):
+    """
+    Creates the cables, crates and cable templates described by a cabling map.
+
+    Every cable is given as a CurrentCablingMap document whose ID is the cable
+    name and Type the cable type; detSide and crateSide entries reference the
+    connected object by name:
+    {"port": 1, "connectedTo": "PS_40_05_IPG-00001", "type": "module"}.
+    Modules must already exist, crates and templates may be existing ones or
+    be part of the import. All names are resolved to ObjectIds with one query
+    per collection, port usage and link symmetry are checked in memory and
+    the documents are then written with insert_many/bulk_write in batches.
+    Modules and crates at the ends of the cables get their connectedTo set.
+
+    Args:
+        maps (list): The CurrentCablingMap documents, one per cable.
+        crates (list, optional): New crates, e.g. {"name": "Crate 1"}.
+        templates (list, optional): New cable templates.
+        dry_run (bool, optional): Only validate, do not write anything.
+        batch_size (int, optional): Number of documents per bulk write.
+
+    Returns:
+        dict: A report with the number of objects written (or to be written),
+        the list of errors and the time spent in every phase. The writes are
+        not atomic: when one fails, "partial" is set and "written" has the
+        number of documents written by each step.
+    """
+    timings = {}
+    errors = []
+    start = time.perf_counter()
+
+    for cabling_map in maps:
+        try:
+            validate(instance=cabling_map, schema=current_cabling_map_schema)
+        except ValidationError as e:
+            errors.append({"name": cabling_map.get("ID"), "message": e.message})
+    for template in templates:
+        try:
+            validate(instance=template, schema=cable_templates_schema)
+        except ValidationError as e:
+            errors.append({"name": template.get("type"), "message": e.message})
+    for crate in crates:
+        if not isinstance(crate.get("name"), str):
+            errors.append({"name": None, "message": "Crates need a name"})
+    timings["validate"] = time.perf_counter() - start
+    report = {"dry_run": dry_run, "errors": errors, "timings": timings}
+    if errors:
+        return report
+
+    # resolve every name with one query per collection
+    start = time.perf_counter()
+    cable_ids = {}
+    for cabling_map in maps:
+        if cabling_map["ID"] in cable_ids:
+            errors.append({"name": cabling_map["ID"], "message": "Cable defined twice"})
+        cable_ids[cabling_map["ID"]] = ObjectId()
+    referenced = {"cable": set(), "crate": set(), "module": set()}
+    for cabling_map in maps:
+        for side in ("detSide", "crateSide"):
+            for conn in cabling_map[side]:
+                if conn.get("type") in referenced:
+                    referenced[conn["type"]].add(conn.get("connectedTo"))
+
+    for cable in cables_collection.find({"name": {"$in": list(cable_ids)}}, {"name": 1}):
+        errors.append({"name": cable["name"], "message": "Cable already exists"})
+    # a name is unique across modules, crates and cables, see claim_name
+    kinds = {crate["name"]: "crate" for crate in crates}
+    for name in cable_ids:
+        if name in kinds:
+            errors.append({"name": name, "message": "Name used by a cable and a crate"})
+        kinds[name] = "cable"
+    for entry in name_registry_collection.find({"name": {"$in": list(kinds)}}):
+        if entry["type"] != kinds[entry["name"]]:
+            errors.append({"name": entry["name"], "message": f"Name already used by a {entry['type']}"})
+
+    new_crates = {crate["name"]: crate for crate in crates}
+    crate_ids = {}
+    for crate in crates_collection.find(
+        {"name": {"$in": list(referenced["crate"] | set(new_crates))}}, {"name": 1}
+    ):
+        if crate["name"] in new_crates:
+            errors.append({"name": crate["name"], "message": "Crate already exists"})
+        crate_ids[crate["name"]] = crate["_id"]
+    for name in new_crates:
+        crate_ids.setdefault(name, ObjectId())
+
+    module_ids = {
+        module["moduleID"]: module["_id"]
+        for module in modules_collection.find(
+            {"moduleID": {"$in": list(referenced["module"])}}, {"moduleID": 1}
+        )
+    }
+
+    new_templates = {template["type"]: template for template in templates}
+    types = {cabling_map["Type"] for cabling_map in maps} | set(new_templates)
+    known_types = set(new_templates)
+    for template in cable_templates_collection.find({"type": {"$in": list(types)}}, {"type": 1}):
+        if template["type"] in new_templates:
+            errors.append({"name": template["type"], "message": "Template already exists"})
+        known_types.add(template["type"])
+    timings["resolve"] = time.perf_counter() - start
+
+    # port consistency
+    start = time.perf_counter()
+    links = {}
+    endpoints = {}
+    ids = {"cable": cable_ids, "crate": crate_ids, "module": module_ids}
+    for cabling_map in maps:
+        name = cabling_map["ID"]
+        if cabling_map["Type"] not in known_types:
+            errors.append({"name": name, "message": f"No template for type {cabling_map['Type']}"})
+        for side in ("detSide", "crateSide"):
+            for conn in cabling_map[side]:
+                port = conn.get("port")
+                target = conn.get("connectedTo")
+                kind = conn.get("type")
+                where = f"{name} {side} port {port}"
+                if not isinstance(port, int):
+                    errors.append({"name": where, "message": "Port must be an integer"})
+                elif (name, side, port) in links:
+                    errors.append({"name": where, "message": "Port used twice"})
+                elif kind not in ids:
+                    errors.append({"name": where, "message": f"Unknown connection type {kind}"})
+                elif target not in ids[kind]:
+                    errors.append({"name": where, "message": f"Unknown {kind} {target}"})
+                elif (kind, side) in (("module", "crateSide"), ("crate", "detSide")):
+                    errors.append({"name": where, "message": f"A {kind} cannot be on the {side}"})
+                elif kind != "cable" and target in endpoints:
+                    errors.append({"name": where, "message": f"{target} connected twice"})
+                else:
+                    links[(name, side, port)] = (kind, target)
+                    if kind != "cable":
+                        endpoints[target] = name
+    reverse = {
+        (name, side, target)
+        for (name, side, port), (kind, target) in links.items()
+        if kind == "cable"
+    }
+    for (name, side, port), (kind, target) in links.items():
+        other_side = "detSide" if side == "crateSide" else "crateSide"
+        if kind == "cable" and (target, other_side, name) not in reverse:
+            errors.append(
+                {"name": f"{name} {side} port {port}", "message": f"{target} has no link back"}
+            )
+    timings["check"] = time.perf_counter() - start
+
+    report.update(
         {
-            "$push": {
-                cable2_side: {
-                    "port": cable2_port,
-                    "connectedTo": ObjectId(cable1_id),
-                    "type": "cable",
-                }
-            }
-        },
+            "cables": len(maps),
+            "crates": len(new_crates),
+            "cable_templates": len(new_templates),
+            "connected_endpoints": len(endpoints),
+        }
     )
+    if errors or dry_run:
+        return report
+
+    # the checks above read the registry; the claims make the names ours before
+    # anything is written, so that a concurrent writer cannot take them meanwhile
+    conflicts, claimed = claim_names(kinds)
+    if conflicts:
+        errors.extend({"name": name, "message": message} for name, message in conflicts.items())
+        sync_name_registry("crates", [name for name in claimed if kinds[name] == "crate"])
+        sync_name_registry("cables", [name for name in claimed if kinds[name] == "cable"])
+        return report
+
+    start = time.perf_counter()
+    cable_documents = []
+    for cabling_map in maps:
+        name = cabling_map["ID"]
+        document = {"_id": cable_ids[name], "name": name, "type": cabling_map["Type"]}
+        for side in ("detSide", "crateSide"):
+            document[side] = [
+                {
+                    "port": conn["port"],
+                    "connectedTo": ids[conn["type"]][conn["connectedTo"]],
+                    "type": conn["type"],
+                }
+                for conn in cabling_map[side]
+            ]
+        cable_documents.append(document)
+    crate_documents = []
+    for name, crate in new_crates.items():
+        crate = dict(crate, _id=crate_ids[name])
+        if name in endpoints:
+            crate["connectedTo"] = cable_ids[endpoints[name]]
+        crate_documents.append(crate)
+    module_updates = [
+        pymongo.UpdateOne(
+            {"_id": module_ids[target]}, {"$set": {"connectedTo": cable_ids[cable]}}
+        )
+        for target, cable in endpoints.items()
+        if target in module_ids
+    ]
+    crate_updates = [
+        pymongo.UpdateOne(
+            {"_id": crate_ids[target]}, {"$set": {"connectedTo": cable_ids[cable]}}
+        )
+        for target, cable in endpoints.items()
+        if target in crate_ids and target not in new_crates
+    ]
+    map_replacements = [
+        pymongo.ReplaceOne({"ID": cabling_map["ID"]}, cabling_map, upsert=True)
+        for cabling_map in maps
+    ]
+
+    # the steps run one after the other and are not atomic: if one fails the
+    # report says what was written so far and the import is marked partial
+    steps = [
+        ("cable_templates", insert_in_batches(
+            cable_templates_collection, list(new_templates.values()), batch_size
+        )),
+        ("crates", insert_in_batches(crates_collection, crate_documents, batch_size)),
+        ("cables", insert_in_batches(cables_collection, cable_documents, batch_size)),
+        ("module_connections", bulk_write_in_batches(
+            modules_collection, module_updates, batch_size
+        )),
+        ("crate_connections", bulk_write_in_batches(
+            crates_collection, crate_updates, batch_size
+        )),
+        ("current_cabling_map", bulk_write_in_batches(
+            current_cabling_map_collection, map_replacements, batch_size
+        )),
+    ]
+    written = report["written"] = {}
+    try:
+        for step, batches in steps:
+            written[step] = 0
+            for count in batches:
+                written[step] += count
+    except pymongo.errors.PyMongoError as e:
+        report["partial"] = True
+        errors.append(
+            {"name": step, "message": f"Import stopped after a partial write: {e}"}
+        )
+    finally:
+        # a step that failed may have written part of a batch, its changes are
+        # recorded anyway: a change of a missing document reads as a deletion
+        if "cable_templates" in written:
+            record_changes("cable_templates", "insert", list(new_templates))
+        if "crates" in written:
+            record_changes("crates", "insert", list(new_crates))
+        if "cables" in written:
+            record_changes("cables", "insert", list(cable_ids))
+        if "module_connections" in written:
+            record_changes("modules", "update", [t for t in endpoints if t in module_ids])
+        if "crate_connections" in written:
+            record_changes(
+                "crates", "update", [t for t in endpoints if t in crate_ids and t not in new_crates]
+            )
+        # release the names claimed for documents that were never written
+        if "crates" not in written:
+            sync_name_registry("crates", [name for name in claimed if kinds[name] == "crate"])
+        if "cables" not in written:
+            sync_name_registry("cables", [name for name in claimed if kinds[name] == "cable"])
+    timings["write"] = time.perf_counter() - start
+    return report
 
-    return {"message": "Cables connected"}, 200
+
+@bp.route("/importCablingMap", methods=["POST"])
+def import_cabling_map_route():
+    """
+    Imports a whole cabling map, see import_cabling_map.
+
+    The map can be sent as a JSON body or as an uploaded file (form field
+    "file"), either as a list of CurrentCablingMap documents or as
+    {"cables": [...], "crates": [...], "cable_templates": [...]}, or streamed
+    as application/x-ndjson with one CurrentCablingMap document per line.
+
+    Query parameters:
+    - dry_run (bool, optional): Only validate and report.
+    - batch_size (int, optional): Number of documents per bulk write (default is 1000).
+
+    Answers 500 with the report when a write failed half way (see "partial").
+    """
+    try:
+        if "file" in request.files:
+            payload = json.load(request.files["file"].stream)
+        elif request.mimetype == "application/x-ndjson":
+            payload = [json.loads(line) for line in request.stream if line.strip()]
+        else:
+            payload = request.get_json()
+        batch_size = int(request.args.get("batch_size", 1000))
+        dry_run = parse_bool(request.args.get("dry_run"))
+    except ValueError as e:
+        return {"message": str(e)}, 400
+    if isinstance(payload, list):
+        payload = {"cables": payload}
+    if not isinstance(payload, dict):
+        return {"message": "The cabling map must be a list or an object"}, 400
+    for field in ("cables", "crates", "cable_templates"):
+        value = payload.get(field, [])
+        if not isinstance(value, list) or not all(isinstance(item, dict) for item in value):
+            return {"message": f"{field} must be a list of objects"}, 400
+
+    report = import_cabling_map(
+        payload.get("cables", []),
+        payload.get("crates", []),
+        payload.get("cable_templates", []),
+        dry_run=dry_run,
+        batch_size=max(batch_size, 1),
+    )
+    if report.get("partial"):
+        return jsonify(report), 500
+    if report["errors"]:
+        return jsonify(report), 400
+    return jsonify(report), 200 if report["dry_run"] else 201
 
 
-@app.route("/addTest", methods=["POST"])
+@bp.route("/addTest", methods=["POST"])
 def addTest():
     # NOTE must be rewritten as "addRun"
     """1) create a new test from the json given by the request
@@ -719,26 +3233,693 @@ def addTest():
     try:
         new_entry = request.get_json()
         validate(instance=new_entry, schema=tests_schema)
+        encode_test_arrays(new_entry)
         tests_collection.insert_one(new_entry)
+        update_test_rollups([new_entry], 1)
+
+        record_change("tests", "insert", new_entry["testID"])
 
         for moduleID in new_entry["modules_list"]:
             modules_collection.update_one(
                 {"moduleID": moduleID}, {"$push": {"tests": new_entry["testID"]}}
             )
+        record_changes("modules", "update", new_entry["modules_list"], ["tests"])
         return {"message": "Entry inserted"}, 201
 
     except ValidationError as e:
         return {"message": str(e)}, 400
 
 
+def visible_horizon(since, last, gap_seconds):
+    """
+    Returns the highest seq, at most last, such that every change from since to it is visible.
+
+    A missing seq stops the horizon before it while the change following it
+    is more recent than gap_seconds.
+    """
+    # MongoDB returns naive UTC datetimes
+    cutoff = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    cutoff -= datetime.timedelta(seconds=gap_seconds)
+    expected = since + 1
+    entries = changes_collection.find({"seq": {"$gt": since, "$lte": last}}, {"seq": 1, "time": 1})
+    for entry in entries.sort("seq", 1):
+        if entry["seq"] != expected and entry.get("time", cutoff) > cutoff:
+            return expected - 1
+        expected = entry["seq"] + 1
+    return last
+
+
+@bp.route("/changes", methods=["GET"])
+def changes():
+    """
+    Returns the inserts, updates and deletes recorded since the given token.
+
+    Query parameters:
+    - since (int, optional): The token returned by a previous call (default is 0, i.e. everything).
+    - limit (int, optional): The maximum number of changes to return (default is 1000, at least 1).
+    - collections (str, optional): Comma separated list of collections to include.
+    - latest (bool, optional): Return no changes, only the current token, from
+      which a client that has just read the documents can follow the feed.
+
+    Returns:
+    - dict: The changes (only the latest one per document, with the current
+      document attached unless it was deleted, and the origins of all the
+      changes of the document it stands for), the token to pass to the next
+      call and whether more changes are pending.
+    """
+    try:
+        since = int(request.args.get("since", 0))
+        limit = int(request.args.get("limit", 1000))
+        latest = parse_bool(request.args.get("latest"))
+    except ValueError:
+        return {"message": "since and limit must be integers, latest a boolean"}, 400
+    limit = max(limit, 1)
+    if latest:
+        # every seq allocated so far belongs to a write that is already applied
+        counter = counters_collection.find_one({"_id": "changes"})
+        return jsonify({"changes": [], "token": counter["seq"] if counter else 0, "more": False})
+
+    query = {"seq": {"$gt": since}}
+    if request.args.get("collections"):
+        query["collection"] = {"$in": request.args["collections"].split(",")}
+
+    entries = list(changes_collection.find(query).sort("seq", 1).limit(limit + 1))
+    more = len(entries) > limit
+    entries = entries[:limit]
+    token = entries[-1]["seq"] if entries else since
+    horizon = visible_horizon(since, token, current_app.config["CHANGES_GAP_SECONDS"])
+    if horizon < token:
+        # the rest is served once the missing changes are written
+        entries = [entry for entry in entries if entry["seq"] <= horizon]
+        token = horizon
+        more = False
+
+    # keep only the latest change per document
+    latest = {}
+    origins = {}
+    for entry in entries:
+        latest[(entry["collection"], entry["key"])] = entry
+        origins.setdefault((entry["collection"], entry["key"]), set()).add(entry.get("origin"))
+    result = sorted(latest.values(), key=lambda entry: entry["seq"])
+
+    # attach the current documents with one query per collection
+    for collection_name, (collection, key_field) in CHANGE_FEED_COLLECTIONS.items():
+        keys = [
+            entry["key"]
+            for entry in result
+            if entry["collection"] == collection_name and entry["op"] != "delete"
+        ]
+        if not keys:
+            continue
+        if key_field == "_id":
+            keys = [ObjectId(key) for key in keys]
+        documents = {
+            str(document[key_field]): document
+            for document in collection.find({key_field: {"$in": keys}})
+        }
+        for entry in result:
+            if entry["collection"] == collection_name and entry["op"] != "delete":
+                entry["document"] = documents.get(str(entry["key"]))
+
+    for entry in result:
+        entry.pop("_id")
+        entry.pop("time", None)
+        entry.pop("origin", None)
+        entry["origins"] = sorted(origins[(entry["collection"], entry["key"])], key=str)
+    return jsonify({"changes": result, "token": token, "more": more})
+
+
+@bp.route("/testStatistics", methods=["GET"])
+def test_statistics():
+    """
+    Returns the number of tests per status and the failure rate, per testType,
+    testStatus, day and module batch.
+
+    Query parameters:
+    - dimension (str, optional): Only return one of testType, testStatus, day or batch.
+    - live (optional): Aggregate the tests collection instead of reading the rollups.
+    """
+    if request.args.get("live"):
+        rollups = aggregate_test_statistics()
+    else:
+        query = {}
+        if request.args.get("dimension"):
+            query["dimension"] = request.args["dimension"]
+        rollups = list(test_rollups_collection.find(query))
+    statistics = format_test_statistics(rollups)
+    if request.args.get("dimension"):
+        statistics = {request.args["dimension"]: statistics.get(request.args["dimension"], {})}
+    return jsonify(statistics)
+
+
+@bp.route("/rebuildTestStatistics", methods=["POST"])
+def rebuild_test_statistics():
+    rollups = aggregate_test_statistics()
+    if rollups:
+        # built aside and swapped in with one rename, so readers never see it half filled
+        staging = db[f"test_rollups_rebuild_{ObjectId()}"]
+        try:
+            staging.insert_many(rollups)
+            staging.rename(test_rollups_collection.name, dropTarget=True)
+        except pymongo.errors.PyMongoError:
+            staging.drop()
+            raise
+    else:
+        test_rollups_collection.delete_many({})
+    return {"message": "Test statistics rebuilt", "count": len(rollups)}, 200
+
+
+@bp.route("/backfillLogbookTimestamps", methods=["POST"])
+def backfill_logbook_timestamps_route():
+    return jsonify(backfill_logbook_timestamps()), 200
+
+
+@bp.cli.command("backfill-logbook-timestamps")
+def backfill_logbook_timestamps_command():
+    """Convert the logbook timestamps stored as strings to dates."""
+    result = backfill_logbook_timestamps()
+    print(f"{result['converted']} entries converted, {result['invalid']} invalid")
+
+
+# involved_modules backfill: the logbook is split in _id ranges scanned by a
+# pool of workers; the progress of every range is checkpointed in backfill_jobs
+# so that an interrupted run resumes where it stopped
+
+INVOLVED_MODULES_JOB = "involved_modules"
+# a running job whose checkpoints stopped for this long is taken over: its process died
+BACKFILL_STALE_SECONDS = 600
+
+
+def truncates(short, full):
+    """True if short is a truncated module ID of full: full continues it past a separator."""
+    return full != short and full.startswith(short) and full[len(short)] in "_-"
+
+
+def claim_backfill_job():
+    """
+    Marks the backfill job running unless another process runs it.
+
+    The claim is one atomic upsert of the job document, so that two workers
+    can never run the job at the same time.
+
+    Returns:
+        bool: True if the job was claimed.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    stale = now - datetime.timedelta(seconds=BACKFILL_STALE_SECONDS)
+    try:
+        backfill_jobs_collection.find_one_and_update(
+            {
+                "_id": INVOLVED_MODULES_JOB,
+                "$or": [{"status": {"$ne": "running"}}, {"heartbeat": {"$lt": stale}}],
+            },
+            {"$set": {"status": "running", "heartbeat": now}, "$unset": {"result": "", "error": ""}},
+            upsert=True,
+        )
+    except pymongo.errors.DuplicateKeyError:
+        # the job document exists and is running: the upsert tried to insert a second one
+        return False
+    return True
+
+
+def split_id_ranges(collection, parts):
+    """
+    Splits the _id space of a collection in ranges covering roughly equal time spans.
+
+    Returns:
+        list: [{"index", "start", "end", "last", "done"}]; start is inclusive,
+        end exclusive (None for the last range, which stays open).
+    """
+    first = collection.find_one({}, {"_id": 1}, sort=[("_id", 1)])
+    last = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    if first is None:
+        return []
+    begin = first["_id"].generation_time
+    span = (last["_id"].generation_time - begin) / parts
+    bounds = [first["_id"]]
+    for i in range(1, parts):
+        bound = ObjectId.from_datetime(begin + span * i)
+        if bound > bounds[-1]:
+            bounds.append(bound)
+    return [
+        {"index": i, "start": start, "end": bounds[i + 1] if i + 1 < len(bounds) else None, "last": None, "done": False}
+        for i, start in enumerate(bounds)
+    ]
+
+
+def backfill_involved_modules_range(job, id_range, batch_size, max_rate):
+    """
+    Re-extracts the module references of the entries of one _id range, batch by batch.
+
+    Only the entries missing some reference are written, with $addToSet, so that
+    concurrent writes to involved_modules are kept. The truncated IDs left by
+    the old extraction, prefixes of an extracted ID ending at a separator
+    (e.g. "PS_40" for "PS_40_05_IPG-00001", but not "PS_1" for "PS_10") that
+    are not extracted themselves, are pulled. After each batch the range
+    checkpoint and the job heartbeat are saved; max_rate (entries per second, None for no limit) is
+    enforced by sleeping between batches.
+
+    Returns:
+        tuple: The number of scanned and of updated entries.
+    """
+    scanned = updated = 0
+    last = id_range["last"]
+    while True:
+        started = time.monotonic()
+        bounds = {"$gt": last} if last is not None else {"$gte": id_range["start"]}
+        if id_range["end"] is not None:
+            bounds["$lt"] = id_range["end"]
+        logs = list(
+            logbook_collection.find({"_id": bounds}, {"details": 1, "involved_modules": 1})
+            .sort("_id", 1)
+            .limit(batch_size)
+        )
+        operations = []
+        changed = []
+        for log in logs:
+            if not isinstance(log.get("details"), str):
+                continue
+            involved = log.get("involved_modules") or []
+            extracted = entity_extractor.extract(log["details"])["module"]
+            missing = [m for m in extracted if m not in involved]
+            truncated = [
+                m for m in involved if m not in extracted and any(truncates(m, e) for e in extracted)
+            ]
+            if missing:
+                operations.append(
+                    pymongo.UpdateOne({"_id": log["_id"]}, {"$addToSet": {"involved_modules": {"$each": missing}}})
+                )
+            if truncated:
+                # in its own update, $pull and $addToSet cannot share a field
+                operations.append(
+                    pymongo.UpdateOne({"_id": log["_id"]}, {"$pull": {"involved_modules": {"$in": truncated}}})
+                )
+            if missing or truncated:
+                changed.append(str(log["_id"]))
+        if operations:
+            logbook_collection.bulk_write(operations, ordered=False)
+            record_changes("logbook", "update", changed)
+        scanned += len(logs)
+        updated += len(changed)
+        done = len(logs) < batch_size
+        if logs:
+            last = logs[-1]["_id"]
+        backfill_jobs_collection.update_one(
+            {"_id": job, "ranges.index": id_range["index"]},
+            {
+                "$set": {
+                    "ranges.$.last": last,
+                    "ranges.$.done": done,
+                    "heartbeat": datetime.datetime.now(datetime.timezone.utc),
+                },
+                "$inc": {"scanned": len(logs), "updated": len(changed)},
+            },
+        )
+        if done:
+            return scanned, updated
+        if max_rate:
+            time.sleep(max(0.0, len(logs) / max_rate - (time.monotonic() - started)))
+
+
+def backfill_involved_modules(workers=4, batch_size=500, max_rate=None, restart=False):
+    """
+    Completes the involved_modules of the logbook entries from their details.
+
+    Resumes the previous run unless it finished or restart is given. The job
+    must have been claimed with claim_backfill_job. The job document records
+    the progress, and its status: running, finished (with the result) or
+    failed (with the error).
+
+    Args:
+        workers (int, optional): The number of ranges scanned in parallel. Defaults to 4.
+        batch_size (int, optional): The entries read, and at most written, per batch. Defaults to 500.
+        max_rate (float, optional): Entries per second for the whole job. Defaults to no limit.
+        restart (bool, optional): Start over instead of resuming. Defaults to False.
+
+    Returns:
+        dict: The number of entries scanned and updated by this run and in total.
+    """
+    job = backfill_jobs_collection.find_one({"_id": INVOLVED_MODULES_JOB})
+    if restart or job is None or "ranges" not in job or all(id_range["done"] for id_range in job["ranges"]):
+        job = {
+            "_id": INVOLVED_MODULES_JOB,
+            # a few ranges per worker, so that uneven ranges still keep every worker busy
+            "ranges": split_id_ranges(logbook_collection, workers * 4),
+            "scanned": 0,
+            "updated": 0,
+            "started": datetime.datetime.now(datetime.timezone.utc),
+            "status": "running",
+            "heartbeat": datetime.datetime.now(datetime.timezone.utc),
+        }
+        backfill_jobs_collection.replace_one({"_id": INVOLVED_MODULES_JOB}, job, upsert=True)
+    pending = [id_range for id_range in job["ranges"] if not id_range["done"]]
+    worker_rate = max_rate / workers if max_rate else None
+    try:
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            results = list(
+                executor.map(
+                    lambda id_range: backfill_involved_modules_range(
+                        INVOLVED_MODULES_JOB, id_range, batch_size, worker_rate
+                    ),
+                    pending,
+                )
+            )
+    except Exception as e:
+        backfill_jobs_collection.update_one(
+            {"_id": INVOLVED_MODULES_JOB}, {"$set": {"status": "failed", "error": str(e)}}
+        )
+        raise
+    job = backfill_jobs_collection.find_one({"_id": INVOLVED_MODULES_JOB})
+    result = {
+        "scanned": sum(scanned for scanned, _ in results),
+        "updated": sum(updated for _, updated in results),
+        "total_scanned": job["scanned"],
+        "total_updated": job["updated"],
+    }
+    backfill_jobs_collection.update_one(
+        {"_id": INVOLVED_MODULES_JOB},
+        {"$set": {"status": "finished", "result": result, "finished": datetime.datetime.now(datetime.timezone.utc)}},
+    )
+    return result
+
+
+def run_backfill_involved_modules(*args):
+    try:
+        backfill_involved_modules(*args)
+    except Exception:
+        # recorded in the job document
+        pass
+
+
+@bp.route("/backfillInvolvedModules", methods=["POST"])
+def backfill_involved_modules_route():
+    """
+    Starts the backfill in the background and returns its job id at once (202);
+    GET /backfillJobs/<job> follows its progress.
+
+    Query parameters: workers, batch_size, max_rate (entries per second) and restart,
+    see backfill_involved_modules.
+    """
+    try:
+        workers = int(request.args.get("workers", 4))
+        batch_size = int(request.args.get("batch_size", 500))
+        max_rate = float(request.args["max_rate"]) if request.args.get("max_rate") else None
+    except ValueError:
+        return {"message": "workers, batch_size and max_rate must be numbers"}, 400
+    if workers < 1 or batch_size < 1:
+        return {"message": "workers and batch_size must be positive"}, 400
+    restart = request.args.get("restart") in ("1", "true")
+    # claimed, and so marked running, before answering: polling never sees the previous run
+    if not claim_backfill_job():
+        return {"message": "The backfill is already running", "job": INVOLVED_MODULES_JOB}, 409
+    threading.Thread(
+        target=run_backfill_involved_modules, args=(workers, batch_size, max_rate, restart), daemon=True
+    ).start()
+    return {"job": INVOLVED_MODULES_JOB, "status": "running"}, 202
+
+
+@bp.route("/backfillJobs/<string:job>", methods=["GET"])
+def backfill_job(job):
+    """
+    Returns the progress of a backfill job: its status (running, finished or
+    failed), the entries scanned and updated so far, the ranges done out of the
+    total, and the result or the error once it stopped.
+    """
+    entry = backfill_jobs_collection.find_one({"_id": job})
+    if entry is None:
+        return {"message": "Job not found"}, 404
+    ranges = entry.pop("ranges", [])
+    entry["ranges_done"] = sum(id_range["done"] for id_range in ranges)
+    entry["ranges_total"] = len(ranges)
+    return jsonify(entry)
+
+
+@bp.cli.command("backfill-involved-modules")
+@click.option("--workers", default=4, help="Ranges scanned in parallel.")
+@click.option("--batch-size", default=500, help="Entries per batch.")
+@click.option("--max-rate", type=float, default=None, help="Entries per second, for the whole job.")
+@click.option("--restart", is_flag=True, help="Start over instead of resuming the last run.")
+def backfill_involved_modules_command(workers, batch_size, max_rate, restart):
+    """Complete the involved_modules of the logbook entries from their details."""
+    if not claim_backfill_job():
+        raise click.ClickException("The backfill is already running")
+    result = backfill_involved_modules(workers, batch_size, max_rate, restart)
+    print(
+        f"{result['updated']} of {result['scanned']} entries updated "
+        f"({result['total_updated']} of {result['total_scanned']} since the job started)"
+    )
+
+
+# generic filtered queries: only whitelisted fields and operators, and only
+# filters that can use an index unless allow_scan is given
+
+QUERYABLE_COLLECTIONS = {
+    "modules": (
+        modules_collection,
+        {"_id", "moduleID", "position", "status", "overall_grade", "tests"},
+    ),
+    "tests": (
+        tests_collection,
+        {"_id", "testID", "testType", "testDate", "testOperator", "testStatus", "modules_list"},
+    ),
+    "cables": (cables_collection, {"_id", "name", "type"}),
+    "crates": (crates_collection, {"_id", "name"}),
+    "logbook": (
+        logbook_collection,
+        {"_id", "station", "timestamp", "operator", "sessionid", "event", "involved_modules"},
+    ),
+}
+QUERY_OPERATORS = {"$in", "$gt", "$gte", "$lt", "$lte"}
+DEFAULT_CONFIG["QUERY_MAX_LIMIT"] = int(os.environ.get("QUERY_MAX_LIMIT", 1000))
+
+
+def index_prefixes(collection):
+    """Returns {first field: index name} for the indexes of a collection."""
+    cached = index_prefixes_cache.get(collection.name)
+    if cached and time.monotonic() - cached[0] < INDEX_CACHE_SECONDS:
+        return cached[1]
+    prefixes = {}
+    for name, index in collection.index_information().items():
+        prefixes.setdefault(index["key"][0][0], name)
+    index_prefixes_cache[collection.name] = (time.monotonic(), prefixes)
+    return prefixes
+
+
+def query_value(field, value):
+    if field == "_id":
+        return ObjectId(value)
+    if field == "timestamp":
+        return parse_timestamp(value)
+    return value
+
+
+def build_query(fields, spec):
+    """
+    Translates a whitelisted filter into a MongoDB filter.
+
+    Raises:
+        ValidationError: For fields or operators that are not allowed.
+    """
+    query = {}
+    for field, condition in spec.items():
+        if field not in fields:
+            raise ValidationError(f"Filtering on {field} is not allowed")
+        if isinstance(condition, dict):
+            if not condition or not set(condition) <= QUERY_OPERATORS:
+                raise ValidationError(f"Allowed operators are {sorted(QUERY_OPERATORS)}")
+            if "$in" in condition and not isinstance(condition["$in"], list):
+                raise ValidationError(f"$in on {field} needs a list")
+            query[field] = {
+                op: [query_value(field, v) for v in value] if op == "$in" else query_value(field, value)
+                for op, value in condition.items()
+            }
+        elif isinstance(condition, (str, int, float, bool)):
+            query[field] = query_value(field, condition)
+        else:
+            raise ValidationError(f"Invalid condition for {field}")
+    return query
+
+
+@bp.route("/query/<string:collection_name>", methods=["POST"])
+def query_collection(collection_name):
+    """query_data = {
+    filter: {field: value | {$in: [...], $gt/$gte/$lt/$lte: value}, ...},
+    sort: [[field, 1 | -1], ...],
+    projection: [field, ...],
+    limit: n,
+    allow_scan: false
+    }
+    Runs a single find with the given filter, sort, projection and limit (at most
+    QUERY_MAX_LIMIT), hinting the index it uses. Filters and sorts that no index
+    can serve are rejected unless allow_scan is set.
+    """
+    if collection_name not in QUERYABLE_COLLECTIONS:
+        return {"message": f"Unknown collection {collection_name}"}, 404
+    collection, fields = QUERYABLE_COLLECTIONS[collection_name]
+    data = request.get_json()
+    if not isinstance(data, dict) or not isinstance(data.get("filter", {}), dict):
+        return {"message": "The body must be an object, and its filter an object"}, 400
+    try:
+        query = build_query(fields, data.get("filter", {}))
+        sort = [(field, int(direction)) for field, direction in data.get("sort", [])]
+        projection = data.get("projection")
+        limit = int(data.get("limit", current_app.config["QUERY_MAX_LIMIT"]))
+        for field, direction in sort:
+            if field not in fields or direction not in (1, -1):
+                raise ValidationError(f"Invalid sort on {field}")
+        if projection is not None and not set(projection) <= fields:
+            raise ValidationError("Projection on fields that are not allowed")
+        if not 0 < limit <= current_app.config["QUERY_MAX_LIMIT"]:
+            raise ValidationError(f"limit must be between 1 and {current_app.config['QUERY_MAX_LIMIT']}")
+    except (ValidationError, ValueError, TypeError, bson.errors.InvalidId) as e:
+        return {"message": getattr(e, "message", str(e))}, 400
+
+    prefixes = index_prefixes(collection)
+    # prefer an index on an equality condition, then on a range, then on the sort
+    candidates = [f for f, c in query.items() if not isinstance(c, dict)]
+    candidates += [f for f, c in query.items() if isinstance(c, dict)]
+    candidates += [field for field, direction in sort[:1]] if not query else []
+    hint = next((prefixes[f] for f in candidates if f in prefixes), None)
+    if (query or sort) and not hint and not data.get("allow_scan"):
+        return {"message": "No index can serve this query, set allow_scan to run it anyway"}, 400
+
+    cursor = collection.find(query, projection)
+    if hint:
+        cursor = cursor.hint(hint)
+    if sort:
+        cursor = cursor.sort(sort)
+    results = list(cursor.limit(limit))
+    return jsonify({"results": results, "count": len(results)})
+
+
+# filtered bulk updates: a single update_many on the documents named by their
+# keys or selected by a /query filter; $set may only touch the fields of the
+# schema, never the keys
+
+BULK_UPDATE_COLLECTIONS = {
+    "modules": ("moduleID", module_schema),
+    "tests": ("testID", tests_schema),
+    "cables": ("name", cables_schema),
+    "crates": ("name", None),
+}
+DEFAULT_CONFIG["BULK_UPDATE_MAX_DOCUMENTS"] = int(os.environ.get("BULK_UPDATE_MAX_DOCUMENTS", 10000))
+
+
+def validate_bulk_set(set_fields, key_field, schema):
+    """
+    Checks the $set of a bulk update against the schema of the collection.
+
+    Raises:
+        ValidationError: For keys, unknown or nested fields and invalid values.
+    """
+    if not isinstance(set_fields, dict) or not set_fields:
+        raise ValidationError("$set must be a non-empty object")
+    for field in set_fields:
+        if field in ("_id", key_field):
+            raise ValidationError(f"{field} cannot be bulk updated")
+        if field.startswith("$") or "." in field:
+            raise ValidationError(f"Invalid field {field}")
+        if schema is not None and field not in schema.get("properties", {}):
+            raise ValidationError(f"Unknown field {field}")
+    if schema is not None:
+        # the fields are checked as a partial document, so that $refs resolve
+        validate(instance=set_fields, schema=dict(schema, required=[]))
+
+
+@bp.route("/bulkUpdate/<string:collection_name>", methods=["POST"])
+def bulk_update(collection_name):
+    """update_data = {
+    ids: [key, ...] | filter: {field: value | {$in: [...], $gt/$gte/$lt/$lte: value}, ...},
+    $set: {field: value, ...}
+    }
+    Sets the given fields on every document named in ids (moduleID, testID or
+    name) or matching the filter, which takes the fields and operators of
+    /query/<collection_name>. At most BULK_UPDATE_MAX_DOCUMENTS can be updated.
+
+    Returns:
+        matched and modified, the number of documents found and changed.
+    """
+    if collection_name not in BULK_UPDATE_COLLECTIONS:
+        return {"message": f"Unknown collection {collection_name}"}, 404
+    collection, fields = QUERYABLE_COLLECTIONS[collection_name]
+    key_field, schema = BULK_UPDATE_COLLECTIONS[collection_name]
+    data = request.get_json()
+    try:
+        if ("ids" in data) == ("filter" in data):
+            raise ValidationError("Give either ids or filter")
+        if "ids" in data:
+            if not isinstance(data["ids"], list) or not all(isinstance(key, str) for key in data["ids"]):
+                raise ValidationError("ids must be a list of strings")
+            query = {key_field: {"$in": data["ids"]}}
+        else:
+            if not isinstance(data["filter"], dict) or not data["filter"]:
+                raise ValidationError("filter must be a non-empty object")
+            query = build_query(fields, data["filter"])
+        set_fields = data.get("$set")
+        validate_bulk_set(set_fields, key_field, schema)
+    except (ValidationError, ValueError, TypeError, bson.errors.InvalidId) as e:
+        return {"message": getattr(e, "message", str(e))}, 400
+    if collection_name == "tests":
+        encode_test_arrays(set_fields)
+
+    # the documents are selected first, so that the change feed and the test
+    # statistics know which ones the update touches
+    rollups = collection_name == "tests" and any(field in set_fields for field in ROLLUP_FIELDS)
+    projection = [key_field] + (list(ROLLUP_FIELDS) if rollups else [])
+    limit = current_app.config["BULK_UPDATE_MAX_DOCUMENTS"]
+    selected = list(collection.find(query, projection).limit(limit + 1))
+    if len(selected) > limit:
+        return {"message": f"More than {limit} documents match, narrow the selection"}, 400
+    if not selected:
+        return {"matched": 0, "modified": 0}, 200
+
+    result = collection.update_many({"_id": {"$in": [doc["_id"] for doc in selected]}}, {"$set": set_fields})
+    if rollups:
+        update_test_rollups(selected, -1)
+        update_test_rollups([dict(doc, **set_fields) for doc in selected], 1)
+    record_changes(collection_name, "update", [doc[key_field] for doc in selected], set_fields)
+    return {"matched": result.matched_count, "modified": result.modified_count}, 200
+
+
+@bp.route("/resolveNames", methods=["POST"])
+def resolve_names():
+    """resolve_data = {
+    names: [name, ...]
+    }
+    Returns {name: {type: "module" | "crate" | "cable", _id: id}} for every registered name.
+    """
+    data = request.get_json()
+    names = data.get("names", []) if isinstance(data, dict) else None
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        return {"message": "names must be a list of strings"}, 400
+    entries = name_registry_collection.find({"name": {"$in": names}})
+    return jsonify({entry["name"]: {"type": entry["type"], "_id": entry["ref"]} for entry in entries})
+
+
+@bp.route("/extractEntities", methods=["POST"])
+def extract_entities():
+    """extract_data = {
+    text: str
+    }
+    Returns {"module": [...], "crate": [...], "cable": [...]}, the names found in the text.
+    """
+    data = request.get_json()
+    text = data.get("text") if isinstance(data, dict) else None
+    if not isinstance(text, str):
+        return {"message": "text must be a string"}, 400
+    return jsonify(entity_extractor.extract(text))
+
+
+@bp.route("/rebuildNameRegistry", methods=["POST"])
+def rebuild_name_registry_route():
+    count = rebuild_name_registry()
+    return {"message": "Name registry rebuilt", "count": count}, 200
+
+
 # Recursive function to traverse through cables
 def traverse_cables(cable, side, port):
-    # Fetch all cable templates
-    cable_templates = list(cable_templates_collection.find({}))
     # Determine the next port using the cable template
-    cable_template = next(
-        (ct for ct in cable_templates if ct["type"] == cable["type"]), None
-    )
+    cable_template = cable_templates_cache.get().get(cable["type"])
     if not cable_template:
         return [cable["name"]]  # End traversal if no matching template
 
@@ -767,7 +3948,7 @@ def traverse_cables(cable, side, port):
 
 
 
-# @app.route("/cablingSnapshot", methods=["POST"])
+# @bp.route("/cablingSnapshot", methods=["POST"])
 # def cabling_snapshot():
 #     data = request.get_json()
 #     starting_point_name = data.get("starting_point_name")
@@ -903,11 +4084,16 @@ def find_starting_cable(starting_point_name, starting_side, starting_port):
     Returns:
         tuple: A tuple containing the starting cable and port. If the starting point is not found, returns (None, None).
     """
-    starting_point = (
-        modules_collection.find_one({"moduleID": starting_point_name})
-        or crates_collection.find_one({"name": starting_point_name})
-        or cables_collection.find_one({"name": starting_point_name})
-    )
+    entry = name_registry_collection.find_one({"name": starting_point_name})
+    if entry:
+        starting_point = NAME_REGISTRY_TYPES[entry["type"]].find_one({"_id": entry["ref"]})
+    else:
+        # names written before the registry existed
+        starting_point = (
+            modules_collection.find_one({"moduleID": starting_point_name})
+            or crates_collection.find_one({"name": starting_point_name})
+            or cables_collection.find_one({"name": starting_point_name})
+        )
 
     if not starting_point:
         return None, None
@@ -945,8 +4131,13 @@ def traverse_cables(starting_point_name, starting_cable, starting_side, starting
     next_cable = starting_cable
     next_port = starting_port
     other_side = "crateSide" if starting_side == "detSide" else "detSide"
+    visited = set()
 
     while next_cable:
+        # stop on loops, see validate_connectivity
+        if next_cable["_id"] in visited:
+            break
+        visited.add(next_cable["_id"])
         path.append(next_cable["name"]) if next_cable[
             "name"
         ] != starting_point_name else None
@@ -993,9 +4184,7 @@ def traverse_cables(starting_point_name, starting_cable, starting_side, starting
                     ),
                     None,
                 )
-                next_crate = crates_collection.find_one(
-                    {"_id": ObjectId(next_crate_id)}
-                )
+                next_crate = crates_cache.get()["by_id"].get(str(next_crate_id))
                 if next_crate:
                     path.append(next_crate["name"])
             # reached end of cables, append the module if starting from crateSide
@@ -1027,11 +4216,14 @@ def traverse_cables(starting_point_name, starting_cable, starting_side, starting
 
     return path
 
-@app.route("/cablingSnapshot", methods=["POST"])
+@bp.route("/cablingSnapshot", methods=["POST"])
 def new_cabling_snapshot():
     """
     Endpoint for creating a new cabling snapshot.
 
+    Modules and crates are served from the materialized connection_snapshot
+    collection, which is recomputed first if it is stale; cables are traversed.
+
     Parameters:
     - starting_point_name (str): The name of the starting point.
     - starting_side (str): The side of the starting point.
@@ -1047,20 +4239,513 @@ def new_cabling_snapshot():
     starting_point_name = data.get("starting_point_name")
     starting_side = data.get("starting_side")
     starting_port = data.get("starting_port", 1)
-    
-    # Fetch all cable templates
-    cable_templates = list(cable_templates_collection.find({}))
+
+    snapshot = connection_snapshot_collection.find_one(
+        {"First": starting_point_name, "StartingSide": starting_side}
+    )
+    if snapshot and snapshot["stale"]:
+        refresh_connection_snapshots([starting_point_name])
+        snapshot = connection_snapshot_collection.find_one(
+            {"First": starting_point_name, "StartingSide": starting_side}
+        )
+    if snapshot:
+        return {"cablingPath": snapshot["Chain"]}, 200
 
     starting_cable, starting_port = find_starting_cable(starting_point_name, starting_side, starting_port)
 
     if not starting_cable:
         return {"message": "Starting point not found"}, 404
 
-    path = traverse_cables(starting_point_name, starting_cable, starting_side, starting_port, cable_templates)
+    path = traverse_cables(starting_point_name, starting_cable, starting_side, starting_port, cable_templates())
 
     return {"cablingPath": path}, 200
 
 
 
+# compact cable graph export for offline analysis
+
+NODE_KINDS = {"module": 0, "crate": 1, "cable": 2}
+SIDES = {"detSide": 0, "crateSide": 1}
+
+
+def build_cable_graph():
+    """
+    Builds the whole cable plant as flat NumPy arrays, with one bulk read per collection.
+
+    Nodes are all modules, crates and cables; the adjacency is stored in CSR
+    form, row i holding the connections of node i (only cables have any):
+    node_ids, node_names, node_kinds (see NODE_KINDS), node_types (index into
+    template_types, -1 if not a cable or unknown type), node_attached (for
+    modules and crates the node index of the cable in connectedTo, -1 if
+    not connected, -2 if it references nothing), adj_indptr,
+    adj_target (node index, -1 for dangling references), adj_port and
+    adj_side (see SIDES). Template routing tables are also in CSR form, one
+    row per (input, output) pair: template_types, routing_indptr,
+    routing_in, routing_out.
+
+    Returns:
+        dict: The arrays, ready for numpy.savez.
+    """
+    # imported here so that the API does not pay for NumPy at import time
+    import numpy as np
+
+    templates = list(cable_templates_collection.find({}, {"type": 1, "internalRouting": 1}))
+    template_index = {template["type"]: i for i, template in enumerate(templates)}
+    routing_indptr = [0]
+    routing_in = []
+    routing_out = []
+    for template in templates:
+        for port_in, ports_out in template["internalRouting"].items():
+            for port_out in ports_out if isinstance(ports_out, list) else [ports_out]:
+                routing_in.append(int(port_in))
+                routing_out.append(int(port_out))
+        routing_indptr.append(len(routing_in))
+
+    modules = list(modules_collection.find({}, {"moduleID": 1, "connectedTo": 1}))
+    crates = list(crates_collection.find({}, {"name": 1, "connectedTo": 1}))
+    cables = list(cables_collection.find({}, {"name": 1, "type": 1, "detSide": 1, "crateSide": 1}))
+    node_ids = [module["_id"] for module in modules] + [crate["_id"] for crate in crates]
+    node_ids += [cable["_id"] for cable in cables]
+    node_names = [module.get("moduleID", "") for module in modules]
+    node_names += [crate.get("name", "") for crate in crates]
+    node_names += [cable.get("name", "") for cable in cables]
+    node_kinds = [NODE_KINDS["module"]] * len(modules) + [NODE_KINDS["crate"]] * len(crates)
+    node_kinds += [NODE_KINDS["cable"]] * len(cables)
+    node_types = [-1] * (len(modules) + len(crates))
+    node_types += [template_index.get(cable.get("type"), -1) for cable in cables]
+    index = {str(_id): i for i, _id in enumerate(node_ids)}
+    node_attached = [
+        index.get(str(endpoint["connectedTo"]), -2) if endpoint.get("connectedTo") else -1
+        for endpoint in modules + crates
+    ]
+    node_attached += [-1] * len(cables)
+
+    adj_indptr = [0] * (len(modules) + len(crates) + 1)
+    adj_target = []
+    adj_port = []
+    adj_side = []
+    for cable in cables:
+        for side, side_code in SIDES.items():
+            for conn in cable.get(side, []):
+                adj_target.append(index.get(str(conn.get("connectedTo")), -1))
+                adj_port.append(conn.get("port", -1))
+                adj_side.append(side_code)
+        adj_indptr.append(len(adj_target))
+
+    return {
+        "node_ids": np.array([str(_id) for _id in node_ids], dtype="U24"),
+        "node_names": np.array(node_names, dtype=str),
+        "node_kinds": np.array(node_kinds, dtype=np.int8),
+        "node_types": np.array(node_types, dtype=np.int32),
+        "node_attached": np.array(node_attached, dtype=np.int64),
+        "adj_indptr": np.array(adj_indptr, dtype=np.int64),
+        "adj_target": np.array(adj_target, dtype=np.int64),
+        "adj_port": np.array(adj_port, dtype=np.int32),
+        "adj_side": np.array(adj_side, dtype=np.int8),
+        "template_types": np.array([template["type"] for template in templates], dtype=str),
+        "routing_indptr": np.array(routing_indptr, dtype=np.int64),
+        "routing_in": np.array(routing_in, dtype=np.int32),
+        "routing_out": np.array(routing_out, dtype=np.int32),
+    }
+
+
+def write_cable_graph(file):
+    import numpy as np
+
+    np.savez_compressed(file, **build_cable_graph())
+
+
+@bp.route("/cableGraph", methods=["GET"])
+def cable_graph():
+    """
+    Returns the whole cable graph as a compressed NumPy .npz file, see build_cable_graph.
+    Load it with numpy.load.
+    """
+    buffer = io.BytesIO()
+    write_cable_graph(buffer)
+    buffer.seek(0)
+    return send_file(
+        buffer,
+        mimetype="application/octet-stream",
+        as_attachment=True,
+        download_name="cable_graph.npz",
+    )
+
+
+@bp.cli.command("export-cable-graph")
+@click.argument("path")
+def export_cable_graph_command(path):
+    """Write the whole cable graph to an .npz file."""
+    with open(path, "wb") as f:
+        write_cable_graph(f)
+    print(f"Cable graph written to {path}")
+
+
+def validate_connectivity():
+    """
+    Checks the invariants of the whole cable plant in one vectorized pass.
+
+    The graph is loaded with build_cable_graph and checked for: connections
+    to objects that do not exist (dangling), ports used twice on the same
+    side of a cable, cable to cable links without the link back (asymmetric),
+    ports missing from the cable template, modules and crates whose
+    connectedTo cable does not list them, and loops of cables.
+
+    Returns:
+        list: One {"check", "name", "side", "port", "message"} dict per violation.
+    """
+    import numpy as np
+
+    graph = build_cable_graph()
+    names = graph["node_names"]
+    kinds = graph["node_kinds"]
+    n_nodes = len(names)
+    side_names = {code: side for side, code in SIDES.items()}
+    source = np.repeat(np.arange(n_nodes), np.diff(graph["adj_indptr"]))
+    target = graph["adj_target"]
+    port = graph["adj_port"].astype(np.int64)
+    side = graph["adj_side"].astype(np.int64)
+    violations = []
+
+    def report(check, edges, message):
+        for edge in np.flatnonzero(edges):
+            violations.append(
+                {
+                    "check": check,
+                    "name": str(names[source[edge]]),
+                    "side": side_names[int(side[edge])],
+                    "port": int(port[edge]),
+                    "message": message(edge),
+                }
+            )
+
+    report("dangling", target < 0, lambda edge: "Connected to an object that does not exist")
+
+    # the same (cable, side, port) more than once
+    port_keys = (source * 2 + side) * (port.max(initial=0) + 1) + port
+    unique, inverse, counts = np.unique(port_keys, return_inverse=True, return_counts=True)
+    report("port used twice", counts[inverse] > 1, lambda edge: "Port used more than once")
+
+    # every cable to cable link must have the link back on the opposite side
+    cable_link = (target >= 0) & (kinds[np.maximum(target, 0)] == NODE_KINDS["cable"])
+    links = (source * 2 + side) * n_nodes + target
+    backs = (target * 2 + (1 - side)) * n_nodes + source
+    report(
+        "asymmetric",
+        cable_link & ~np.isin(backs, links[cable_link]),
+        lambda edge: f"{names[target[edge]]} has no link back",
+    )
+
+    # ports must exist in the template: inputs on the detSide, outputs on the crateSide
+    types = graph["node_types"][source]
+    template_of_route = np.repeat(
+        np.arange(len(graph["template_types"])), np.diff(graph["routing_indptr"])
+    )
+    width = 1 + max(
+        port.max(initial=0),
+        graph["routing_in"].max(initial=0),
+        graph["routing_out"].max(initial=0),
+    )
+    known_ports = np.concatenate(
+        [
+            (template_of_route * 2 + SIDES["detSide"]) * width + graph["routing_in"],
+            (template_of_route * 2 + SIDES["crateSide"]) * width + graph["routing_out"],
+        ]
+    )
+    for node in np.flatnonzero((kinds == NODE_KINDS["cable"]) & (graph["node_types"] < 0)):
+        violations.append(
+            {"check": "no template", "name": str(names[node]), "side": None, "port": None,
+             "message": "The cable type has no template"}
+        )
+    report(
+        "port not in template",
+        (types >= 0) & (port >= 0) & ~np.isin((types * 2 + side) * width + port, known_ports),
+        lambda edge: "Port not in the cable template",
+    )
+
+    # modules and crates must be listed by the cable they are attached to
+    attached = graph["node_attached"]
+    for node in np.flatnonzero(attached == -2):
+        violations.append(
+            {"check": "dangling", "name": str(names[node]), "side": None, "port": None,
+             "message": "connectedTo references a cable that does not exist"}
+        )
+    endpoint_links = set((target * n_nodes + source)[target >= 0].tolist())
+    for node in np.flatnonzero(attached >= 0):
+        if node * n_nodes + attached[node] not in endpoint_links:
+            violations.append(
+                {"check": "asymmetric", "name": str(names[node]), "side": None, "port": None,
+                 "message": f"{names[attached[node]]} does not list it"}
+            )
+
+    # loops: peel off cables without incoming crate-ward links until nothing changes
+    towards_crate = cable_link & (side == SIDES["crateSide"])
+    edge_from = source[towards_crate]
+    edge_to = target[towards_crate]
+    alive = np.ones(n_nodes, dtype=bool)
+    while True:
+        live_edges = alive[edge_from] & alive[edge_to]
+        in_degree = np.bincount(edge_to[live_edges], minlength=n_nodes)
+        out_degree = np.bincount(edge_from[live_edges], minlength=n_nodes)
+        removable = alive & ((in_degree == 0) | (out_degree == 0))
+        if not removable.any():
+            break
+        alive &= ~removable
+    for node in np.flatnonzero(alive):
+        violations.append(
+            {"check": "loop", "name": str(names[node]), "side": None, "port": None,
+             "message": "Cable is part of a loop"}
+        )
+    return violations
+
+
+@bp.route("/validateConnectivity", methods=["GET"])
+def validate_connectivity_route():
+    start = time.perf_counter()
+    violations = validate_connectivity()
+    return jsonify(
+        {"violations": violations, "seconds": time.perf_counter() - start}
+    ), 200
+
+
+@bp.cli.command("validate-connectivity")
+def validate_connectivity_command():
+    """Check the whole cable plant and list the violations."""
+    violations = validate_connectivity()
+    for violation in violations:
+        print(
+            f"{violation['check']}: {violation['name']} {violation['side'] or ''} "
+            f"{violation['port'] if violation['port'] is not None else ''} - {violation['message']}"
+        )
+    print(f"{len(violations)} violations")
+    if violations:
+        raise SystemExit(1)
+
+
+# materialized connection snapshots: the chain of every module (from its
+# detSide) and of every crate (from its crateSide) is kept in
+# connection_snapshot and recomputed when something along it is written
+
+
+def compute_connection_snapshot(name, side, cable_templates):
+    """
+    Computes the chain starting from a module or crate.
+
+    Args:
+        name (str): The moduleID of the module or the name of the crate.
+        side (str): "detSide" for modules, "crateSide" for crates.
+        cable_templates (list): A list of cable templates.
+
+    Returns:
+        dict: The ConnectionSnapshot document, or None if the starting point is
+        not connected or the chain cannot be followed.
+    """
+    starting_cable, starting_port = find_starting_cable(name, side, 1)
+    if not starting_cable:
+        return None
+    try:
+        path = traverse_cables(name, starting_cable, side, starting_port, cable_templates)
+    except (TypeError, ValueError, KeyError):
+        return None
+    snapshot = {"First": name, "Last": path[-1], "Chain": path}
+    validate(instance=snapshot, schema=connection_snapshot_schema)
+    snapshot.update({"StartingSide": side, "stale": False})
+    return snapshot
+
+
+def store_connection_snapshots(starting_points, cable_templates):
+    """
+    Recomputes and stores the chains of the given (name, side) starting points.
+
+    Returns:
+        int: The number of chains stored.
+    """
+    operations = []
+    for name, side in starting_points:
+        snapshot = compute_connection_snapshot(name, side, cable_templates)
+        key = {"First": name, "StartingSide": side}
+        if snapshot:
+            operations.append(pymongo.ReplaceOne(key, snapshot, upsert=True))
+        else:
+            operations.append(pymongo.DeleteOne(key))
+    if operations:
+        connection_snapshot_collection.bulk_write(operations, ordered=False)
+    return sum(isinstance(op, pymongo.ReplaceOne) for op in operations)
+
+
+def connected_starting_points(query_modules, query_crates):
+    starting_points = set()
+    for module in modules_collection.find(query_modules, {"moduleID": 1}):
+        starting_points.add((module["moduleID"], "detSide"))
+    for crate in crates_collection.find(query_crates, {"name": 1}):
+        starting_points.add((crate["name"], "crateSide"))
+    return starting_points
+
+
+def refresh_connection_snapshots(names):
+    """
+    Recomputes only the materialized chains affected by a write.
+
+    These are the chains passing through any of the given module, crate or
+    cable names, the chains starting from them and the chains of the modules
+    and crates plugged into those cables.
+
+    Args:
+        names (list): The names of the written modules, crates or cables.
+    """
+    names = [name for name in names if name is not None]
+    if not names:
+        return
+    starting_points = {
+        (snapshot["First"], snapshot["StartingSide"])
+        for snapshot in connection_snapshot_collection.find(
+            {"Chain": {"$in": names}}, {"First": 1, "StartingSide": 1}
+        )
+    }
+    cable_ids = [
+        cable["_id"] for cable in cables_collection.find({"name": {"$in": names}}, {"_id": 1})
+    ]
+    connected = {"$in": cable_ids + [str(_id) for _id in cable_ids]}
+    starting_points |= connected_starting_points(
+        {"$or": [{"moduleID": {"$in": names}}, {"connectedTo": connected}]},
+        {"$or": [{"name": {"$in": names}}, {"connectedTo": connected}]},
+    )
+    if not starting_points:
+        return
+    connection_snapshot_collection.update_many(
+        {"First": {"$in": [name for name, side in starting_points]}},
+        {"$set": {"stale": True}},
+    )
+    store_connection_snapshots(starting_points, cable_templates())
+
+
+def rebuild_connection_snapshots():
+    """
+    Drops and recomputes the chains of every connected module and crate.
+
+    Returns:
+        int: The number of chains stored.
+    """
+    connection_snapshot_collection.delete_many({})
+    starting_points = connected_starting_points(
+        {"connectedTo": {"$exists": True}}, {"connectedTo": {"$exists": True}}
+    )
+    return store_connection_snapshots(starting_points, cable_templates())
+
+
+@bp.route("/connectionSnapshot/<string:name>", methods=["GET"])
+def get_connection_snapshot(name):
+    """
+    Returns the materialized chain of a module or crate, with its stale flag.
+    """
+    snapshot = connection_snapshot_collection.find_one({"First": name})
+    if not snapshot:
+        return {"message": "Snapshot not found"}, 404
+    snapshot.pop("_id")
+    return jsonify(snapshot)
+
+
+@bp.route("/rebuildConnectionSnapshots", methods=["POST"])
+def rebuild_connection_snapshots_route():
+    count = rebuild_connection_snapshots()
+    return {"message": "Snapshots rebuilt", "count": count}, 200
+
+
+@bp.cli.command("rebuild-name-registry")
+def rebuild_name_registry_command():
+    """Recreate the module/crate/cable name registry."""
+    print(f"{rebuild_name_registry()} names registered")
+
+
+@bp.cli.command("benchmark-extractor")
+@click.option("--names", default=100000, help="Number of known names in the automaton.")
+@click.option("--size", default=10, help="Megabytes of text to scan.")
+def benchmark_extractor_command(names, size):
+    """Measure the throughput of the entity extractor on synthetic logbook text."""
+    import random
+
+    known = {f"PS_{i // 1000:02d}_05_IPG-{i:05d}": "module" for i in range(names // 2)}
+    known.update({f"Cable {i}": "cable" for i in range(names - len(known))})
+    start = time.perf_counter()
+    automaton = AhoCorasick(known)
+    build = time.perf_counter() - start
+
+    words = ["mounted", "on", "the", "tray", "after", "visual", "inspection", "OK", "bonded"]
+    ids = list(known)
+    chunks = []
+    length = 0
+    while length < size * 2**20:
+        chunk = " ".join(random.choice(words) for _ in range(20)) + f" {random.choice(ids)}."
+        chunks.append(chunk)
+        length += len(chunk)
+    text = " ".join(chunks)
+
+    start = time.perf_counter()
+    found = sum(1 for _ in automaton.matches(text))
+    scan = time.perf_counter() - start
+    start = time.perf_counter()
+    found_pattern = sum(1 for pattern in ENTITY_PATTERNS.values() for _ in pattern.finditer(text))
+    pattern_scan = time.perf_counter() - start
+    megabytes = len(text) / 2**20
+    print(f"automaton: {len(known)} names built in {build:.2f} s")
+    print(f"automaton scan: {megabytes / scan:.1f} MB/s, {found} matches")
+    print(f"pattern scan: {megabytes / pattern_scan:.1f} MB/s, {found_pattern} matches")
+
+
+@bp.cli.command("ensure-indexes")
+def ensure_indexes_command():
+    """Create the indexes used by the API."""
+    ensure_indexes()
+    print("Indexes created")
+
+
+@bp.cli.command("rebuild-snapshots")
+def rebuild_connection_snapshots_command():
+    """Recompute every materialized connection snapshot."""
+    print(f"{rebuild_connection_snapshots()} snapshots rebuilt")
+
+
+def create_app(config=None):
+    """
+    Creates the Flask application of the API.
+
+    No connection is opened here: the database is connected by the first
+    query, and the indexes are ensured on the first request.
+
+    Args:
+        config (dict, optional): Settings overriding DEFAULT_CONFIG, e.g. MONGO_URI and MONGO_DB_NAME.
+            The database, the logbook writer and the entity extractor are shared
+            by the apps of a process and take the settings of the last app created.
+
+    Returns:
+        Flask: The application.
+    """
+    app = Flask(__name__)
+    app.json = CustomJSONProvider(app)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update(config or {})
+    if (app.config["MONGO_URI"], app.config["MONGO_DB_NAME"]) != (db.uri, db.name):
+        db.configure(app.config["MONGO_URI"], app.config["MONGO_DB_NAME"])
+    logbook_writer.flush_size = app.config["LOGBOOK_FLUSH_SIZE"]
+    logbook_writer.flush_interval = app.config["LOGBOOK_FLUSH_INTERVAL"]
+    logbook_writer.queue.maxsize = app.config["LOGBOOK_QUEUE_SIZE"]
+    entity_extractor.refresh_seconds = app.config["EXTRACTOR_REFRESH_SECONDS"]
+    entity_extractor.max_delta = app.config["EXTRACTOR_MAX_DELTA"]
+    for caches in CACHES_BY_COLLECTION.values():
+        for cache in caches:
+            cache.ttl = app.config["CACHE_TTL_SECONDS"]
+            cache.version_check = app.config["CACHE_VERSION_CHECK_SECONDS"]
+    workers = max(app.config["ADMISSION_WORKERS"], 1)
+    app.extensions["localdb_admission"] = {
+        group: AdmissionLimit(-(-running // workers), -(-waiting // workers))
+        for group, (running, waiting, seconds) in app.config["ADMISSION_LIMITS"].items()
+    }
+    app.register_blueprint(bp)
+    return app
+
+
+app = create_app()
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5005, debug=False)
@@ -7,15 +7,26 @@ from PyQt5.QtWidgets import (
     QLabel,
     QFormLayout,
     QMessageBox,
-    QListWidget,
+    QTableView,
+    QHBoxLayout,
+    QAbstractItemView,
     QTextEdit
 )
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import (
+    Qt,
+    QAbstractTableModel,
+    QModelIndex,
+    QObject,
+    QThread,
+    pyqtSignal,
+    pyqtSlot,
+)
 from pymongo import MongoClient
 from dotenv import load_dotenv
 import os
 from jsonschema import validate, ValidationError
 import json
+import re
 
 
 load_dotenv("mongo.env")
@@ -30,6 +41,219 @@ with open("module_schema.json", "r") as f:
     module_schema = json.load(f)
 
 
+# columns of the module tables: (field, header); only these fields are fetched
+MODULE_COLUMNS = [
+    ("moduleID", "Module"),
+    ("position", "Position"),
+    ("status", "Status"),
+    ("overall_grade", "Grade"),
+]
+MODULE_PROJECTION = {field: 1 for field, _ in MODULE_COLUMNS}
+
+# one thread runs the module queries of all the tables, so the GUI never waits on MongoDB
+_fetch_thread = None
+
+
+def fetch_thread():
+    global _fetch_thread
+    if _fetch_thread is None:
+        _fetch_thread = QThread()
+        _fetch_thread.start()
+        QApplication.instance().aboutToQuit.connect(stop_fetch_thread)
+    return _fetch_thread
+
+
+def stop_fetch_thread():
+    _fetch_thread.quit()
+    _fetch_thread.wait()
+
+
+class ModuleFetcher(QObject):
+    """Runs the page queries of a ModuleTableModel on the fetch thread."""
+
+    fetched = pyqtSignal(object, int)
+    failed = pyqtSignal(str, int)
+
+    @pyqtSlot(object, object, int, int)
+    def fetch(self, query, after, limit, generation):
+        # keyset pagination on _id: a page starts where the previous one ended
+        # instead of skipping over it, but with filters the _id index scan still
+        # examines the non matching documents on the way
+        if after is not None:
+            query = {"$and": [query, {"_id": {"$gt": after}}]}
+        try:
+            rows = list(db.modules.find(query, MODULE_PROJECTION).sort("_id", 1).limit(limit))
+        except Exception as e:
+            # every fetch answers, or the table would wait for this page forever
+            self.failed.emit(str(e), generation)
+            return
+        self.fetched.emit(rows, generation)
+
+
+class DocumentFetcher(QObject):
+    """Reads single modules by _id on the fetch thread."""
+
+    fetched = pyqtSignal(object, int)
+    failed = pyqtSignal(str, int)
+
+    @pyqtSlot(object, int)
+    def fetch(self, _id, request):
+        try:
+            document = db.modules.find_one({"_id": _id})
+        except Exception as e:
+            self.failed.emit(str(e), request)
+            return
+        self.fetched.emit(document, request)
+
+
+class ModuleTableModel(QAbstractTableModel):
+    """
+    Table of the modules matching a query, loaded a page at a time as the view scrolls.
+
+    The view asks for more rows through canFetchMore/fetchMore; the page is
+    queried by a ModuleFetcher on the fetch thread and appended when it arrives.
+    Pages of a previous query arriving after set_query are dropped. A failed
+    page is reported through fetch_error once: no more pages are fetched
+    until retry() or set_query.
+    """
+
+    fetch_requested = pyqtSignal(object, object, int, int)
+    fetch_error = pyqtSignal(str)
+
+    def __init__(self, batch_size=500, parent=None):
+        super().__init__(parent)
+        self.batch_size = batch_size
+        self.rows = []
+        self.query = {}
+        self.generation = 0
+        self.loading = False
+        self.exhausted = False
+        self.failed = False
+        self.fetcher = ModuleFetcher()
+        self.fetcher.moveToThread(fetch_thread())
+        self.fetch_requested.connect(self.fetcher.fetch)
+        self.fetcher.fetched.connect(self.add_rows)
+        self.fetcher.failed.connect(self.fetch_failed)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(MODULE_COLUMNS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        return str(self.rows[index.row()].get(MODULE_COLUMNS[index.column()][0], ""))
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return MODULE_COLUMNS[section][1]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted and not self.loading and not self.failed
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        self.loading = True
+        after = self.rows[-1]["_id"] if self.rows else None
+        self.fetch_requested.emit(self.query, after, self.batch_size, self.generation)
+
+    def set_query(self, query):
+        self.beginResetModel()
+        self.rows = []
+        self.query = query
+        self.generation += 1
+        self.loading = False
+        self.exhausted = False
+        self.failed = False
+        self.endResetModel()
+        self.fetchMore()
+
+    def retry(self):
+        """Fetches the page that failed again."""
+        self.failed = False
+        self.fetchMore()
+
+    @pyqtSlot(object, int)
+    def add_rows(self, rows, generation):
+        if generation != self.generation:
+            return
+        self.loading = False
+        self.exhausted = len(rows) < self.batch_size
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+            self.rows.extend(rows)
+            self.endInsertRows()
+
+    @pyqtSlot(str, int)
+    def fetch_failed(self, message, generation):
+        if generation != self.generation:
+            return
+        self.loading = False
+        # the view asks for more rows on every scroll: stop here rather than report the error again
+        self.failed = True
+        self.fetch_error.emit(message)
+
+    def module_id(self, row):
+        return self.rows[row]["_id"]
+
+
+class ModuleBrowser(QWidget):
+    """A module table with filters on the module ID prefix and the status, applied by MongoDB."""
+
+    def __init__(self, button_text="Search"):
+        super().__init__()
+
+        layout = QVBoxLayout()
+        filters = QHBoxLayout()
+
+        self.module_filter = QLineEdit()
+        self.module_filter.setPlaceholderText("Module ID starts with")
+        self.module_filter.returnPressed.connect(self.apply_filters)
+        self.status_filter = QLineEdit()
+        self.status_filter.setPlaceholderText("Status")
+        self.status_filter.returnPressed.connect(self.apply_filters)
+        filter_button = QPushButton(button_text)
+        filter_button.clicked.connect(self.apply_filters)
+
+        filters.addWidget(self.module_filter)
+        filters.addWidget(self.status_filter)
+        filters.addWidget(filter_button)
+        layout.addLayout(filters)
+
+        self.model = ModuleTableModel(parent=self)
+        self.model.fetch_error.connect(self.show_fetch_error)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        layout.addWidget(self.table)
+
+        self.setLayout(layout)
+
+    def apply_filters(self):
+        query = {}
+        if self.module_filter.text():
+            # an anchored prefix regex is served by the moduleID index
+            query["moduleID"] = {"$regex": "^" + re.escape(self.module_filter.text())}
+        if self.status_filter.text():
+            query["status"] = self.status_filter.text()
+        self.model.set_query(query)
+
+    def show_fetch_error(self, message):
+        answer = QMessageBox.warning(
+            self,
+            "Query failed",
+            f"The modules could not be loaded: {message}",
+            QMessageBox.Retry | QMessageBox.Cancel,
+        )
+        if answer == QMessageBox.Retry:
+            self.model.retry()
+
+
 class WelcomeScreen(QWidget):
     def __init__(self):
         super().__init__()
@@ -129,64 +353,67 @@ class InsertScreen(QWidget):
             print(f"Validation Error: {e.message}")
 
 class BrowseScreen(QWidget):
+    module_requested = pyqtSignal(object, int)
+
     def __init__(self):
         super().__init__()
 
         layout = QVBoxLayout()
 
-        # Search Bar
-        self.search_bar = QLineEdit()
-        layout.addWidget(QLabel("Search by Inventory:"))
-        layout.addWidget(self.search_bar)
-
-        # Search Button
-        search_button = QPushButton("Search")
-        search_button.clicked.connect(self.search_module)
-        layout.addWidget(search_button)
+        # Module table with its search bar
+        self.browser = ModuleBrowser()
+        self.browser.table.clicked.connect(self.show_module)
+        layout.addWidget(QLabel("Search by Module ID and status:"))
+        layout.addWidget(self.browser)
 
         # Display Area
         self.result_area = QTextEdit()
         self.result_area.setReadOnly(True)
         layout.addWidget(self.result_area)
 
+        # the clicked module is read on the fetch thread; only the last click is shown
+        self.request = 0
+        self.fetcher = DocumentFetcher()
+        self.fetcher.moveToThread(fetch_thread())
+        self.module_requested.connect(self.fetcher.fetch)
+        self.fetcher.fetched.connect(self.module_fetched)
+        self.fetcher.failed.connect(self.module_failed)
+
         self.setLayout(layout)
         self.setWindowTitle('Browse Screen')
-
-
-    def fetch_modules(self):
-        self.list_widget.clear()
-        for module in db.modules.find():
-            self.list_widget.addItem(f"Module: {module['inventory']} - Position: {module['position']}")
-
-    def search_module(self):
-        search_inventory = self.search_bar.text()
-        query_result = db.modules.find_one({"inventory": search_inventory})
-
+        self.browser.apply_filters()
+
+    def show_module(self, index):
+        # a single lookup by _id, the full document is only read for the clicked module
+        self.request += 1
+        self.result_area.setText("Loading...")
+        self.module_requested.emit(self.browser.model.module_id(index.row()), self.request)
+
+    @pyqtSlot(object, int)
+    def module_fetched(self, query_result, request):
+        if request != self.request:
+            return
         if query_result:
             self.result_area.setText(str(query_result))
         else:
-            self.result_area.setText("No module found with the specified inventory.")
+            self.result_area.setText("The module has been deleted.")
+
+    @pyqtSlot(str, int)
+    def module_failed(self, message, request):
+        if request == self.request:
+            self.result_area.setText(f"The module could not be loaded: {message}")
 
 class ModifyScreen(QWidget):
     def __init__(self):
         super().__init__()
 
         layout = QVBoxLayout()
-        self.list_widget = QListWidget()
+        self.browser = ModuleBrowser('Fetch Modules')
 
-        layout.addWidget(self.list_widget)
-        fetch_button = QPushButton('Fetch Modules')
-        fetch_button.clicked.connect(self.fetch_modules)
-
-        layout.addWidget(fetch_button)
+        layout.addWidget(self.browser)
         self.setLayout(layout)
         self.setWindowTitle('Modify Screen')
 
-    def fetch_modules(self):
-        self.list_widget.clear()
-        for module in db.modules.find():
-            self.list_widget.addItem(f"Module: {module['inventory']} - Position: {module['position']}")
-
 if __name__ == "__main__":
     app = QApplication([])
 
@@ -0,0 +1,446 @@
+"""
+Client library for the localdb REST API.
+
+LocalDBClient keeps one pooled keep-alive session, retries failed calls with
+backoff, pages through list queries and batches writes, sending them
+concurrently:
+
+    with LocalDBClient("http://localhost:5005") as db:
+        with db.batch() as batch:
+            for module in modules:
+                batch.insert("modules", module)
+        for module in db.iter_query("modules", {"status": "ok"}):
+            ...
+"""
+import base64
+import concurrent.futures
+import threading
+import time
+
+import bson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+
+def encode_ndarray(array):
+    """
+    Encodes a NumPy array for the testResults of a test.
+
+    Args:
+        array (numpy.ndarray): A numeric array.
+
+    Returns:
+        dict: The {"__ndarray__": ...} JSON representation of the array.
+    """
+    # imported here so that the client does not need NumPy unless arrays are used
+    import numpy as np
+
+    array = np.ascontiguousarray(array)
+    return {
+        "__ndarray__": {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "data": base64.b64encode(array.tobytes()).decode("ascii"),
+        }
+    }
+
+
+def decode_ndarrays(obj):
+    """
+    Replaces every stored array of a BSON-decoded document with a NumPy array.
+
+    The arrays are read-only views on the bytes of the document, so no element
+    is converted in Python.
+    """
+    if isinstance(obj, dict):
+        if len(obj) == 1 and "__ndarray__" in obj:
+            import numpy as np
+
+            spec = obj["__ndarray__"]
+            return np.frombuffer(spec["data"], dtype=spec["dtype"]).reshape(spec["shape"])
+        return {key: decode_ndarrays(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [decode_ndarrays(value) for value in obj]
+    return obj
+
+
+def get_test(api_url, testID, session=None):
+    """
+    Fetches a test with its arrays decoded as NumPy arrays, see LocalDBClient.get_test.
+
+    Args:
+        api_url (str): The URL of the API, e.g. "http://localhost:5005".
+        testID (str): The testID of the test.
+        session (requests.Session, optional): The session to use, left open. Defaults to a new one.
+
+    Returns:
+        dict: The test, or None if it does not exist.
+    """
+    client = LocalDBClient(api_url)
+    if session is None:
+        with client:
+            return client.get_test(testID)
+    client.session.close()
+    client.session = session
+    return client.get_test(testID)
+
+
+# the key used in the URL of each resource, e.g. /modules/<moduleID>
+RESOURCE_KEYS = {
+    "modules": "moduleID",
+    "tests": "testID",
+    "cables": "name",
+    "crates": "name",
+    "cable_templates": "type",
+    "logbook": "_id",
+    "testpayloads": "_id",
+}
+# failed requests of these methods are retried whatever happened; the others
+# only when the API did not process them, see LocalDBClient.request
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE"}
+
+
+def not_sent(error):
+    """True if a failed request never reached the API: the connection could not be opened."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    # requests wraps the urllib3 error in a MaxRetryError
+    return isinstance(getattr(reason, "reason", reason), NewConnectionError)
+
+
+class LocalDBError(Exception):
+    """An API call failed; carries its status code and the message of the API."""
+
+    def __init__(self, status_code, message, method=None, path=None):
+        super().__init__(f"{method} {path}: {status_code} {message}")
+        self.status_code = status_code
+        self.message = message
+
+
+class BatchError(Exception):
+    """Some writes of a batch failed; failures holds (operation, exception) pairs, usually LocalDBErrors."""
+
+    def __init__(self, failures):
+        super().__init__(f"{len(failures)} writes failed, first: {failures[0][1]}")
+        self.failures = failures
+
+
+class LocalDBClient:
+    """
+    A client of the localdb REST API.
+
+    Args:
+        api_url (str): The URL of the API, e.g. "http://localhost:5005".
+        max_workers (int, optional): Concurrent requests, also the connection pool size. Defaults to 8.
+        retries (int, optional): Retries of a failed request. Defaults to 3.
+        backoff (float, optional): Delay before the first retry in seconds, doubled at each retry. Defaults to 0.5.
+        timeout (float, optional): Timeout of each request in seconds. Defaults to 30.
+        batch_size (int, optional): Writes queued by a batch before they are sent. Defaults to 200.
+    """
+
+    def __init__(self, api_url, max_workers=8, retries=3, backoff=0.5, timeout=30, batch_size=200):
+        self.api_url = api_url.rstrip("/")
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown()
+        self.session.close()
+
+    def request(self, method, path, **kwargs):
+        """
+        Sends a request, retrying with exponential backoff on connection errors and 5xx.
+
+        POST requests, which are not idempotent, are only retried when the API
+        did not process them: the connection could not be opened, or the API
+        refused the request with a 503 carrying Retry-After (admission control
+        or a full queue). A 504 or a dropped connection may hide a completed
+        write, so it is not retried. A Retry-After header sent by the API
+        overrides the backoff.
+
+        Returns:
+            requests.Response: The last response.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2**attempt
+            try:
+                response = self.session.request(method, self.api_url + path, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # a request that was sent may have been processed
+                if attempt == self.retries or not (idempotent or not_sent(e)):
+                    raise
+            else:
+                status = response.status_code
+                refused = status == 503 and "Retry-After" in response.headers
+                retry = refused or (status >= 500 and idempotent)
+                if not retry or attempt == self.retries:
+                    return response
+                if response.headers.get("Retry-After", "").isdigit():
+                    delay = int(response.headers["Retry-After"])
+            time.sleep(delay)
+
+    def call(self, method, path, **kwargs):
+        """
+        Sends a request and returns its decoded JSON body.
+
+        Raises:
+            LocalDBError: If the API answers with an error status.
+        """
+        response = self.request(method, path, **kwargs)
+        if response.status_code >= 400:
+            try:
+                message = response.json().get("message")
+            except ValueError:
+                message = response.text
+            raise LocalDBError(response.status_code, message, method, path)
+        return response.json() if response.content else None
+
+    def get(self, resource, key=None):
+        """Returns one document of a resource (None if it does not exist), or all of them."""
+        if key is None:
+            return self.call("GET", f"/{resource}")
+        try:
+            return self.call("GET", f"/{resource}/{key}")
+        except LocalDBError as e:
+            if e.status_code == 404:
+                return None
+            raise
+
+    def insert(self, resource, document):
+        return self.call("POST", f"/{resource}", json=document)
+
+    def update(self, resource, key, fields):
+        return self.call("PUT", f"/{resource}/{key}", json=fields)
+
+    def delete(self, resource, key):
+        return self.call("DELETE", f"/{resource}/{key}")
+
+    def bulk_update(self, collection, set_fields, ids=None, filter=None):
+        """
+        Sets fields on the documents named in ids or matching a /query filter, in one request.
+
+        Returns:
+            dict: The number of documents matched and modified.
+        """
+        body = {"$set": set_fields}
+        if ids is not None:
+            body["ids"] = list(ids)
+        if filter is not None:
+            body["filter"] = filter
+        return self.call("POST", f"/bulkUpdate/{collection}", json=body)
+
+    def batch_delete(self, collection, ids):
+        """
+        Deletes the documents with the given keys and the references to them, in one request.
+
+        Returns:
+            dict: The keys deleted and the number of documents cleaned per collection.
+        """
+        return self.call("POST", f"/batchDelete/{collection}", json={"ids": list(ids)})
+
+    def suggest_modules(self, prefix, limit=10):
+        """Returns the first moduleIDs starting with prefix."""
+        return self.call("GET", "/modules/_suggest", params={"prefix": prefix, "limit": limit})
+
+    def map(self, function, items, return_exceptions=False):
+        """
+        Calls function on every item using up to max_workers concurrent requests.
+
+        Args:
+            return_exceptions (bool, optional): Return the exception raised for an item in place of
+                its result, instead of re-raising the first one. Defaults to False.
+
+        Returns:
+            list: The results, in the order of items.
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(self.max_workers)
+        if not return_exceptions:
+            return list(self._executor.map(function, items))
+        futures = [self._executor.submit(function, item) for item in items]
+        return [future.exception() or future.result() for future in futures]
+
+    def iter_query(self, collection, filter=None, projection=None, page_size=500, allow_scan=False):
+        """
+        Iterates over the documents matching a /query filter, in _id order, one page per request.
+
+        Yields:
+            dict: The matching documents.
+        """
+        last = None
+        while True:
+            page_filter = dict(filter or {})
+            if last is not None:
+                # /query has no $and: the page bound joins the caller's _id operators,
+                # keeping the tighter of two $gt
+                condition = page_filter.get("_id", {})
+                if not isinstance(condition, dict):
+                    # a single _id fits in the first page
+                    return
+                condition = dict(condition)
+                condition["$gt"] = max(condition.get("$gt", last), last)
+                page_filter["_id"] = condition
+            query = {"filter": page_filter, "sort": [["_id", 1]], "limit": page_size, "allow_scan": allow_scan}
+            if projection is not None:
+                query["projection"] = projection
+            results = self.call("POST", f"/query/{collection}", json=query)["results"]
+            yield from results
+            if len(results) < page_size:
+                return
+            last = results[-1]["_id"]
+
+    def iter_logbook(self, page_size=100, **window):
+        """
+        Iterates over the logbook entries of a time window, see GET /logbook.
+
+        Args:
+            page_size (int, optional): Entries per request. Defaults to 100.
+            **window: from_, to and station; all entries if none is given.
+
+        Yields:
+            dict: The entries, in timestamp order.
+        """
+        params = {key.rstrip("_"): value for key, value in window.items()}
+        params.setdefault("from", "1970-01-01T00:00:00Z")
+        params["limit"] = page_size
+        while True:
+            page = self.call("GET", "/logbook", params=params)
+            yield from page["entries"]
+            if not page["next"]:
+                return
+            params["after"] = page["next"]
+
+    def iter_changes(self, since=0, collections=None, page_size=1000):
+        """
+        Iterates over the change feed from the since token up to now.
+
+        Yields:
+            dict: The changes; each carries its "seq", the token to resume after it.
+        """
+        params = {"since": since, "limit": page_size}
+        if collections:
+            params["collections"] = ",".join(collections)
+        while True:
+            page = self.call("GET", "/changes", params=params)
+            yield from page["changes"]
+            if not page["more"]:
+                return
+            params["since"] = page["token"]
+
+    def changes_token(self):
+        """Returns the current change feed token, from which to follow the changes of documents read after it."""
+        return self.call("GET", "/changes", params={"latest": 1})["token"]
+
+    def get_test(self, testID):
+        """
+        Fetches a test with its arrays decoded as NumPy arrays.
+
+        Returns:
+            dict: The test, or None if it does not exist.
+        """
+        response = self.request("GET", f"/tests/{testID}", params={"format": "bson"})
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return decode_ndarrays(bson.decode(response.content))
+
+    def batch(self, raise_on_error=True):
+        """Returns a WriteBatch; use it as a context manager so that it is flushed at the end."""
+        return WriteBatch(self, raise_on_error)
+
+
+class WriteBatch:
+    """
+    Queues writes and sends them batch_size at a time.
+
+    Inserts, updates and deletes are sent concurrently by the client; cable
+    connections are sent as one /batchConnectCables call per flush. Writes
+    are not ordered: do not queue two writes to the same document.
+    """
+
+    def __init__(self, client, raise_on_error=True):
+        self.client = client
+        self.raise_on_error = raise_on_error
+        self.writes = []
+        self.links = []
+        self.failures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.flush()
+            if self.failures and self.raise_on_error:
+                raise BatchError(self.failures)
+
+    def _queue(self, write):
+        self.writes.append(write)
+        if len(self.writes) + len(self.links) >= self.client.batch_size:
+            self.flush()
+
+    def insert(self, resource, document):
+        self._queue(("POST", f"/{resource}", document))
+
+    def update(self, resource, key, fields):
+        self._queue(("PUT", f"/{resource}/{key}", fields))
+
+    def delete(self, resource, key):
+        self._queue(("DELETE", f"/{resource}/{key}", None))
+
+    def connect(self, cable1_name, cable1_port, cable1_side, cable2_name, cable2_port):
+        self.links.append(
+            {
+                "cable1_name": cable1_name,
+                "cable1_port": cable1_port,
+                "cable1_side": cable1_side,
+                "cable2_name": cable2_name,
+                "cable2_port": cable2_port,
+            }
+        )
+        if len(self.writes) + len(self.links) >= self.client.batch_size:
+            self.flush()
+
+    def _send(self, write):
+        method, path, body = write
+        self.client.call(method, path, json=body)
+
+    def flush(self):
+        """Sends the queued writes; failed ones, whatever the error, are added to failures."""
+        writes, self.writes = self.writes, []
+        links, self.links = self.links, []
+        for write, error in zip(writes, self.client.map(self._send, writes, return_exceptions=True)):
+            if error is not None:
+                self.failures.append((write, error))
+        if links:
+            try:
+                results = self.client.call("POST", "/batchConnectCables", json={"links": links})["results"]
+            except Exception as e:
+                # none of the links is known to be connected
+                self.failures.extend((("POST", "/batchConnectCables", link), e) for link in links)
+                results = []
+            for result in results:
+                if result["status"] == "error":
+                    error = LocalDBError(409, result["message"], "POST", "/batchConnectCables")
+                    self.failures.append((("POST", "/batchConnectCables", links[result["index"]]), error))
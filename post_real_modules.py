@@ -1,7 +1,7 @@
-import requests
+from localdb_client import BatchError, LocalDBClient
 
 # The URL where your Flask API is running
-api_url = "http://localhost:5005/modules"  # Replace with your actual API URL
+api_url = "http://localhost:5005"  # Replace with your actual API URL
 
 # The new modules data
 new_modules = [
@@ -10,18 +10,16 @@ new_modules = [
     {"moduleID": "PS_40_05_IPG_00001", "position": "cleanroom", "status": "ok", }  # Perugia data
 ]
 
-# # Loop through each module and make a POST request to insert it
-# for module in new_modules:
-#     response = requests.post(api_url, json=module)
-#     if response.status_code == 201:
-#         print(f"Module {module['moduleID']} inserted successfully.")
-#     else:
-#         print(f"Failed to insert module {module['moduleID']}. Status code: {response.status_code}, Response: {response.json()}")
+with LocalDBClient(api_url) as localdb:
+    try:
+        with localdb.batch() as batch:
+            # # insert the modules
+            # for module in new_modules:
+            #     batch.insert("modules", module)
 
-# add to moduleID  PS_40_05-IBA_00001 the LpGBTFuseId 1216106599
-
-response = requests.put(api_url + "/PS_40_05-IBA_00001", json={"LpGBTFuseId": 1216106599})
-if response.status_code == 200:
-    print(f"Module PS_40_05-IBA_00001 updated successfully.")
-else:
-    print(f"Failed to update module PS_40_05-IBA_00001. Status code: {response.status_code}, Response: {response.json()}")
\ No newline at end of file
+            # add to moduleID  PS_40_05-IBA_00001 the LpGBTFuseId 1216106599
+            batch.update("modules", "PS_40_05-IBA_00001", {"LpGBTFuseId": 1216106599})
+        print("Modules updated successfully.")
+    except BatchError as e:
+        for (method, path, body), error in e.failures:
+            print(f"Failed: {method} {path}. Status code: {error.status_code}, Response: {error.message}")
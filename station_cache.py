@@ -0,0 +1,482 @@
+"""
+Station-side cache of the localdb REST API.
+
+StationCache mirrors the modules, cables and recent logbook entries in a
+local SQLite file, kept current through the /changes feed, so that reads
+never wait on the network. Writes are applied to the local copy at once and
+queued; sync() sends them in batches when the API is reachable:
+
+    cache = StationCache("station.sqlite", "http://localdb:5005")
+    cache.start_sync(interval=10)
+    module = cache.get("modules", "PS_40_05_IPG-00002")
+    cache.update("modules", "PS_40_05_IPG-00002", {"status": "mounted"})
+
+Every mirrored document carries its version, the change feed sequence number
+of its last change. A queued write remembers the version it was based on;
+if the document changes on the server before the write is sent, the write
+is not sent but kept as a conflict, see conflicts() and resolve(). The
+writes of the station are sent with its id in the X-Station header, so that
+its own changes, coming back through the feed, are not taken as conflicts.
+"""
+import datetime
+import json
+import sqlite3
+import threading
+import uuid
+
+import requests
+
+from localdb_client import LocalDBClient, LocalDBError
+
+
+# collection: key field
+MIRRORED_COLLECTIONS = {"modules": "moduleID", "cables": "name", "logbook": "_id"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    collection TEXT NOT NULL,
+    key TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (collection, key)
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    collection TEXT NOT NULL,
+    key TEXT NOT NULL,
+    op TEXT NOT NULL,
+    body TEXT,
+    base_version INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_key ON outbox (collection, key);
+CREATE TABLE IF NOT EXISTS state (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class StationCache:
+    """
+    A local SQLite mirror of the documents a station uses, with queued writes.
+
+    Args:
+        path (str): The SQLite file.
+        api_url (str, optional): The URL of the API; or pass client.
+        client (LocalDBClient, optional): The client used to sync.
+        logbook_days (int, optional): How many days of logbook entries are kept. Defaults to 14.
+    """
+
+    def __init__(self, path, api_url=None, client=None, logbook_days=14):
+        self.client = client or LocalDBClient(api_url)
+        self.logbook_days = logbook_days
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        with self.conn:
+            self.station_id = self._state("station_id", None)
+            if self.station_id is None:
+                self.station_id = uuid.uuid4().hex
+                self._set_state("station_id", self.station_id)
+        self._stop = threading.Event()
+        self._thread = None
+
+    # reads, served from the local copy
+
+    def _resolve(self, key):
+        """The real key of a document: a sent logbook entry keeps answering to its "local-<n>" key."""
+        key = str(key)
+        return self._state(f"alias:{key}", key) if key.startswith("local-") else key
+
+    def get(self, collection, key):
+        row = self.conn.execute(
+            "SELECT body FROM documents WHERE collection = ? AND key = ?", (collection, self._resolve(key))
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find(self, collection, **fields):
+        """Returns the documents of a collection whose top-level fields equal the given values."""
+        sql = "SELECT body FROM documents WHERE collection = ?"
+        params = [collection]
+        for field, value in fields.items():
+            sql += " AND json_extract(body, ?) = ?"
+            params += [f"$.{field}", value]
+        return [json.loads(body) for body, in self.conn.execute(sql, params)]
+
+    def recent_logbook(self, station=None):
+        """Returns the mirrored logbook entries, newest first."""
+        entries = self.find("logbook", station=station) if station else self.find("logbook")
+        return sorted(entries, key=lambda entry: entry.get("timestamp", ""), reverse=True)
+
+    # writes, applied locally and queued
+
+    def _queue(self, collection, key, op, body):
+        row = self.conn.execute(
+            "SELECT version FROM documents WHERE collection = ? AND key = ?", (collection, key)
+        ).fetchone()
+        cursor = self.conn.execute(
+            "INSERT INTO outbox (collection, key, op, body, base_version) VALUES (?, ?, ?, ?, ?)",
+            (collection, key, op, json.dumps(body) if body is not None else None, row[0] if row else 0),
+        )
+        return cursor.lastrowid
+
+    def _store(self, collection, key, version, document):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO documents (collection, key, version, body) VALUES (?, ?, ?, ?)",
+            (collection, key, version, json.dumps(document)),
+        )
+
+    def insert(self, collection, document):
+        """
+        Queues an insert. Logbook entries get a temporary "local-<n>" key until they are sent.
+
+        Returns:
+            str: The key of the document.
+        """
+        with self.lock, self.conn:
+            if collection == "logbook":
+                entry_id = self._queue(collection, "", "insert", document)
+                key = f"local-{entry_id}"
+                self.conn.execute("UPDATE outbox SET key = ? WHERE id = ?", (key, entry_id))
+            else:
+                key = str(document[MIRRORED_COLLECTIONS[collection]])
+                self._queue(collection, key, "insert", document)
+            self._store(collection, key, 0, dict(document, _id=key) if collection == "logbook" else document)
+        return key
+
+    def update(self, collection, key, fields):
+        with self.lock, self.conn:
+            key = self._resolve(key)
+            self._queue(collection, key, "update", fields)
+            document = self.get(collection, key)
+            if document is not None:
+                self.conn.execute(
+                    "UPDATE documents SET body = ? WHERE collection = ? AND key = ?",
+                    (json.dumps(dict(document, **fields)), collection, key),
+                )
+
+    def delete(self, collection, key):
+        with self.lock, self.conn:
+            key = self._resolve(key)
+            self._queue(collection, key, "delete", None)
+            self.conn.execute("DELETE FROM documents WHERE collection = ? AND key = ?", (collection, key))
+
+    # synchronization
+
+    def _state(self, name, default):
+        row = self.conn.execute("SELECT value FROM state WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else default
+
+    def _set_state(self, name, value):
+        self.conn.execute("INSERT OR REPLACE INTO state (name, value) VALUES (?, ?)", (name, str(value)))
+
+    def _logbook_cutoff(self):
+        cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=self.logbook_days)
+        # in the format of the API, so that the timestamps compare as strings
+        return cutoff.replace(tzinfo=None).isoformat() + "Z"
+
+    def _apply_server_document(self, collection, key, version, document, own=False):
+        """
+        Stores a server version of a document; pending writes based on an older version become conflicts.
+
+        A change made only by this station's own writes (own) is no conflict:
+        the pending writes queued meanwhile are rebased on it instead.
+        The pending writes are then applied again on the stored copy.
+        """
+        if own:
+            self.conn.execute(
+                "UPDATE outbox SET base_version = ? "
+                "WHERE collection = ? AND key = ? AND status = 'pending' AND base_version < ?",
+                (version, collection, key, version),
+            )
+        else:
+            self.conn.execute(
+                "UPDATE outbox SET status = 'conflict', error = 'changed on the server' "
+                "WHERE collection = ? AND key = ? AND status = 'pending' AND base_version < ?",
+                (collection, key, version),
+            )
+        if document is None:
+            self.conn.execute("DELETE FROM documents WHERE collection = ? AND key = ?", (collection, key))
+        elif collection != "logbook" or document.get("timestamp", "") >= self._logbook_cutoff():
+            self._store(collection, key, version, document)
+        self._reapply_pending(collection, key)
+
+    def _reapply_pending(self, collection, key):
+        """Applies the pending writes of a document on its local copy, as they were when queued."""
+        rows = self.conn.execute(
+            "SELECT op, body FROM outbox WHERE collection = ? AND key = ? AND status = 'pending' ORDER BY id",
+            (collection, key),
+        ).fetchall()
+        if not rows:
+            return
+        row = self.conn.execute(
+            "SELECT version FROM documents WHERE collection = ? AND key = ?", (collection, key)
+        ).fetchone()
+        document = self.get(collection, key)
+        for op, body in rows:
+            if op == "delete":
+                document = None
+            elif op == "insert":
+                document = json.loads(body)
+            elif document is not None:
+                document = dict(document, **json.loads(body))
+        if document is None:
+            self.conn.execute("DELETE FROM documents WHERE collection = ? AND key = ?", (collection, key))
+        else:
+            self._store(collection, key, row[0] if row else 0, document)
+
+    def load(self):
+        """
+        Loads the whole mirror from the API; done by the first pull.
+
+        The feed token is read first: the changes after it are applied by
+        the next pulls, the ones before it are already in the documents read.
+        """
+        token = self.client.changes_token()
+        documents = {
+            collection: self.client.get(collection) for collection in ("modules", "cables")
+        }
+        entries = list(self.client.iter_logbook(from_=self._logbook_cutoff()))
+        with self.lock, self.conn:
+            for collection, collection_documents in documents.items():
+                key_field = MIRRORED_COLLECTIONS[collection]
+                for document in collection_documents:
+                    self._store(collection, str(document[key_field]), token, document)
+            for entry in entries:
+                self._store("logbook", entry["_id"], token, entry)
+            self._set_state("token", token)
+            self._set_state("loaded", 1)
+
+    def pull(self):
+        """Applies the changes made on the server since the last pull."""
+        if not int(self._state("loaded", 0)):
+            self.load()
+        token = int(self._state("token", 0))
+        changes = self.client.iter_changes(since=token, collections=list(MIRRORED_COLLECTIONS))
+        with self.lock, self.conn:
+            for change in changes:
+                self._apply_server_document(
+                    change["collection"],
+                    str(change["key"]),
+                    change["seq"],
+                    change.get("document"),
+                    own=change.get("origins") == [self.station_id],
+                )
+                token = max(token, change["seq"])
+            self._set_state("token", token)
+            self.conn.execute(
+                "DELETE FROM documents WHERE collection = 'logbook' AND version > 0 "
+                "AND json_extract(body, '$.timestamp') < ?",
+                (self._logbook_cutoff(),),
+            )
+
+    def _send(self, entry):
+        """
+        Sends one queued write.
+
+        Returns:
+            str: The real _id of an inserted logbook entry, None for the other writes.
+        """
+        entry_id, collection, key, op, body = entry
+        body = json.loads(body) if body is not None else None
+        headers = {"X-Station": self.station_id}
+        if op == "insert":
+            result = self.client.call("POST", f"/{collection}", json=body, headers=headers)
+            if collection == "logbook":
+                real_id = result["_id"]
+                with self.lock, self.conn:
+                    # the local copy, with the updates queued meanwhile, moves to the real _id,
+                    # and so do the writes still queued on the temporary key
+                    document = self.get("logbook", key)
+                    self.conn.execute("DELETE FROM documents WHERE collection = 'logbook' AND key = ?", (key,))
+                    if document is not None:
+                        self._store("logbook", real_id, 0, dict(document, _id=real_id))
+                    self.conn.execute(
+                        "UPDATE outbox SET key = ? WHERE collection = 'logbook' AND key = ? AND id != ?",
+                        (real_id, key, entry_id),
+                    )
+                    self._set_state(f"alias:{key}", real_id)
+                return real_id
+        elif op == "update":
+            self.client.call("PUT", f"/{collection}/{key}", json=body, headers=headers)
+        else:
+            self.client.call("DELETE", f"/{collection}/{key}", headers=headers)
+        return None
+
+    def _restore(self, collection, key):
+        """Replaces the local copy of a document by the server one, after a write to it was rejected."""
+        document = None
+        if not key.startswith("local-"):
+            try:
+                document = self.client.get(collection, key)
+            except (requests.ConnectionError, requests.Timeout, LocalDBError):
+                # the local copy stays until the server is reachable; the write is kept as rejected
+                return
+        with self.lock, self.conn:
+            if document is None:
+                self.conn.execute("DELETE FROM documents WHERE collection = ? AND key = ?", (collection, key))
+            else:
+                row = self.conn.execute(
+                    "SELECT version FROM documents WHERE collection = ? AND key = ?", (collection, key)
+                ).fetchone()
+                self._store(collection, key, row[0] if row else 0, document)
+
+    def _send_key(self, entries):
+        """
+        Sends, in order, the writes of one document; stops at the first failure.
+
+        Returns:
+            tuple: The ids of the writes sent and of those rejected by the API.
+        """
+        sent = []
+        rejected = []
+        real_id = None
+        for entry in entries:
+            if real_id is not None:
+                # read before the insert of the logbook entry gave it its real _id
+                entry = entry[:2] + (real_id,) + entry[3:]
+            if entry[3] != "insert" and entry[2].startswith("local-"):
+                # the insert was rejected: there is no entry to update or delete
+                with self.lock, self.conn:
+                    self.conn.execute(
+                        "UPDATE outbox SET status = 'rejected', error = 'the entry was never inserted' "
+                        "WHERE id = ?",
+                        (entry[0],),
+                    )
+                rejected.append(entry[0])
+                continue
+            try:
+                real_id = self._send(entry) or real_id
+            except LocalDBError as e:
+                if e.status_code >= 500:
+                    break
+                with self.lock, self.conn:
+                    self.conn.execute(
+                        "UPDATE outbox SET status = 'rejected', error = ? WHERE id = ?", (e.message, entry[0])
+                    )
+                rejected.append(entry[0])
+                self._restore(entry[1], entry[2])
+                continue
+            except (requests.ConnectionError, requests.Timeout):
+                break
+            sent.append(entry[0])
+        return sent, rejected
+
+    def push(self, batch_size=200):
+        """
+        Sends the pending writes, up to batch_size per round, writes to different documents concurrently.
+
+        Writes rejected by the API are kept with status "rejected", and the
+        local copy of their document is replaced by the server one.
+        """
+        while True:
+            entries = self.conn.execute(
+                "SELECT id, collection, key, op, body FROM outbox WHERE status = 'pending' ORDER BY id LIMIT ?",
+                (batch_size,),
+            ).fetchall()
+            if not entries:
+                return
+            by_key = {}
+            for entry in entries:
+                by_key.setdefault((entry[1], entry[2]), []).append(entry)
+            results = self.client.map(self._send_key, by_key.values())
+            sent = [entry_id for ids, _ in results for entry_id in ids]
+            rejected = [entry_id for _, ids in results for entry_id in ids]
+            with self.lock, self.conn:
+                self.conn.executemany("DELETE FROM outbox WHERE id = ?", [(entry_id,) for entry_id in sent])
+            if len(sent) + len(rejected) < len(entries):
+                return
+
+    def sync(self):
+        """
+        Pulls the server changes, sends the pending writes and pulls again.
+
+        Returns:
+            bool: False if the API could not be reached; the writes stay queued.
+        """
+        try:
+            self.pull()
+            self.push()
+            self.pull()
+        except (requests.ConnectionError, requests.Timeout):
+            return False
+        except LocalDBError as e:
+            if e.status_code < 500:
+                raise
+            return False
+        return True
+
+    def start_sync(self, interval=10):
+        """Syncs every interval seconds on a background thread."""
+
+        def run():
+            while not self._stop.is_set():
+                self.sync()
+                self._stop.wait(interval)
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stop_sync(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    # conflicts
+
+    def pending(self):
+        return self._outbox("pending")
+
+    def conflicts(self):
+        """Returns the writes that were not sent because the document changed on the server, or were rejected."""
+        return self._outbox("conflict") + self._outbox("rejected")
+
+    def _outbox(self, status):
+        rows = self.conn.execute(
+            "SELECT id, collection, key, op, body, base_version, error FROM outbox WHERE status = ? ORDER BY id",
+            (status,),
+        )
+        return [
+            {
+                "id": row[0],
+                "collection": row[1],
+                "key": row[2],
+                "op": row[3],
+                "body": json.loads(row[4]) if row[4] is not None else None,
+                "base_version": row[5],
+                "error": row[6],
+            }
+            for row in rows
+        ]
+
+    def resolve(self, entry_id, keep_local):
+        """
+        Resolves a conflict: keep_local queues the write again on top of the
+        current server version, otherwise it is dropped and the server version stays.
+        """
+        with self.lock, self.conn:
+            if not keep_local:
+                self.conn.execute("DELETE FROM outbox WHERE id = ?", (entry_id,))
+                return
+            collection, key, op, body = self.conn.execute(
+                "SELECT collection, key, op, body FROM outbox WHERE id = ?", (entry_id,)
+            ).fetchone()
+            row = self.conn.execute(
+                "SELECT version FROM documents WHERE collection = ? AND key = ?", (collection, key)
+            ).fetchone()
+            self.conn.execute(
+                "UPDATE outbox SET status = 'pending', error = NULL, base_version = ? WHERE id = ?",
+                (row[0] if row else 0, entry_id),
+            )
+            # show the local write again
+            document = self.get(collection, key)
+            if op == "update" and document is not None:
+                self.conn.execute(
+                    "UPDATE documents SET body = ? WHERE collection = ? AND key = ?",
+                    (json.dumps(dict(document, **json.loads(body))), collection, key),
+                )
+            elif op == "delete":
+                self.conn.execute("DELETE FROM documents WHERE collection = ? AND key = ?", (collection, key))
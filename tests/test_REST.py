@@ -1,15 +1,86 @@
 import unittest
 from flask_testing import TestCase
 import sys
+import io
+import os
+import subprocess
+import time
+import base64
+import datetime
+import hashlib
+import numpy as np
+import pymongo
+import requests
+from urllib.parse import urlsplit
 
 sys.path.append("..")
 from app.flask_REST import (
     app,
+    cable_templates_cache,
+    clear_caches,
+    create_app,
+    DEFAULT_CONFIG,
     db,
+    ensure_indexes,
+    entity_extractor,
+    logbook_writer,
+    migrate_testpayloads,
+    mongo_timeout_response,
+    ReadThroughCache,
 )
 from bson import ObjectId
+import bson
+from localdb_client import BatchError, LocalDBClient, LocalDBError, decode_ndarrays, encode_ndarray
+from station_cache import StationCache
 
 
+class FlaskTestAdapter(requests.adapters.BaseAdapter):
+    """Sends the requests of a LocalDBClient to the Flask test client."""
+
+    def __init__(self, test_client):
+        super().__init__()
+        self.test_client = test_client
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        result = self.test_client.open(
+            url.path,
+            method=request.method,
+            query_string=url.query,
+            data=request.body,
+            headers=dict(request.headers),
+        )
+        response = requests.Response()
+        response.status_code = result.status_code
+        response._content = result.data
+        response.headers.update(result.headers)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+# seconds allowed to import the API module, which must not connect to MongoDB
+IMPORT_TIME_BUDGET = 2.0
+
+
+def mongo_reachable():
+    """True if the database of the API is configured and its server answers."""
+    if not DEFAULT_CONFIG["MONGO_DB_NAME"]:
+        return False
+    client = pymongo.MongoClient(DEFAULT_CONFIG["MONGO_URI"], serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        return False
+    finally:
+        client.close()
+    return True
+
+
+@unittest.skipUnless(mongo_reachable(), "needs MONGO_DB_NAME and a reachable MongoDB server")
 class TestAPI(TestCase):
     def create_app(self):
         app.config["TESTING"] = True
@@ -18,25 +89,21 @@ class TestAPI(TestCase):
         }
         return app
 
+    @classmethod
+    def setUpClass(cls):
+        ensure_indexes()
+
     def setUp(self):
-        db.modules.drop()
-        db.logbook.drop()
-        db.current_cabling_map.drop()
-        db.tests.drop()
-        db.testpayloads.drop()
-        db.cables.drop()
-        db.cables_templates.drop()
-        db.crates.drop()
-
-    def tearDown(self):
-        db.modules.drop()
-        db.logbook.drop()
-        db.current_cabling_map.drop()
-        db.tests.drop()
-        db.testpayloads.drop()
-        db.cables.drop()
-        db.cables_templates.drop()
-        db.crates.drop()
+        # emptied rather than dropped: the indexes are ensured once for the class
+        for name in db.database.list_collection_names():
+            db[name].delete_many({})
+        entity_extractor.invalidate()
+        clear_caches()
+
+    @classmethod
+    def tearDownClass(cls):
+        for name in db.database.list_collection_names():
+            db[name].drop()
 
     def test_fetch_all_modules_empty(self):
         response = self.client.get("/modules")
@@ -58,6 +125,202 @@ class TestAPI(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json["moduleID"], "INV001")
 
+    def test_query_modules(self):
+        for i, status in enumerate(["ok", "ok", "broken", "mounted"]):
+            module = {"moduleID": f"PS_{i}", "position": "cleanroom", "status": status, "overall_grade": "A"}
+            self.client.post("/modules", json=module)
+
+        query = {
+            "filter": {"status": {"$in": ["ok", "mounted"]}},
+            "sort": [["moduleID", -1]],
+            "projection": ["moduleID"],
+            "limit": 2,
+        }
+        response = self.client.post("/query/modules", json=query)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m["moduleID"] for m in response.json["results"]], ["PS_3", "PS_1"])
+        self.assertNotIn("status", response.json["results"][0])
+
+        # unindexed filters need allow_scan, other fields and operators are refused
+        query = {"filter": {"overall_grade": "A"}}
+        self.assertEqual(self.client.post("/query/modules", json=query).status_code, 400)
+        query["allow_scan"] = True
+        self.assertEqual(self.client.post("/query/modules", json=query).json["count"], 4)
+        query = {"filter": {"notes": "x"}}
+        self.assertEqual(self.client.post("/query/modules", json=query).status_code, 400)
+        query = {"filter": {"status": {"$where": "1"}}}
+        self.assertEqual(self.client.post("/query/modules", json=query).status_code, 400)
+        query = {"filter": {"moduleID": {"$in": "abc"}}}
+        self.assertEqual(self.client.post("/query/modules", json=query).status_code, 400)
+        self.assertEqual(self.client.post("/query/nothing", json={}).status_code, 404)
+        self.assertEqual(self.client.post("/query/modules", json=[]).status_code, 400)
+        self.assertEqual(self.client.post("/query/modules", json={"filter": []}).status_code, 400)
+
+    def test_explain_modules(self):
+        self.client.post("/modules", json={"moduleID": "PS_1", "position": "cleanroom", "status": "ok"})
+        self.assertEqual(self.client.get("/modules?explain=1").status_code, 403)
+
+        app.config["ADMIN_TOKEN"] = "secret"
+        try:
+            response = self.client.get("/modules?explain=1", headers={"X-Admin-Token": "wrong"})
+            self.assertEqual(response.status_code, 403)
+            response = self.client.get("/modules?explain=1", headers={"X-Admin-Token": "secret"})
+        finally:
+            app.config["ADMIN_TOKEN"] = None
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m["moduleID"] for m in response.json["result"]], ["PS_1"])
+        timings = response.json["explain"]["timings"]
+        self.assertEqual(set(timings), {"totalMs", "dbMs", "pythonMs", "serializationMs"})
+        self.assertGreater(timings["serializationMs"], 0)
+        # without explain the response is unchanged
+        self.assertEqual(len(self.client.get("/modules").json), 1)
+
+    def test_client_batch_and_paging(self):
+        localdb = LocalDBClient("http://localdb", max_workers=1, batch_size=2)
+        localdb.session.mount("http://localdb", FlaskTestAdapter(self.client))
+
+        with self.assertRaises(BatchError) as cm:
+            with localdb.batch() as batch:
+                for i in range(5):
+                    batch.insert("modules", {"moduleID": f"PS_{i}", "position": "cleanroom", "status": "ok"})
+                batch.insert("modules", {"moduleID": "PS_5", "position": "cleanroom"})
+                batch.update("modules", "PS_4", {"status": "mounted"})
+        self.assertEqual([error.status_code for _, error in cm.exception.failures], [400])
+
+        modules = list(localdb.iter_query("modules", page_size=2))
+        self.assertEqual([m["moduleID"] for m in modules], [f"PS_{i}" for i in range(5)])
+        mounted = list(localdb.iter_query("modules", {"status": "mounted"}, page_size=2))
+        self.assertEqual([m["moduleID"] for m in mounted], ["PS_4"])
+        # a caller condition on _id is kept on every page
+        start = modules[1]["_id"]
+        tail = list(localdb.iter_query("modules", {"_id": {"$gte": start}}, page_size=2))
+        self.assertEqual([m["moduleID"] for m in tail], [f"PS_{i}" for i in range(1, 5)])
+        self.assertIsNone(localdb.get("modules", "PS_9"))
+
+        # every failure is collected, not only the API errors
+        def send(i):
+            if i == 1:
+                raise ValueError("no connection")
+            return i
+
+        results = localdb.map(send, range(3), return_exceptions=True)
+        self.assertEqual(results[::2], [0, 2])
+        self.assertIsInstance(results[1], ValueError)
+
+        # a POST whose outcome is unknown is not sent again
+        localdb.backoff = 0.01
+        new_log = {"timestamp": "2023-11-03T14:21:29Z", "event": "Module added", "operator": "John Doe",
+                   "station": "pccmslab1", "sessionid": "TESTSESSION1"}
+        app.config["LOGBOOK_BUFFERED"] = True
+        app.config["LOGBOOK_WAIT_TIMEOUT"] = 0
+        try:
+            with self.assertRaises(LocalDBError) as cm:
+                localdb.call("POST", "/logbook", params={"wait": 1}, json=new_log)
+            logbook_writer.flush()
+        finally:
+            app.config["LOGBOOK_BUFFERED"] = False
+            app.config["LOGBOOK_WAIT_TIMEOUT"] = DEFAULT_CONFIG["LOGBOOK_WAIT_TIMEOUT"]
+        self.assertEqual(cm.exception.status_code, 504)
+        self.assertEqual(db.logbook.count_documents({}), 1)
+
+    def test_station_cache_sync(self):
+        localdb = LocalDBClient("http://localdb", max_workers=1)
+        localdb.session.mount("http://localdb", FlaskTestAdapter(self.client))
+        cache = StationCache(":memory:", client=localdb)
+        for i in range(2):
+            self.client.post("/modules", json={"moduleID": f"PS_{i}", "position": "cleanroom", "status": "ok"})
+        self.assertTrue(cache.sync())
+        self.assertEqual(cache.get("modules", "PS_0")["status"], "ok")
+
+        # local writes are visible at once and sent by the next sync
+        cache.update("modules", "PS_0", {"status": "mounted"})
+        cache.insert("logbook", {"timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                                 "event": "Module mounted", "operator": "John Doe", "station": "pccmslab1",
+                                 "sessionid": "S1", "involved_modules": ["PS_0"]})
+        self.assertEqual(cache.get("modules", "PS_0")["status"], "mounted")
+        self.assertEqual(len(cache.pending()), 2)
+        self.assertTrue(cache.sync())
+        self.assertEqual(self.client.get("/modules/PS_0").json["status"], "mounted")
+        self.assertEqual(cache.pending(), [])
+        self.assertEqual(len(cache.recent_logbook()), 1)
+
+        # a write based on a version changed on the server is kept as a conflict
+        cache.update("modules", "PS_1", {"status": "broken"})
+        self.client.put("/modules/PS_1", json={"status": "tested"})
+        self.assertTrue(cache.sync())
+        self.assertEqual(self.client.get("/modules/PS_1").json["status"], "tested")
+        self.assertEqual(cache.get("modules", "PS_1")["status"], "tested")
+        conflict, = cache.conflicts()
+        cache.resolve(conflict["id"], keep_local=True)
+        self.assertTrue(cache.sync())
+        self.assertEqual(self.client.get("/modules/PS_1").json["status"], "broken")
+
+        # a write refused by the API is kept, and the local copy follows the server
+        cache.insert("modules", {"moduleID": "PS_2", "position": "cleanroom"})
+        self.assertTrue(cache.sync())
+        rejected, = cache.conflicts()
+        self.assertEqual((rejected["key"], rejected["op"]), ("PS_2", "insert"))
+        self.assertIsNone(cache.get("modules", "PS_2"))
+
+    def test_station_cache_own_writes(self):
+        localdb = LocalDBClient("http://localdb", max_workers=1)
+        localdb.session.mount("http://localdb", FlaskTestAdapter(self.client))
+        self.client.post("/modules", json={"moduleID": "PS_0", "position": "cleanroom", "status": "ok"})
+        cache = StationCache(":memory:", client=localdb)
+        cache.load()
+        # the changes already read by the load are not pulled again
+        self.assertEqual(int(cache._state("token", 0)), self.client.get("/changes?latest=1").json["token"])
+
+        # a write queued while the previous one is sent is no conflict
+        cache.update("modules", "PS_0", {"status": "mounted"})
+        cache.push()
+        cache.update("modules", "PS_0", {"position": "rack"})
+        self.assertTrue(cache.sync())
+        self.assertEqual(cache.conflicts(), [])
+        module = self.client.get("/modules/PS_0").json
+        self.assertEqual((module["status"], module["position"]), ("mounted", "rack"))
+
+        # the writes queued on the temporary key of a logbook entry follow it to its real _id
+        key = cache.insert("logbook", {"timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                                       "event": "Module mounted", "operator": "John Doe",
+                                       "station": "pccmslab1", "sessionid": "S1"})
+        cache.update("logbook", key, {"event": "Module tested"})
+        self.assertTrue(cache.sync())
+        cache.update("logbook", key, {"operator": "Jane Doe"})
+        self.assertTrue(cache.sync())
+        self.assertEqual(cache.pending() + cache.conflicts(), [])
+        entry = db.logbook.find_one({"sessionid": "S1"})
+        self.assertEqual((entry["event"], entry["operator"]), ("Module tested", "Jane Doe"))
+        self.assertEqual(cache.get("logbook", key)["_id"], str(entry["_id"]))
+
+    def test_suggest_modules(self):
+        for moduleID in ["PS_40_05_IPG-00002", "PS_40_05_IPG-00001", "PS_40_05-IBA_00001", "PS_26_05-IBA_00004"]:
+            self.client.post("/modules", json={"moduleID": moduleID, "position": "cleanroom", "status": "ok"})
+
+        response = self.client.get("/modules/_suggest?prefix=PS_40_05_")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, ["PS_40_05_IPG-00001", "PS_40_05_IPG-00002"])
+        response = self.client.get("/modules/_suggest?prefix=PS_&limit=2")
+        self.assertEqual(response.json, ["PS_26_05-IBA_00004", "PS_40_05-IBA_00001"])
+        self.assertEqual(self.client.get("/modules/_suggest?prefix=XX").json, [])
+        self.assertEqual(self.client.get("/modules/_suggest?prefix=PS&limit=0").status_code, 400)
+
+        # also without the indexes
+        self.addCleanup(ensure_indexes)
+        db.modules.drop_indexes()
+        self.assertEqual(len(self.client.get("/modules/_suggest?prefix=PS_40").json), 3)
+
+    def test_import_is_lazy(self):
+        code = (
+            "import time; start = time.perf_counter(); import app.flask_REST as api; "
+            "print(time.perf_counter() - start, api.db._database is None)"
+        )
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+        elapsed, unconnected = result.stdout.split()
+        self.assertLess(float(elapsed), IMPORT_TIME_BUDGET)
+        self.assertEqual(unconnected, "True")
+
     def test_fetch_specific_module_not_found(self):
         response = self.client.get("/modules/INV999")
         self.assertEqual(response.status_code, 404)
@@ -122,6 +385,42 @@ class TestAPI(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(retrieved_test["testID"], "T001")
 
+    def test_test_results_ndarrays(self):
+        iv_scan = np.arange(12, dtype=np.float32).reshape(3, 4)
+        new_test = {
+            "testID": "T001",
+            "modules_list": ["M1"],
+            "testType": "IV",
+            "testDate": "2023-11-01",
+            "testStatus": "completed",
+            "testResults": {"iv_scan": encode_ndarray(iv_scan), "grade": "A"},
+        }
+        response = self.client.post("/tests", json=new_test)
+        self.assertEqual(response.status_code, 201)
+        stored = db.tests.find_one({"testID": "T001"})["testResults"]["iv_scan"]["__ndarray__"]
+        self.assertEqual(bytes(stored["data"]), iv_scan.tobytes())
+
+        # JSON clients get nested lists
+        response = self.client.get("/tests/T001")
+        self.assertEqual(response.json["testResults"]["iv_scan"], iv_scan.tolist())
+        self.assertEqual(response.json["testResults"]["grade"], "A")
+
+        # NumPy clients get the raw bytes
+        response = self.client.get("/tests/T001?format=bson")
+        results = decode_ndarrays(bson.decode(response.data))["testResults"]
+        np.testing.assert_array_equal(results["iv_scan"], iv_scan)
+        self.assertEqual(results["iv_scan"].dtype, np.float32)
+
+        new_test["testID"] = "T002"
+        new_test["testResults"] = {"bad": {"__ndarray__": {"dtype": "<f8", "shape": [5], "data": "AAAA"}}}
+        response = self.client.post("/tests", json=new_test)
+        self.assertEqual(response.status_code, 400)
+        # the sizes match, but no array has this shape
+        data = base64.b64encode(np.zeros(6).tobytes()).decode()
+        new_test["testResults"] = {"bad": {"__ndarray__": {"dtype": "<f8", "shape": [-2, -3], "data": data}}}
+        self.assertEqual(self.client.post("/tests", json=new_test).status_code, 400)
+        self.assertEqual(self.client.get("/tests").status_code, 200)
+
     def test_delete_test(self):
         # Delete
         new_test = {
@@ -196,6 +495,45 @@ class TestAPI(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(retrieved_module["tests"], ["T001"])
 
+    def test_test_statistics(self):
+        tests = [
+            ("T001", "Type1", "completed", "2023-11-01", ["PS_40_05_IPG-00001", "PS_40_05_IPG-00002"]),
+            ("T002", "Type1", "failed", "2023-11-01", ["PS_40_05_IPG-00003"]),
+            ("T003", "Type2", "completed", "2023-11-02", ["PS_26_05-IBA_00004"]),
+        ]
+        for testID, testType, testStatus, testDate, modules in tests:
+            new_test = {"testID": testID, "modules_list": modules, "testType": testType,
+                        "testDate": testDate, "testStatus": testStatus, "testResults": {}}
+            self.client.post("/tests", json=new_test)
+        self.client.put("/tests/T003", json={"testStatus": "failed"})
+        self.client.delete("/tests/T002")
+
+        response = self.client.get("/testStatistics")
+        self.assertEqual(response.status_code, 200)
+        statistics = response.json
+        self.assertEqual(statistics["testType"]["Type1"], {"total": 1, "status": {"completed": 1}, "fail_rate": 0.0})
+        self.assertEqual(statistics["testType"]["Type2"]["status"], {"failed": 1})
+        self.assertEqual(statistics["day"]["2023-11-01"]["total"], 1)
+        self.assertEqual(statistics["batch"]["PS_40_05_IPG"]["total"], 2)
+        self.assertEqual(statistics["batch"]["PS_26_05-IBA"]["fail_rate"], 1.0)
+        self.assertNotIn("2023-11-03", statistics["day"])
+
+        # the rollups agree with a full aggregation
+        self.assertEqual(self.client.get("/testStatistics?live=1").json, statistics)
+        response = self.client.get("/testStatistics?dimension=testStatus")
+        self.assertEqual(list(response.json), ["testStatus"])
+
+        # statuses are not taken as field paths
+        for testID, testStatus in [("T004", "retest.2"), ("T005", "$failed")]:
+            new_test = {"testID": testID, "modules_list": [], "testType": "Type3",
+                        "testDate": "2023-11-04", "testStatus": testStatus, "testResults": {}}
+            self.assertEqual(self.client.post("/tests", json=new_test).status_code, 201)
+        statistics = self.client.get("/testStatistics").json
+        self.assertEqual(statistics["testType"]["Type3"]["status"], {"retest.2": 1, "$failed": 1})
+        self.assertEqual(self.client.post("/rebuildTestStatistics").status_code, 200)
+        self.assertEqual(self.client.get("/testStatistics").json, statistics)
+        self.assertEqual(self.client.get("/testStatistics?live=1").json, statistics)
+
     def test_insert_cable_templates(self):
         cable_templates = [
             {
@@ -330,7 +668,93 @@ class TestAPI(TestCase):
         )
         self.assertTrue(connection_not_exists)
 
+    def test_batch_connect_disconnect_cables(self):
+        for name in ["Cable 1", "Cable 2", "Cable 3"]:
+            cable = {"name": name, "type": "12-to-1", "detSide": [], "crateSide": []}
+            self.client.post("/cables", json=cable)
+
+        links = [
+            {"cable1_name": "Cable 1", "cable1_port": 1, "cable1_side": "crateSide",
+             "cable2_name": "Cable 2", "cable2_port": 1},
+            {"cable1_name": "Cable 1", "cable1_port": 2, "cable1_side": "crateSide",
+             "cable2_name": "Cable 3", "cable2_port": 1},
+            # port 1 of Cable 1 is taken by the first link
+            {"cable1_name": "Cable 1", "cable1_port": 1, "cable1_side": "crateSide",
+             "cable2_name": "Cable 3", "cable2_port": 2},
+            {"cable1_name": "Cable 9", "cable1_port": 1, "cable1_side": "crateSide",
+             "cable2_name": "Cable 3", "cable2_port": 3},
+        ]
+        response = self.client.post("/batchConnectCables", json={"links": links})
+        self.assertEqual(response.status_code, 200)
+        statuses = [result["status"] for result in response.json["results"]]
+        self.assertEqual(statuses, ["connected", "connected", "error", "error"])
+
+        cable1 = self.client.get("/cables/Cable 1").json
+        cable2 = self.client.get("/cables/Cable 2").json
+        self.assertEqual(len(cable1["crateSide"]), 2)
+        self.assertEqual(cable2["detSide"], [{"port": 1, "connectedTo": cable1["_id"], "type": "cable"}])
+
+        # the port is still taken in a later batch
+        response = self.client.post("/batchConnectCables", json={"links": links[:1]})
+        self.assertEqual(response.json["results"][0]["status"], "error")
+
+        response = self.client.post("/batchDisconnectCables", json={"links": links[:2]})
+        statuses = [result["status"] for result in response.json["results"]]
+        self.assertEqual(statuses, ["disconnected", "disconnected"])
+        self.assertEqual(self.client.get("/cables/Cable 1").json["crateSide"], [])
+        self.assertEqual(self.client.get("/cables/Cable 3").json["detSide"], [])
+
+        # malformed links are reported one by one, a malformed body is rejected
+        bad = [dict(links[0], cable1_port=None), "Cable 1", dict(links[0], cable2_name=["x"])]
+        response = self.client.post("/batchConnectCables", json={"links": bad})
+        self.assertEqual(response.status_code, 200)
+        statuses = [result["status"] for result in response.json["results"]]
+        self.assertEqual(statuses, ["error", "error", "error"])
+        self.assertEqual(self.client.get("/cables/Cable 1").json["crateSide"], [])
+        self.assertEqual(self.client.post("/batchConnectCables", json=[]).status_code, 400)
+        response = self.client.post("/batchDisconnectCables", json={"links": {}})
+        self.assertEqual(response.status_code, 400)
+
+    def test_name_registry(self):
+        module = {"moduleID": "PS_1", "position": "cleanroom", "status": "readyformount"}
+        self.client.post("/modules", json=module)
+        self.client.post("/crates", json={"name": "Crate 1"})
+        self.client.post("/cables", json={"name": "Cable 1", "type": "extfib", "detSide": [], "crateSide": []})
+
+        response = self.client.post("/resolveNames", json={"names": ["PS_1", "Crate 1", "Cable 1", "nothing"]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({name: entry["type"] for name, entry in response.json.items()},
+                         {"PS_1": "module", "Crate 1": "crate", "Cable 1": "cable"})
+        self.assertEqual(response.json["Cable 1"]["_id"], self.client.get("/cables/Cable 1").json["_id"])
+
+        # names are unique across types
+        response = self.client.post("/cables", json={"name": "PS_1", "type": "extfib", "detSide": [], "crateSide": []})
+        self.assertEqual(response.status_code, 409)
+
+        # renames and deletes are followed
+        self.client.put("/cables/Cable 1", json={"name": "Cable 2"})
+        self.client.delete("/crates/Crate 1")
+        response = self.client.post("/resolveNames", json={"names": ["Crate 1", "Cable 1", "Cable 2"]})
+        self.assertEqual(list(response.json), ["Cable 2"])
+
+        # also when renaming
+        self.assertEqual(self.client.put("/cables/Cable 2", json={"name": "PS_1"}).status_code, 409)
+        self.assertEqual(self.client.put("/cables/Cable 9", json={"name": "Cable 9b"}).status_code, 200)
+        response = self.client.post("/resolveNames", json={"names": ["PS_1", "Cable 2", "Cable 9b"]})
+        self.assertEqual({name: entry["type"] for name, entry in response.json.items()},
+                         {"PS_1": "module", "Cable 2": "cable"})
+
+        response = self.client.post("/rebuildNameRegistry")
+        self.assertEqual(response.json["count"], 2)
+
+        for body in [["PS_1"], {"names": "PS_1"}, {"names": [{"$gt": ""}]}]:
+            self.assertEqual(self.client.post("/resolveNames", json=body).status_code, 400)
+        self.assertEqual(self.client.post("/extractEntities", json=["PS_1"]).status_code, 400)
+
     def test_cabling_snapshot(self):
+        # 0. Create the cable template
+        routing = {str(port): port for port in range(1, 13)}
+        self.client.post("/cable_templates", json={"type": "extfib", "internalRouting": routing})
         # 1. Create module, crate, and cables
         cables = [
             {"name": "Cable 3", "type": "extfib", "detSide": [], "crateSide": []},
@@ -445,6 +869,190 @@ class TestAPI(TestCase):
         self.assertEqual(snapshot_cable_det.json["cablingPath"], ["Cable 3", "Cable 4", "Crate 1"])
 
         # Snapshot from Cable (crateSide)
+    def test_import_cabling_map(self):
+        module = {"moduleID": "Module 1", "position": "cleanroom", "status": "readyformount"}
+        self.client.post("/modules", json=module)
+        routing = {str(port): port for port in range(1, 13)}
+        cabling_map = {
+            "cable_templates": [{"type": "extfib", "internalRouting": routing}],
+            "crates": [{"name": "Crate 1"}],
+            "cables": [
+                {
+                    "ID": "Cable 3",
+                    "Type": "extfib",
+                    "detSide": [{"port": 2, "connectedTo": "Module 1", "type": "module"}],
+                    "crateSide": [{"port": 2, "connectedTo": "Cable 4", "type": "cable"}],
+                },
+                {
+                    "ID": "Cable 4",
+                    "Type": "extfib",
+                    "detSide": [{"port": 1, "connectedTo": "Cable 3", "type": "cable"}],
+                    "crateSide": [{"port": 1, "connectedTo": "Crate 1", "type": "crate"}],
+                },
+            ],
+        }
+
+        response = self.client.post("/importCablingMap?dry_run=1", json=cabling_map)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["cables"], 2)
+        self.assertEqual(self.client.get("/cables/Cable 3").status_code, 404)
+        response = self.client.post("/importCablingMap?dry_run=maybe", json=cabling_map)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.post("/importCablingMap", json="x").status_code, 400)
+        response = self.client.post("/importCablingMap", json={"cables": {"ID": "Cable 3"}})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post("/importCablingMap?dry_run=0", json=cabling_map)
+        self.assertEqual(response.status_code, 201)
+        self.assertIn("write", response.json["timings"])
+        self.assertEqual(response.json["written"]["cables"], 2)
+        self.assertNotIn("partial", response.json)
+
+        snapshot = self.client.post(
+            "/cablingSnapshot",
+            json={"starting_point_name": "Module 1", "starting_side": "detSide"},
+        )
+        self.assertEqual(snapshot.status_code, 200)
+        self.assertEqual(snapshot.json["cablingPath"], ["Module 1", "Cable 3", "Cable 4", "Crate 1"])
+
+        # importing again conflicts with the existing cables, templates and crates
+        response = self.client.post("/importCablingMap", json=cabling_map)
+        self.assertEqual(response.status_code, 400)
+
+        # names are unique across kinds: a cable cannot take a crate name, nor a crate a cable name
+        cable = {"ID": "Crate 1", "Type": "extfib", "detSide": [], "crateSide": []}
+        response = self.client.post("/importCablingMap", json={"cables": [cable], "crates": [{"name": "Cable 3"}]})
+        self.assertEqual(response.status_code, 400)
+        messages = {error["name"]: error["message"] for error in response.json["errors"]}
+        self.assertEqual(messages["Crate 1"], "Name already used by a crate")
+        self.assertEqual(messages["Cable 3"], "Name already used by a cable")
+
+    def test_connection_snapshot_materialized(self):
+        module = {"moduleID": "Module 1", "position": "cleanroom", "status": "readyformount"}
+        self.client.post("/modules", json=module)
+        routing = {str(port): port for port in range(1, 13)}
+        cabling_map = {
+            "cable_templates": [{"type": "extfib", "internalRouting": routing}],
+            "crates": [{"name": "Crate 1"}],
+            "cables": [
+                {"ID": "Cable 3", "Type": "extfib",
+                 "detSide": [{"port": 2, "connectedTo": "Module 1", "type": "module"}],
+                 "crateSide": [{"port": 2, "connectedTo": "Cable 4", "type": "cable"}]},
+                {"ID": "Cable 4", "Type": "extfib",
+                 "detSide": [{"port": 1, "connectedTo": "Cable 3", "type": "cable"}],
+                 "crateSide": [{"port": 1, "connectedTo": "Crate 1", "type": "crate"}]},
+            ],
+        }
+        self.client.post("/importCablingMap", json=cabling_map)
+
+        response = self.client.get("/connectionSnapshot/Module 1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["Chain"], ["Module 1", "Cable 3", "Cable 4", "Crate 1"])
+        self.assertFalse(response.json["stale"])
+        response = self.client.get("/connectionSnapshot/Crate 1")
+        self.assertEqual(response.json["Chain"], ["Crate 1", "Cable 4", "Cable 3", "Module 1"])
+
+        # disconnecting the cables only recomputes the chains through them
+        link = {"cable1_name": "Cable 3", "cable1_port": 2, "cable1_side": "crateSide",
+                "cable2_name": "Cable 4", "cable2_port": 1}
+        self.client.post("/batchDisconnectCables", json={"links": [link]})
+        response = self.client.get("/connectionSnapshot/Module 1")
+        self.assertEqual(response.json["Chain"], ["Module 1", "Cable 3"])
+
+        # a status change leaves the chains alone
+        db.connection_snapshot.update_many({}, {"$set": {"stale": True}})
+        self.assertEqual(self.client.put("/modules/Module 1", json={"status": "mounted"}).status_code, 200)
+        self.assertTrue(self.client.get("/connectionSnapshot/Module 1").json["stale"])
+
+        # a template change marks every chain stale until it is read again
+        self.client.put("/cable_templates/extfib", json={"internalRouting": routing})
+        self.assertTrue(self.client.get("/connectionSnapshot/Module 1").json["stale"])
+        response = self.client.post(
+            "/cablingSnapshot",
+            json={"starting_point_name": "Module 1", "starting_side": "detSide"},
+        )
+        self.assertEqual(response.json["cablingPath"], ["Module 1", "Cable 3"])
+        self.assertFalse(self.client.get("/connectionSnapshot/Module 1").json["stale"])
+
+        response = self.client.post("/rebuildConnectionSnapshots")
+        self.assertEqual(response.json["count"], 2)
+
+    def test_cable_graph_export(self):
+        module = {"moduleID": "Module 1", "position": "cleanroom", "status": "readyformount"}
+        self.client.post("/modules", json=module)
+        cabling_map = {
+            "cable_templates": [{"type": "exapus", "internalRouting": {"1": [1, 2], "2": [3, 4]}}],
+            "crates": [{"name": "Crate 1"}],
+            "cables": [
+                {"ID": "Cable 1", "Type": "exapus",
+                 "detSide": [{"port": 1, "connectedTo": "Module 1", "type": "module"}],
+                 "crateSide": [{"port": 2, "connectedTo": "Crate 1", "type": "crate"}]},
+            ],
+        }
+        self.client.post("/importCablingMap", json=cabling_map)
+
+        response = self.client.get("/cableGraph")
+        self.assertEqual(response.status_code, 200)
+        graph = np.load(io.BytesIO(response.data))
+        self.assertEqual(list(graph["node_names"]), ["Module 1", "Crate 1", "Cable 1"])
+        self.assertEqual(list(graph["adj_indptr"]), [0, 0, 0, 2])
+        self.assertEqual(list(graph["adj_target"]), [0, 1])
+        self.assertEqual(list(graph["adj_port"]), [1, 2])
+        self.assertEqual(list(graph["adj_side"]), [0, 1])
+        self.assertEqual(list(graph["routing_in"]), [1, 1, 2, 2])
+        self.assertEqual(list(graph["routing_out"]), [1, 2, 3, 4])
+
+    def test_validate_connectivity(self):
+        routing = {str(port): port for port in range(1, 13)}
+        self.client.post("/cable_templates", json={"type": "extfib", "internalRouting": routing})
+        for name in ["Cable A", "Cable B", "Cable C", "Cable D"]:
+            self.client.post("/cables", json={"name": name, "type": "extfib", "detSide": [], "crateSide": []})
+        ids = {
+            name: ObjectId(self.client.get("/cables/" + name).json["_id"])
+            for name in ["Cable A", "Cable B", "Cable C", "Cable D"]
+        }
+
+        def conn(port, name):
+            return {"port": port, "connectedTo": ids[name], "type": "cable"}
+
+        # A -> B without the link back, port 1 of A used twice and a dangling reference
+        db.cables.update_one({"name": "Cable A"}, {"$set": {"crateSide": [
+            conn(1, "Cable B"), conn(1, "Cable C"), {"port": 3, "connectedTo": ObjectId(), "type": "cable"}]}})
+        # C and D form a loop
+        db.cables.update_one({"name": "Cable C"}, {"$set": {
+            "crateSide": [conn(5, "Cable D")], "detSide": [conn(5, "Cable D")]}})
+        db.cables.update_one({"name": "Cable D"}, {"$set": {
+            "crateSide": [conn(5, "Cable C")], "detSide": [conn(5, "Cable C")]}})
+
+        response = self.client.get("/validateConnectivity")
+        self.assertEqual(response.status_code, 200)
+        found = {(v["check"], v["name"], v["port"]) for v in response.json["violations"]}
+        self.assertIn(("dangling", "Cable A", 3), found)
+        self.assertIn(("port used twice", "Cable A", 1), found)
+        self.assertIn(("asymmetric", "Cable A", 1), found)
+        self.assertIn(("loop", "Cable C", None), found)
+        self.assertIn(("loop", "Cable D", None), found)
+        self.assertNotIn(("loop", "Cable A", None), found)
+
+        # traversing the loop terminates
+        response = self.client.post(
+            "/cablingSnapshot",
+            json={"starting_point_name": "Cable C", "starting_side": "detSide", "starting_port": 5},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["cablingPath"], ["Cable C", "Cable D"])
+
+    def test_import_cabling_map_asymmetric(self):
+        cabling_map = [
+            {"ID": "Cable 1", "Type": "extfib", "detSide": [],
+             "crateSide": [{"port": 1, "connectedTo": "Cable 2", "type": "cable"}]},
+            {"ID": "Cable 2", "Type": "extfib", "detSide": [], "crateSide": []},
+        ]
+        response = self.client.post("/importCablingMap", json=cabling_map)
+        self.assertEqual(response.status_code, 400)
+        messages = [error["message"] for error in response.json["errors"]]
+        self.assertIn("Cable 2 has no link back", messages)
+
     def test_LogBookSearchByText(self):
         new_log = {
             "timestamp": "2023-11-03T14:21:29Z",
@@ -530,6 +1138,378 @@ class TestAPI(TestCase):
         response = self.client.get("/logbook/"+_id)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.json["involved_modules"]),4)
+
+    def test_extract_entities(self):
+        self.client.post("/modules", json={"moduleID": "M_1", "position": "cleanroom", "status": "ok"})
+        self.client.post("/cables", json={"name": "Cable A", "type": "exapus", "detSide": [], "crateSide": []})
+        self.client.post("/crates", json={"name": "Crate 1", "connectedTo": None})
+
+        text = "PS_40_05_IPG-00001 and M_1 on Cable A, Crate 1 (not M_10 nor Crate 12), again PS_40_05_IPG-00001"
+        response = self.client.post("/extractEntities", json={"text": text})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json, {"module": ["PS_40_05_IPG-00001", "M_1"], "cable": ["Cable A"], "crate": ["Crate 1"]}
+        )
+
+        # the automaton is built in the background; writes are applied to it, not rebuilt in the request
+        deadline = time.monotonic() + 10
+        while (entity_extractor.automaton is None or entity_extractor.rebuilding) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        automaton = entity_extractor.automaton
+        self.assertIsNotNone(automaton)
+        self.client.post("/modules", json={"moduleID": "M_2", "position": "cleanroom", "status": "ok"})
+        self.client.delete("/modules/M_1")
+        response = self.client.post("/extractEntities", json={"text": "M_1 next to M_2"})
+        self.assertEqual(response.json["module"], ["M_2"])
+        self.assertIs(entity_extractor.automaton, automaton)
+        self.client.post("/modules", json={"moduleID": "M_1", "position": "cleanroom", "status": "ok"})
+
+        # IDs are whole tokens
+        response = self.client.post("/extractEntities", json={"text": "PS_12-fixed, xPS_3, old-PS_4 and PS_5- PS_6."})
+        self.assertEqual(response.json["module"], ["PS_12-fixed", "PS_6"])
+
+        # full IDs end up in involved_modules
+        new_log = {
+            "timestamp": "2023-10-03T14:21:29Z",
+            "event": "Module mounted",
+            "operator": "John Doe",
+            "station": "pccmslab1",
+            "sessionid": "TESTSESSION1",
+            "involved_modules": ["PS_40_05-IBA_00001"],
+            "details": "mounted PS_40_05_IPG-00001 next to M_1 and PS_40_05-IBA_00001",
+        }
+        _id = self.client.post("/logbook", json=new_log).json["_id"]
+        self.assertEqual(
+            self.client.get(f"/logbook/{_id}").json["involved_modules"],
+            ["PS_40_05-IBA_00001", "PS_40_05_IPG-00001", "M_1"],
+        )
+
+    def wait_for_job(self, job, timeout=10):
+        deadline = time.monotonic() + timeout
+        while True:
+            response = self.client.get(f"/backfillJobs/{job}")
+            if response.json["status"] != "running" or time.monotonic() > deadline:
+                return response.json
+            time.sleep(0.01)
+
+    def test_backfill_involved_modules(self):
+        logs = [
+            {"event": "old", "details": f"mounted PS_40_05_IPG-{i:05d}", "involved_modules": ["PS_40"]}
+            for i in range(5)
+        ]
+        logs.append({"event": "old", "details": "nothing", "involved_modules": []})
+        # PS_1 is a module of its own, not a truncation of PS_10
+        logs.append({"event": "old", "details": "PS_1 and PS_10", "involved_modules": ["PS_1"]})
+        db.logbook.insert_many(logs)
+
+        response = self.client.post("/backfillInvolvedModules?workers=2&batch_size=2")
+        self.assertEqual(response.status_code, 202)
+        job = self.wait_for_job(response.json["job"])
+        self.assertEqual((job["result"]["scanned"], job["result"]["updated"]), (7, 6))
+        self.assertEqual(job["ranges_done"], job["ranges_total"])
+        # the truncated ID of the old extraction is replaced by the full one
+        log = db.logbook.find_one({"details": "mounted PS_40_05_IPG-00003"})
+        self.assertEqual(log["involved_modules"], ["PS_40_05_IPG-00003"])
+        both = db.logbook.find_one({"details": "PS_1 and PS_10"})
+        self.assertEqual(both["involved_modules"], ["PS_1", "PS_10"])
+
+        # a finished job starts over, and finds nothing left to do
+        self.client.post("/backfillInvolvedModules")
+        job = self.wait_for_job("involved_modules")
+        self.assertEqual((job["result"]["scanned"], job["result"]["updated"]), (7, 0))
+
+        # a job running in another process is not started twice, unless its heartbeat stopped
+        heartbeat = datetime.datetime.now(datetime.timezone.utc)
+        db.backfill_jobs.update_one({"_id": "involved_modules"}, {"$set": {"status": "running", "heartbeat": heartbeat}})
+        self.assertEqual(self.client.post("/backfillInvolvedModules").status_code, 409)
+        heartbeat -= datetime.timedelta(hours=1)
+        db.backfill_jobs.update_one({"_id": "involved_modules"}, {"$set": {"heartbeat": heartbeat}})
+        self.assertEqual(self.client.post("/backfillInvolvedModules").status_code, 202)
+        self.assertEqual(self.wait_for_job("involved_modules")["status"], "finished")
+        self.assertEqual(self.client.get("/backfillJobs/nothing").status_code, 404)
+
+        # PUT extracts from new details too
+        _id = str(log["_id"])
+        self.client.put(f"/logbook/{_id}", json={"details": "swapped with PS_40_05-IBA_00001"})
+        self.assertEqual(self.client.get(f"/logbook/{_id}").json["involved_modules"][-1], "PS_40_05-IBA_00001")
+
+    def test_read_through_caches(self):
+        template = {"type": "exapus", "internalRouting": {"1": [1]}}
+        self.client.post("/cable_templates", json=template)
+        self.assertEqual(self.client.get("/cable_templates/exapus").json["type"], "exapus")
+
+        # served from memory: a write bypassing the API is not seen...
+        db.cable_templates.insert_one({"type": "hidden", "internalRouting": {}})
+        self.assertEqual(len(self.client.get("/cable_templates").json), 1)
+        # ...until a write through the API bumps the version
+        self.client.post("/cable_templates", json={"type": "extfib", "internalRouting": {"1": [1]}})
+        self.assertEqual(len(self.client.get("/cable_templates").json), 3)
+        self.assertEqual(db.counters.find_one({"_id": "cache:cable_templates"})["seq"], 2)
+
+        # another process sees the new version at its next check
+        db.counters.update_one({"_id": "cache:cable_templates"}, {"$inc": {"seq": 1}})
+        db.cable_templates.delete_one({"type": "hidden"})
+        cable_templates_cache.version_check = 0
+        try:
+            self.assertEqual(len(self.client.get("/cable_templates").json), 2)
+        finally:
+            cable_templates_cache.version_check = app.config["CACHE_VERSION_CHECK_SECONDS"]
+
+        for status in ["ok", "broken", "ok"]:
+            self.client.post("/modules", json={"moduleID": f"PS_{status}", "position": "cleanroom", "status": status})
+        response = self.client.get("/modules/_vocabularies")
+        self.assertEqual(response.json, {"status": ["broken", "ok"], "position": ["cleanroom"]})
+
+        # a load overtaken by an invalidation is returned but not kept
+        loads = []
+
+        def loader():
+            loads.append(len(loads))
+            if len(loads) == 1:
+                cache.invalidate()
+            return loads[-1]
+
+        cache = ReadThroughCache("test", loader, ttl=60, version_check=60)
+        self.assertEqual(cache.get(), 0)
+        self.assertEqual(cache.get(), 1)
+        self.assertEqual(cache.get(), 1)
+
+    def test_admission_control(self):
+        limits = app.extensions["localdb_admission"]
+        # take every slot of the searches and of the listings, as busy requests would
+        for group in ["search", "list"]:
+            running, waiting, seconds = app.config["ADMISSION_LIMITS"][group]
+            for _ in range(running):
+                self.assertTrue(limits[group].acquire(0))
+        app.config["ADMISSION_WAIT_SECONDS"] = 0.01
+        try:
+            response = self.client.post("/searchLogBookByText", json={"modules": "PS"})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.headers["Retry-After"], str(app.config["ADMISSION_RETRY_AFTER"]))
+            self.assertEqual(self.client.get("/modules").status_code, 503)
+
+            # writes and single documents are never held back
+            module = {"moduleID": "PS_1", "position": "cleanroom", "status": "ok"}
+            self.assertEqual(self.client.post("/modules", json=module).status_code, 201)
+            self.assertEqual(self.client.get("/modules/PS_1").status_code, 200)
+        finally:
+            app.config["ADMISSION_WAIT_SECONDS"] = 2.0
+            for group in ["search", "list"]:
+                for _ in range(app.config["ADMISSION_LIMITS"][group][0]):
+                    limits[group].release()
+        self.assertEqual(self.client.post("/searchLogBookByText", json={"modules": "PS"}).status_code, 200)
+        self.assertEqual(len(self.client.get("/modules").json), 1)
+
+        # each worker process enforces its share of the limits
+        other = create_app({"ADMISSION_WORKERS": 3, "ENSURE_INDEXES": False})
+        self.assertEqual(other.extensions["localdb_admission"]["list"].running, 2)
+        self.assertEqual(other.extensions["localdb_admission"]["maintenance"].running, 1)
+
+        # a MongoDB timeout is not a refusal: the write may have been applied
+        body, status = mongo_timeout_response()
+        self.assertEqual((status, body["outcome"]), (504, "unknown"))
+
+    def test_indexes_follow_the_database(self):
+        uri, name = db.uri, db.name
+        self.addCleanup(ensure_indexes)
+        other = create_app({"MONGO_DB_NAME": name + "_other"})
+        try:
+            other.test_client().get("/modules")
+            self.assertIn("moduleID_1", db.modules.index_information())
+            db.database.client.drop_database(name + "_other")
+        finally:
+            db.configure(uri, name)
+        # this app ensures them again on the database it moved back to
+        db.modules.drop_indexes()
+        self.client.get("/modules")
+        self.assertIn("moduleID_1", db.modules.index_information())
+
+    def test_bulk_update(self):
+        for i in range(4):
+            module = {"moduleID": f"PS_{i}", "position": "cleanroom", "status": "ok"}
+            self.client.post("/modules", json=module)
+        response = self.client.post(
+            "/bulkUpdate/modules", json={"ids": ["PS_0", "PS_1", "PS_9"], "$set": {"position": "storage"}}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, {"matched": 2, "modified": 2})
+        self.assertEqual(db.modules.count_documents({"position": "storage"}), 2)
+        changes = self.client.get("/changes").json["changes"]
+        self.assertEqual(sorted(c["key"] for c in changes if c["op"] == "update"), ["PS_0", "PS_1"])
+
+        body = {"filter": {"position": "cleanroom"}, "$set": {"status": "broken"}}
+        self.assertEqual(self.client.post("/bulkUpdate/modules", json=body).json["modified"], 2)
+        self.assertEqual(db.modules.count_documents({"status": "broken"}), 2)
+
+        # only schema fields, never the keys, and only whitelisted filters
+        for body in [
+            {"ids": ["PS_0"], "$set": {"moduleID": "PS_5"}},
+            {"ids": ["PS_0"], "$set": {"colour": "red"}},
+            {"ids": ["PS_0"], "$set": {"status": 3}},
+            {"filter": {"notes": "x"}, "$set": {"status": "ok"}},
+            {"filter": {}, "$set": {"status": "ok"}},
+            {"ids": ["PS_0"], "filter": {"status": "ok"}, "$set": {"status": "ok"}},
+        ]:
+            self.assertEqual(self.client.post("/bulkUpdate/modules", json=body).status_code, 400)
+        self.assertEqual(self.client.post("/bulkUpdate/logbook", json={}).status_code, 404)
+
+    def test_cascade_delete(self):
+        for moduleID in ["PS_1", "PS_2"]:
+            self.client.post("/modules", json={"moduleID": moduleID, "position": "cleanroom", "status": "ok"})
+        test = {
+            "testID": "T1",
+            "modules_list": ["PS_1", "PS_2"],
+            "testType": "IV",
+            "testDate": "2023-11-01",
+            "testStatus": "completed",
+            "testResults": {},
+        }
+        self.client.post("/addTest", json=test)
+        log = {
+            "timestamp": "2023-11-03T14:21:29Z",
+            "event": "Module added",
+            "operator": "John Doe",
+            "station": "pccmslab1",
+            "sessionid": "S1",
+            "involved_modules": ["PS_1", "PS_2"],
+        }
+        _id = self.client.post("/logbook", json=log).json["_id"]
+        module_id = db.modules.find_one({"moduleID": "PS_1"})["_id"]
+        db.cables.insert_one(
+            {"name": "C1", "type": "exapus", "detSide": [{"port": 1, "connectedTo": module_id, "type": "module"}], "crateSide": []}
+        )
+
+        self.assertEqual(self.client.delete("/modules/PS_1").status_code, 200)
+        self.assertEqual(db.tests.find_one({"testID": "T1"})["modules_list"], ["PS_2"])
+        self.assertEqual(self.client.get(f"/logbook/{_id}").json["involved_modules"], ["PS_2"])
+        self.assertEqual(db.cables.find_one({"name": "C1"})["detSide"], [])
+        batches = self.client.get("/testStatistics?dimension=batch").json["batch"]
+        self.assertEqual(batches["PS"]["total"], 1)
+
+        self.assertEqual(self.client.delete("/tests/T1").status_code, 200)
+        self.assertEqual(db.modules.find_one({"moduleID": "PS_2"})["tests"], [])
+        self.assertEqual(self.client.delete("/tests/T1").status_code, 404)
+
+        db.modules.update_one({"moduleID": "PS_2"}, {"$set": {"connectedTo": db.cables.find_one()["_id"]}})
+        response = self.client.post("/batchDelete/cables", json={"ids": ["C1", "C9"]})
+        self.assertEqual(response.json, {"deleted": ["C1"], "cleaned": {"modules": 1, "crates": 0, "cables": 0}})
+        self.assertNotIn("connectedTo", db.modules.find_one({"moduleID": "PS_2"}))
+        self.assertEqual(self.client.post("/batchDelete/logbook", json={"ids": []}).status_code, 404)
+        self.assertEqual(self.client.post("/batchDelete/cables", json=["C1"]).status_code, 400)
+        app.config["BATCH_DELETE_MAX_KEYS"] = 1
+        try:
+            response = self.client.post("/batchDelete/cables", json={"ids": ["C1", "C2"]})
+            self.assertEqual(response.status_code, 400)
+        finally:
+            app.config["BATCH_DELETE_MAX_KEYS"] = DEFAULT_CONFIG["BATCH_DELETE_MAX_KEYS"]
+
+    def test_changes_feed(self):
+        for moduleID in ["M1", "M2"]:
+            module = {"moduleID": moduleID, "position": "cleanroom", "status": "ok"}
+            self.client.post("/modules", json=module)
+        response = self.client.get("/changes")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json["changes"]), 2)
+        token = response.json["token"]
+
+        self.client.put("/modules/M1", json={"status": "mounted"})
+        self.client.delete("/modules/M2")
+        response = self.client.get("/changes?since=" + str(token))
+        self.assertEqual(response.status_code, 200)
+        changes = response.json["changes"]
+        self.assertEqual([(c["key"], c["op"]) for c in changes], [("M1", "update"), ("M2", "delete")])
+        self.assertEqual(changes[0]["document"]["status"], "mounted")
+        self.assertNotIn("document", changes[1])
+
+        response = self.client.get("/changes?since=" + str(response.json["token"]))
+        self.assertEqual(response.json["changes"], [])
+        token = response.json["token"]
+
+        # a seq allocated by a writer that has not inserted its change yet holds the token back
+        db.counters.update_one({"_id": "changes"}, {"$inc": {"seq": 1}})
+        self.client.put("/modules/M1", json={"status": "tested"})
+        response = self.client.get("/changes?since=" + str(token))
+        self.assertEqual((response.json["changes"], response.json["token"]), ([], token))
+        db.changes.insert_one({"seq": token + 1, "collection": "modules", "op": "update", "key": "M1"})
+        response = self.client.get("/changes?since=" + str(token))
+        self.assertEqual(response.json["token"], token + 2)
+        self.assertEqual(self.client.get("/changes?limit=-1").json["more"], True)
+
+    def test_logbook_time_window(self):
+        for station, timestamp in [
+            ("pccmslab1", "2023-11-03T14:00:00Z"),
+            ("pccmslab1", "2023-11-03T22:00:00Z"),
+            ("pccmslab2", "2023-11-03T23:00:00Z"),
+            ("pccmslab1", "2023-11-04T01:30:00+01:00"),
+            ("pccmslab1", "2023-11-04T09:00:00Z"),
+        ]:
+            new_log = {"timestamp": timestamp, "event": "Module added", "operator": "John Doe",
+                       "station": station, "sessionid": "TESTSESSION1"}
+            self.client.post("/logbook", json=new_log)
+        self.assertIsInstance(db.logbook.find_one()["timestamp"], datetime.datetime)
+
+        query = {"station": "pccmslab1", "from": "2023-11-03T20:00:00Z", "to": "2023-11-04T06:00:00Z", "limit": 1}
+        response = self.client.get("/logbook", query_string=query)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["entries"][0]["timestamp"], "2023-11-03T22:00:00Z")
+        query["after"] = response.json["next"]
+        response = self.client.get("/logbook", query_string=query)
+        self.assertEqual(response.json["entries"][0]["timestamp"], "2023-11-04T00:30:00Z")
+        self.assertIsNone(response.json["next"])
+
+        # limit or after alone page through the whole logbook
+        response = self.client.get("/logbook", query_string={"limit": 2})
+        self.assertEqual(len(response.json["entries"]), 2)
+        response = self.client.get("/logbook", query_string={"after": response.json["next"]})
+        self.assertEqual([e["timestamp"] for e in response.json["entries"]],
+                         ["2023-11-03T23:00:00Z", "2023-11-04T00:30:00Z", "2023-11-04T09:00:00Z"])
+
+        response = self.client.get("/logbook", query_string={"from": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_backfill_logbook_timestamps(self):
+        db.logbook.insert_one({"timestamp": "2023-11-03T14:21:29Z", "station": "pccmslab1"})
+        db.logbook.insert_one({"timestamp": "not a date", "station": "pccmslab1"})
+        response = self.client.post("/backfillLogbookTimestamps")
+        self.assertEqual(response.json, {"converted": 1, "invalid": 1})
+        log = db.logbook.find_one({"station": "pccmslab1", "timestamp": {"$type": "date"}})
+        self.assertEqual(log["timestamp"], datetime.datetime(2023, 11, 3, 14, 21, 29))
+
+    def test_insert_log_buffered(self):
+        app.config["LOGBOOK_BUFFERED"] = True
+        try:
+            new_log = {
+                "timestamp": "2023-11-03T14:21:29Z",
+                "event": "Module added",
+                "operator": "John Doe",
+                "station": "pccmslab1",
+                "sessionid": "TESTSESSION1",
+                "details": "mounted PS_7",
+            }
+            response = self.client.post("/logbook?wait=1", json=new_log)
+            self.assertEqual(response.status_code, 201)
+            _id = response.json["_id"]
+
+            response = self.client.post("/logbook", json=new_log)
+            self.assertEqual(response.status_code, 202)
+            response = self.client.post("/logbook?wait=0", json=new_log)
+            self.assertEqual(response.status_code, 202)
+            response = self.client.post("/logbook?wait=maybe", json=new_log)
+            self.assertEqual(response.status_code, 400)
+
+            # a requested wait that times out is not reported as queued
+            app.config["LOGBOOK_WAIT_TIMEOUT"] = 0
+            response = self.client.post("/logbook?wait=true", json=new_log)
+            self.assertEqual(response.status_code, 504)
+            logbook_writer.flush()
+        finally:
+            app.config["LOGBOOK_BUFFERED"] = False
+            app.config["LOGBOOK_WAIT_TIMEOUT"] = DEFAULT_CONFIG["LOGBOOK_WAIT_TIMEOUT"]
+
+        response = self.client.get("/logbook/" + _id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["involved_modules"], ["PS_7"])
+
 #################
     def test_insert_get_delete_testpayload(self):
         new_log = {
@@ -549,6 +1529,62 @@ class TestAPI(TestCase):
         response = self.client.delete("/testpayloads/"+str(_id))
         self.assertEqual(response.status_code, 200)
 
+    def test_migrate_testpayloads(self):
+        # where the API wrote the payloads before they had their own collection
+        legacy = db.tests.insert_one({"sessionID": "testsession000", "remoteFileList": []}).inserted_id
+        db.tests.insert_one({"testID": "T1", "sessionID": "testsession000", "remoteFileList": []})
+        self.assertEqual(migrate_testpayloads(), 1)
+        self.assertEqual(self.client.get(f"/testpayloads/{legacy}").status_code, 200)
+        self.assertEqual(db.tests.count_documents({}), 1)
+        self.assertEqual(migrate_testpayloads(), 0)
+
+    def test_testpayload_files(self):
+        payload = {"sessionID": "testsession000", "remoteFileList": []}
+        _id = self.client.post("/testpayloads", json=payload).json["_id"]
+        content = bytes(range(256)) * 5000
+
+        response = self.client.post(
+            f"/testpayloads/{_id}/files/iv_scan.bin",
+            data=content,
+            headers={"X-Checksum-SHA256": hashlib.sha256(content).hexdigest()},
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json["length"], len(content))
+
+        response = self.client.post(f"/testpayloads/{_id}/files/bad.bin", data=content,
+                                    headers={"X-Checksum-SHA256": "0" * 64})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(f"/testpayloads/{_id}/files/iv_scan.bin", data=b"again")
+        self.assertEqual(response.status_code, 409)
+        # enforced by the index too, for uploads racing past the check
+        with self.assertRaises(pymongo.errors.DuplicateKeyError):
+            db["payload_files.files"].insert_one({"filename": "iv_scan.bin", "metadata": {"payload": ObjectId(_id)}})
+
+        response = self.client.get(f"/testpayloads/{_id}/files")
+        self.assertEqual([f["filename"] for f in response.json], ["iv_scan.bin"])
+
+        response = self.client.get(f"/testpayloads/{_id}/files/iv_scan.bin")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, content)
+
+        response = self.client.get(f"/testpayloads/{_id}/files/iv_scan.bin",
+                                   headers={"Range": "bytes=1000-1999"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, content[1000:2000])
+        self.assertEqual(response.headers["Content-Range"], f"bytes 1000-1999/{len(content)}")
+
+        app.config["PAYLOAD_MAX_FILE_SIZE"] = 1000
+        try:
+            response = self.client.post(f"/testpayloads/{_id}/files/big.bin", data=content)
+            self.assertEqual(response.status_code, 413)
+        finally:
+            app.config["PAYLOAD_MAX_FILE_SIZE"] = 2**30
+
+        self.client.delete("/testpayloads/" + _id)
+        self.assertEqual(db["payload_files.files"].count_documents({}), 0)
+
+
 
 
 